@@ -1,54 +1,57 @@
 from collections import defaultdict, Counter
 from statistics import mean, pstdev
-from utils.helpers import is_toc_page
+
+import numpy as np
+
+from utils.helpers import toc_pages
+from utils.line_table import require_table
 
 class HierarchyAnalysisAgent:
     def __init__(self, processed_data, visual_features=None, text_features=None):
-        self.structure_data = processed_data
+        self.structure_data = require_table(processed_data)
         self.visual = visual_features
         self.text = text_features
 
-    def score_line(self, line, font_size_stats):
-        score = 0
-        size = line["font_size"]
+    def score_lines(self, rows, font_size_stats):
+        """Heading scores of the given LineTable rows, one array operation per rule"""
+        lines = self.structure_data
+        score = np.zeros(len(rows))
+        size = lines.font_size[rows]
         mean_size = font_size_stats["mean"]
         std_size = font_size_stats["std"]
-        text = line["text"].strip()
+        texts = [lines.text[row].strip() for row in rows]
+        lowered = [text.lower() for text in texts]
+
+        def flags(test, values=texts):
+            return np.fromiter((test(text) for text in values), dtype=bool, count=len(values))
 
         # Normalize font size (z-score)
         if std_size > 0:
             z_score = (size - mean_size) / std_size
             score += z_score * 2
-        if line.get("bold"): score += 1.0
-        if line["bbox"][1] < 200: score += 0.75
-        if line.get("ocr"): score -= 0.5
+        score[lines.bold[rows]] += 1.0
+        score[lines.bbox[rows, 1] < 200] += 0.75
+        score[lines.ocr[rows]] -= 0.5
 
         # Word count scoring
-        wc = len(text.split())
-        if 2 <= wc <= 10:
-            score += 0.5
-        elif wc > 20:
-            score -= 1.0
-        elif wc <= 1:
-            score -= 0.5
+        wc = lines.word_count[rows]
+        score[(2 <= wc) & (wc <= 10)] += 0.5
+        score[wc > 20] -= 1.0
+        score[wc <= 1] -= 0.5
 
         # Penalize colon-ended labels (form fields)
-        if text.endswith(":"):
-            score -= 0.8
-        
+        score[flags(lambda text: text.endswith(":"))] -= 0.8
+
         # Penalize very long sentences (likely content, not headings)
-        if wc > 15:
-            score -= 1.5
-        
+        score[wc > 15] -= 1.5
+
         # Boost for section-like keywords
         section_keywords = ['pathway', 'options', 'goals', 'mission', 'regular', 'distinction']
-        if any(keyword in text.lower() for keyword in section_keywords):
-            score += 1.0
-        
+        score[flags(lambda text: any(keyword in text for keyword in section_keywords), lowered)] += 1.0
+
         # Penalize mission statements and long descriptive text
-        if text.lower().startswith('mission statement') or text.lower().startswith('to provide'):
-            score -= 2.0
-            
+        score[flags(lambda text: text.startswith(('mission statement', 'to provide')), lowered)] -= 2.0
+
         return score
 
     def determine_levels(self, top_lines):
@@ -63,8 +66,8 @@ class HierarchyAnalysisAgent:
         return levels
 
     def is_form_like(self):
-        p1_lines = [l for l in self.structure_data if l["page"] == 1]
-        if len(p1_lines) < 5:
+        p1_rows = self.structure_data.rows_of_page(1)
+        if len(p1_rows) < 5:
             return False
 
         numbered_questions = 0
@@ -75,8 +78,8 @@ class HierarchyAnalysisAgent:
             'application form', 'grant of', 'government servant', 'advance required'
         ]
 
-        for line in p1_lines:
-            text = line["text"].strip().lower()
+        for row in p1_rows:
+            text = self.structure_data.text[row].strip().lower()
             if text.strip() and text.strip()[0].isdigit() and '.' in text[:5]:
                 numbered_questions += 1
             for keyword in form_keyword_patterns:
@@ -86,48 +89,44 @@ class HierarchyAnalysisAgent:
 
         return form_keywords >= 5
 
+    def first_page_title(self):
+        """Text of the largest line on page 1, the first such line on ties"""
+        p1_rows = self.structure_data.rows_of_page(1)
+        if not len(p1_rows):
+            return ""
+        title_row = p1_rows[np.argmax(self.structure_data.font_size[p1_rows])]
+        return self.structure_data.text[title_row].strip()
+
     def rank_headings(self):
-        if not self.structure_data:
+        lines = self.structure_data
+        if not len(lines):
             return {"title": "", "outline": []}
 
         if self.is_form_like():
-            p1_lines = [l for l in self.structure_data if l["page"] == 1]
-            title = ""
-            if p1_lines:
-                title_candidate = max(p1_lines, key=lambda x: x["font_size"])
-                title = title_candidate["text"].strip()
             return {
-                "title": title,
+                "title": self.first_page_title(),
                 "outline": []
             }
 
-        font_sizes = [line["font_size"] for line in self.structure_data]
+        font_sizes = lines.font_size.tolist()
         font_size_stats = {
             "mean": mean(font_sizes),
             "std": pstdev(font_sizes) if len(font_sizes) > 1 else 1.0
         }
 
-        scored = []
-        for line in self.structure_data:
-            if is_toc_page(self.structure_data, line["page"]):
-                continue
-            score = self.score_line(line, font_size_stats)
-            scored.append((score, line))
+        rows = np.flatnonzero(~np.isin(lines.page, list(toc_pages(lines))))
+        scores = self.score_lines(rows, font_size_stats)
 
-        scored.sort(reverse=True, key=lambda x: x[0])
+        # Stable, so equal scores keep line order as list.sort(reverse=True) did
+        ranked = rows[np.argsort(-scores, kind="stable")]
 
-        top_k = max(5, int(0.05 * len(scored)))
-        top_lines = [line for score, line in scored[:top_k]]
+        top_k = max(5, int(0.05 * len(rows)))
+        top_lines = [lines[row] for row in ranked[:top_k]]
 
         level_map = self.determine_levels(top_lines)
 
-        p1_lines = [l for l in self.structure_data if l["page"] == 1]
-        title = ""
-        title_text = ""
-        if p1_lines:
-            title_candidate = max(p1_lines, key=lambda x: x["font_size"])
-            title = title_candidate["text"].strip()
-            title_text = title
+        title = self.first_page_title()
+        title_text = title
 
         outline = []
         seen = set()
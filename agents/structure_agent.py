@@ -2,39 +2,203 @@
 import re
 import statistics
 import json
-from PIL import Image
-import pytesseract
+import os
+from contextlib import ExitStack
 import fitz
+from utils.columnar import ColumnarResults, is_columnar
+from utils.page_context import DocumentContext, render_scale
+from utils.ocr_pool import ocr_pages, uses_workers
+from utils.pdf_source import open_document, pdf_source
+from utils.worker_pool import LazyPool
+
+TITLE_TYPES = {"doc_title", "paragraph_title", "table_title"}
+# Detections whose regions are OCRed in "roi" mode
+ROI_TYPES = {"doc_title", "paragraph_title"}
+# Unset: up to 4 processes for the per-page pass, like the OCR pool
+STRUCTURE_WORKERS = int(os.environ["STRUCTURE_WORKERS"]) if os.environ.get("STRUCTURE_WORKERS") else min(4, os.cpu_count() or 1)
+# Shorter documents stay in this process, starting workers and parsing pages again would cost more
+PARALLEL_MIN_PAGES = 64
+
+# Long-lived workers for the per-page pass
+_pool = LazyPool(STRUCTURE_WORKERS)
+
+
+def shutdown():
+    _pool.shutdown()
+
+
+def _extract_page_range(source, all_elements, first_page, ocr_mode, views=None, reused=None):
+    """Worker task: the per-page pass over pages first_page.. of the document at source
+    (a path or SharedPDF); all_elements holds just those page entries, views the
+    pages of the range the caller had already parsed, reused its unchanged pages."""
+    pdf_doc = open_document(source)
+    try:
+        agent = StructureAnalysisAgent(all_elements, pdf_doc, DocumentContext(pdf_doc, views=views), ocr_mode=ocr_mode)
+        agent.reused = reused or {}
+        return agent._extract_pages(agent._iter_pages(), first_page)
+    finally:
+        pdf_doc.close()
 
 class StructureAnalysisAgent:
-    def __init__(self, all_elements_path, pdf_path):
+    def __init__(self, all_elements_path, pdf_path, context=None, ocr_mode="page", workers=None, previous_pages=None,
+                 source=None):
+        """all_elements_path may also be the all-elements dict itself and pdf_path an
+        open fitz.Document, so results can come straight from the model in memory.
+        context is that document's DocumentContext when an earlier stage already parsed pages.
+        ocr_mode "roi" OCRs only the detected title boxes of low-text pages, "page" the whole page.
+        workers > 1 splits the per-page pass of long documents into page ranges run in processes.
+        previous_pages is utils.incremental.load_structure_pages() of an earlier run: pages whose
+        hash is in it take their lines from there, without reading the text layer or OCR.
+        source is where worker processes open the document (a path or SharedPDF) when the caller
+        already has one, e.g. from utils.pdf_source.pdf_source."""
         self.all_elements_path = all_elements_path
         self.pdf_path = pdf_path
 
-        with open(all_elements_path, "r", encoding="utf-8") as f:
-            self.all_elements = json.load(f)
+        if isinstance(all_elements_path, (dict, ColumnarResults)):
+            self.all_elements = all_elements_path
+        # Columnar results are read lazily, page by page and only the title elements
+        elif is_columnar(all_elements_path):
+            self.all_elements = ColumnarResults(all_elements_path)
+        else:
+            with open(all_elements_path, "r", encoding="utf-8") as f:
+                self.all_elements = json.load(f)
+
+        # A document passed in stays open, it belongs to the caller
+        self._owns_doc = not isinstance(pdf_path, fitz.Document)
+        self.fitz_doc = fitz.open(pdf_path) if self._owns_doc else pdf_path
+        self.context = context or DocumentContext(self.fitz_doc)
+        self.ocr_mode = ocr_mode
+        self.workers = STRUCTURE_WORKERS if workers is None else workers
+        document = self.all_elements.document if isinstance(self.all_elements, ColumnarResults) else self.all_elements
+        self.dpi = document.get("dpi", 55)
+        # {page number: content hash} when the model stage recorded them
+        self.page_hashes = document.get("page_hashes") or {}
+        self.previous_pages = previous_pages or {}
+        # {page number: saved record} of the unchanged pages, and after extract_structure
+        # {content hash: record} of every hashed page, to save for the next run
+        self.reused = {}
+        self.page_records = {}
+        self.source = source
+        self._worker_source = None
 
-        self.fitz_doc = fitz.open(pdf_path)
+    def _iter_pages(self):
+        if isinstance(self.all_elements, ColumnarResults):
+            for entry_index in range(len(self.all_elements)):
+                yield {"elements": self.all_elements.page_elements(entry_index, TITLE_TYPES)}
+        else:
+            yield from self.all_elements["pages"]
+
+    def _page_count(self):
+        if isinstance(self.all_elements, ColumnarResults):
+            return len(self.all_elements)
+        return len(self.all_elements["pages"])
 
     def extract_structure(self):
-        structure_data = []
-        page_sources = ""
+        self.reused = {
+            int(page): self.previous_pages[content_hash]
+            for page, content_hash in self.page_hashes.items() if content_hash in self.previous_pages
+        }
+        if self.reused:
+            print(f"♻️ {len(self.reused)}/{self._page_count()} pages unchanged, reusing their structure lines")
+
+        # The structure pass and OCR share one worker source, see _get_worker_source
+        self._worker_source = self.source
+        with ExitStack() as sources:
+            if self.workers > 1 and self._page_count() - len(self.reused) >= PARALLEL_MIN_PAGES:
+                page_entries, ocr_page_nums, ocr_regions, page_kinds = self._extract_parallel(
+                    self._get_worker_source(sources)
+                )
+            else:
+                page_entries, ocr_page_nums, ocr_regions, page_kinds = self._extract_pages(self._iter_pages())
+
+            if ocr_page_nums:
+                source = self._get_worker_source(sources) if uses_workers(len(ocr_page_nums)) else None
+                ocr_results = ocr_pages(self.fitz_doc, source, ocr_page_nums,
+                                        regions={page_num: list(regions) for page_num, regions in ocr_regions.items()})
+                for page_num, lines in ocr_results.items():
+                    page_entries[page_num].extend(self._ocr_entries(lines, page_num + 1, ocr_regions.get(page_num)))
+        self._worker_source = None
+
+        self.page_records = {
+            self.page_hashes[str(page)]: {"source": kind, "entries": entries}
+            for page, (kind, entries) in enumerate(zip(page_kinds, page_entries), start=1)
+            if str(page) in self.page_hashes
+        }
+
+        structure_data = [entry for entries in page_entries for entry in entries]
+        # The last page that decided a source decides it for the document
+        page_sources = next((kind for kind in reversed(page_kinds) if kind), "")
+        return structure_data, page_sources
+
+    def _get_worker_source(self, sources):
+        """The path or SharedPDF workers open the document from: the caller's source if given,
+        else made on first need and kept open on sources, so a document without a file
+        behind it is copied into shared memory at most once per extract_structure"""
+        if self._worker_source is None:
+            _, self._worker_source = sources.enter_context(pdf_source(self.fitz_doc))
+        return self._worker_source
+
+    def _extract_parallel(self, source):
+        """_extract_pages over contiguous page ranges in worker processes, merged in page order"""
+        # Workers only need the title elements, the rest of the detections stay here
+        pages = [
+            {"elements": [el for el in page["elements"] if el.get("type") in TITLE_TYPES]}
+            for page in self._iter_pages()
+        ]
+        chunk = -(-len(pages) // self.workers)
+        print(f"🧱 Structure pass over {len(pages)} pages on {self.workers} workers...")
+
+        page_entries, ocr_page_nums, ocr_regions, page_kinds = [], [], {}, []
+        pool = _pool.get()
+        futures = [
+            pool.submit(_extract_page_range, source, {"dpi": self.dpi, "pages": pages[start:start + chunk]},
+                        start + 1, self.ocr_mode, self.context.parsed_views(range(start, start + chunk)),
+                        {page: record for page, record in self.reused.items() if start < page <= start + chunk})
+            for start in range(0, len(pages), chunk)
+        ]
+        for future in futures:
+            entries, ocr_nums, regions, kinds = future.result()
+            page_entries.extend(entries)
+            ocr_page_nums.extend(ocr_nums)
+            ocr_regions.update(regions)
+            page_kinds.extend(kinds)
+        return page_entries, ocr_page_nums, ocr_regions, page_kinds
+
+    def _extract_pages(self, pages, first_page=1):
+        """Per-page pass over page entries numbered from first_page.
 
+        Returns the entries of each page, the 0-based pages left for OCR with their
+        ROI regions, and each page's source ("doc_title", "ocr_fallback" or "").
+        """
+        # One list of entries per page; OCR pages are filled in once all of them are known
+        page_entries = []
+        ocr_page_nums = []
+        ocr_regions = {}
+        page_kinds = []
 
-        for i, page_elements in enumerate(self.all_elements["pages"], start=1):
-            page = self.fitz_doc[i - 1]
-            blocks = page.get_text("dict")["blocks"]
-            text_lines = sum(len(b.get("lines", [])) for b in blocks if b.get("type") == 0)
+
+        for i, page_elements in enumerate(pages, start=first_page):
+            if i in self.reused:
+                record = self.reused[i]
+                page_entries.append([{**entry, "page": i} for entry in record["entries"]])
+                page_kinds.append(record["source"])
+                continue
+
+            structure_data = []
+            page_entries.append(structure_data)
+            page_kinds.append("")
+            # Pages are parsed on demand: one with title elements never needs its text layer
+            page_context = self.context[i - 1]
 
             # If text-based elements exist
             page_text_elements = [
                 el for el in page_elements["elements"]
-                if el.get("type") in {"doc_title", "paragraph_title", "table_title"}
+                if el.get("type") in TITLE_TYPES
                 and (el.get("text") or "").strip()
             ]
 
             if page_text_elements:
-                page_sources="doc_title"
+                page_kinds[-1] = "doc_title"
                 span_sizes = [el["font_size"] for el in page_text_elements if "font_size" in el]
                 median_size = statistics.median(span_sizes) if span_sizes else 12
 
@@ -58,77 +222,87 @@ class StructureAnalysisAgent:
                         "is_heading": True,
                         "type":     el["type"]
                     })
-            elif text_lines < 15:
-                page_sources="ocr_fallback"
-                # 🔁 New OCR fallback logic with heading check
-                pix = page.get_pixmap(dpi=300)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                ocr_text = pytesseract.image_to_string(img)
-
-                for idx, line in enumerate(ocr_text.splitlines()):
-                    line = self._normalize_ocr_text(line)
-                    if not line:
-                        continue
-                    structure_data.append({
-                        "text":      line,
-                        "font_size": 16,
-                        "font":      "OCR",
-                        "bold":      False,
-                        "italic":    False,
-                        "bbox":      [0, idx * 20, pix.width, (idx + 1) * 20],
-                        "page":      i,
-                        "ocr":       True,
-                        "is_heading": self._is_likely_heading(line),
-                        "type":      "ocr_text"
-                    })
+            elif page_context.line_count < 15:
+                page_kinds[-1] = "ocr_fallback"
+                # 🔁 OCR fallback with heading check, run for all such pages at once below
+                ocr_page_nums.append(i - 1)
+                if self.ocr_mode == "roi":
+                    regions = self._roi_regions(page_elements, page_context)
+                    # No heading boxes on the page: read all of it
+                    if regions:
+                        ocr_regions[i - 1] = regions
                 continue
             else:
-                span_sizes = []
-                for block in blocks:
-                    if block.get("type") != 0:
-                        continue
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            span_sizes.append(span["size"])
+                span_sizes = [span["size"] for span in page_context.spans]
                 if not span_sizes:
                     continue
 
                 median_size = statistics.median(span_sizes)
 
-                for block in blocks:
-                    if block.get("type") != 0:
-                        continue
-                    for line in block["lines"]:
-                        text = " ".join(s["text"] for s in line["spans"]).strip()
-                        if not text:
-                            continue
-
-                        span0 = line["spans"][0]
-                        size = span0["size"]
-                        font = span0["font"]
-                        is_bold = "bold" in font.lower()
-                        is_italic = "italic" in font.lower()
-                        bbox = line["bbox"]
-
-                        is_heading = (
-                            size >= median_size + 1 and
-                            len(text) < 100 and
-                            (is_bold or is_italic or re.match(r'^(\d+[\.\)]?\s*)?([A-Z][a-z]+\s*){1,6}$', text))
-                        )
-
-                        structure_data.append({
-                            "text":      text,
-                            "font_size": size,
-                            "font":      font,
-                            "bold":      is_bold,
-                            "italic":    is_italic,
-                            "bbox":      bbox,
-                            "page":      i,
-                            "ocr":       False,
-                            "is_heading": is_heading
-                        })
+                for line in page_context.lines:
+                    text = line["text"]
+                    size = line["size"]
+                    font = line["font"]
+                    is_bold = "bold" in font.lower()
+                    is_italic = "italic" in font.lower()
+                    bbox = line["bbox"]
 
-        return structure_data, page_sources
+                    # A bool, not the re.Match, so the records can come back from worker processes
+                    is_heading = bool(
+                        size >= median_size + 1 and
+                        len(text) < 100 and
+                        (is_bold or is_italic or re.match(r'^(\d+[\.\)]?\s*)?([A-Z][a-z]+\s*){1,6}$', text))
+                    )
+
+                    structure_data.append({
+                        "text":      text,
+                        "font_size": size,
+                        "font":      font,
+                        "bold":      is_bold,
+                        "italic":    is_italic,
+                        "bbox":      bbox,
+                        "page":      i,
+                        "ocr":       False,
+                        "is_heading": is_heading
+                    })
+
+        return page_entries, ocr_page_nums, ocr_regions, page_kinds
+
+    def _roi_regions(self, page_elements, page_context):
+        """{rect in PDF points: label} for the page's doc_title / paragraph_title detections"""
+        # Element bboxes are pixels at the document dpi, whatever size the page was rendered at
+        scale_x, scale_y = render_scale(page_context.rect, self.dpi)
+        regions = {}
+        for el in page_elements["elements"]:
+            if el.get("type") in ROI_TYPES:
+                x0, y0, x1, y1 = el.get("bbox", [0, 0, 0, 0])
+                regions[(x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y)] = el["type"]
+        return regions
+
+    def _ocr_entries(self, lines, page, regions=None):
+        """Structure entries for one page's OCR lines, bboxes in PDF points.
+
+        regions maps the rects of an ROI read to their labels; those entries are
+        headings by detection rather than by the text heuristic.
+        """
+        entries = []
+        for text, bbox, _ in lines:
+            line = self._normalize_ocr_text(text)
+            if not line:
+                continue
+            entries.append({
+                "text":      line,
+                "font_size": 16,
+                "font":      "OCR",
+                "bold":      False,
+                "italic":    False,
+                "bbox":      bbox,
+                "page":      page,
+                "ocr":       True,
+                "is_heading": True if regions else self._is_likely_heading(line),
+                "type":      regions.get(tuple(bbox), "ocr_text") if regions else "ocr_text"
+            })
+        return entries
 
     def _normalize_ocr_text(self, text):
         text = re.sub(r'(\b\w)\s(\w\b)', r'\1\2', text)
@@ -145,5 +319,5 @@ class StructureAnalysisAgent:
         return False
 
     def __del__(self):
-        if hasattr(self, 'fitz_doc'):
+        if hasattr(self, 'fitz_doc') and self._owns_doc:
             self.fitz_doc.close()
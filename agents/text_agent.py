@@ -1,24 +1,32 @@
-
 import re
+
+import numpy as np
+
 from utils.helpers import detect_language
+from utils.line_table import require_table
 
 class TextAnalysisAgent:
     def __init__(self, structure_data):
-        self.data = structure_data
-       
-        sample_text = " ".join(item["text"] for item in self.data if item["page"] == 1 and len(item["text"]) > 20)
+        self.data = require_table(structure_data)
+
+        sample_text = " ".join(self.data.text[row] for row in self.data.rows_of_page(1) if len(self.data.text[row]) > 20)
         self.language = detect_language(sample_text) if sample_text else "unknown"
 
     def analyze_text(self):
         num_pattern = re.compile(r"^\d+(\.\d+)*\s")
-        for item in self.data:
-            text = item["text"]
-            item["is_numbered"] = bool(num_pattern.match(text))
-            
+        texts = self.data.text
+        count = len(texts)
+
+        def flags(test):
+            return np.fromiter((test(text) for text in texts), dtype=bool, count=count)
+
+        def is_uppercase(text):
             words = [w for w in text.split() if len(w) > 3]
-            item["is_uppercase"] = any(w.isupper() for w in words) if words else text.isupper()
-            item["is_short"] = len(text.split()) < 5
-            
-            item["language"] = self.language
-            
-        return self.data
\ No newline at end of file
+            return any(w.isupper() for w in words) if words else text.isupper()
+
+        self.data.set_feature("is_numbered", flags(lambda text: num_pattern.match(text) is not None))
+        self.data.set_feature("is_uppercase", flags(is_uppercase))
+        self.data.set_feature("is_short", self.data.word_count < 5)
+        self.data.set_feature("language", self.language)
+
+        return self.data
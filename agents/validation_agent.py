@@ -2,10 +2,12 @@
 from collections import Counter
 import re
 
+from utils.line_table import require_table
+
 class ValidationAgent:
     def __init__(self, headings, all_structure):
         self.headings = headings
-        self.all_structure = all_structure
+        self.all_structure = require_table(all_structure)
 
     def validate(self):
         def clean_spacing(txt):
@@ -13,18 +15,20 @@ class ValidationAgent:
             txt = re.sub(r'\s{2,}', ' ', txt)
             return txt.strip()
 
-        def is_poster_like_page(page_data):
-            return any(x.get("ocr", False) for x in page_data)
+        lines = self.all_structure
 
         try:
-            pages = sorted({x["page"] for x in self.all_structure})
+            page_rows = lines.page_rows()
+            pages = list(page_rows)
             final_outline = []
             final_title = ""
 
             # TITLE
-            page1 = [x for x in self.all_structure if x["page"] == 1 and not x.get("ocr", False)]
+            p1_rows = lines.rows_of_page(1)
+            page1 = [lines[row] for row in p1_rows[~lines.ocr[p1_rows]]]
             if page1:
-                valid_fr_items = [x for x in page1 if isinstance(x.get("font_ratio"), (int, float))]
+                # font_ratio comes from VisualAnalysisAgent
+                valid_fr_items = page1 if "font_ratio" in lines.features else []
                 if valid_fr_items:
                     max_fr = max(x["font_ratio"] for x in valid_fr_items)
                     cands = [x for x in valid_fr_items if x["font_ratio"] >= max_fr * 0.9]
@@ -40,11 +44,16 @@ class ValidationAgent:
                 "introduction", "conclusion", "appendix", "overview", "revision history"
             ]
 
+            headings_by_page = {}
+            for h in self.headings:
+                headings_by_page.setdefault(h["page"], []).append(h)
+
             for pg in pages:
-                page_data = [x for x in self.all_structure if x["page"] == pg]
+                rows = page_rows[pg]
 
-                if is_poster_like_page(page_data):
-                    ocr_lines = [x for x in page_data if x.get("ocr", False)]
+                # Poster-like page: any OCR line on it
+                if lines.ocr[rows].any():
+                    ocr_lines = [lines[row] for row in rows[lines.ocr[rows]]]
                     mixed = [x for x in ocr_lines if re.search(r"[a-z]", x["text"])]
                     candidates = mixed if mixed else ocr_lines
                     if not candidates:
@@ -60,7 +69,7 @@ class ValidationAgent:
                         print(f"[ERROR] Poster fallback failed on page {pg}: {e}")
                     continue
 
-                page_headings = [h for h in self.headings if h["page"] == pg]
+                page_headings = headings_by_page.get(pg, [])
                 texts = [clean_spacing(h["text"]) for h in page_headings]
                 counts = Counter(texts)
                 page_headings = [
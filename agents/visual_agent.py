@@ -1,27 +1,49 @@
-
 from statistics import mean
 
+import numpy as np
+
+from utils.line_table import require_table
+
 class VisualAnalysisAgent:
     def __init__(self, structure_data):
-        self.data = structure_data
+        self.data = require_table(structure_data)
 
     def analyze_visual(self):
-        page_fonts = {}
-        for item in self.data:
-            page_fonts.setdefault(item["page"], []).append(item["font_size"])
-        page_mean = {p: mean(sizes) for p, sizes in page_fonts.items()}
-
-        y_positions = {}
-        for item in self.data:
-            y_positions.setdefault(item["page"], []).append(item["bbox"][1])
-
-        for item in self.data:
-            p = item["page"]
-            item["font_ratio"] = item["font_size"] / page_mean.get(p, item["font_size"])
-            y_list = sorted(y_positions[p])
-            idx = y_list.index(item["bbox"][1])
-            prev_gap = item["bbox"][1] - y_list[idx-1] if idx > 0 else None
-            next_gap = y_list[idx+1] - item["bbox"][1] if idx < len(y_list)-1 else None
-            item["is_isolated"] = ((prev_gap and prev_gap > item["font_size"]*1.2)
-                                   or (next_gap and next_gap > item["font_size"]*1.2))
+        """Adds font_ratio (size over the page mean) and is_isolated (a gap above
+        or below larger than 1.2 x the font size) to the LineTable"""
+        if not len(self.data):
+            return self.data
+
+        sizes = self.data.font_size
+        ys = self.data.bbox[:, 1]
+        pages = self.data.page
+
+        page_mean = np.empty(len(self.data))
+        for rows in self.data.page_rows().values():
+            page_sizes = sizes[rows]
+            # statistics.mean is exact; a page of one size needs no summing
+            page_mean[rows] = page_sizes[0] if page_sizes.min() == page_sizes.max() else mean(page_sizes.tolist())
+        font_ratio = sizes / page_mean
+
+        # Lines ordered by page, then height; each line's neighbours are looked up
+        # from the first line at its height, as list.index found it
+        order = np.lexsort((ys, pages))
+        sorted_pages, sorted_ys = pages[order], ys[order]
+        position = np.arange(len(order))
+        new_page = np.r_[True, sorted_pages[1:] != sorted_pages[:-1]]
+        new_height = new_page | np.r_[True, sorted_ys[1:] != sorted_ys[:-1]]
+        first = np.maximum.accumulate(np.where(new_height, position, 0))
+        page_start = np.maximum.accumulate(np.where(new_page, position, 0))
+        page_end = np.r_[np.flatnonzero(new_page)[1:], len(order)][np.cumsum(new_page) - 1]
+
+        limit = sizes[order] * 1.2
+        has_prev = first > page_start
+        has_next = first < page_end - 1
+        prev_gap = sorted_ys - sorted_ys[np.maximum(first - 1, 0)]
+        next_gap = sorted_ys[np.minimum(first + 1, len(order) - 1)] - sorted_ys
+        is_isolated = np.empty(len(self.data), dtype=bool)
+        is_isolated[order] = (has_prev & (prev_gap > limit)) | (has_next & (next_gap > limit))
+
+        self.data.set_feature("font_ratio", font_ratio)
+        self.data.set_feature("is_isolated", is_isolated)
         return self.data
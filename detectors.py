@@ -0,0 +1,209 @@
+import os
+
+import numpy as np
+
+MODEL_NAME = "PP-DocLayout-L"
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), MODEL_NAME)
+DEFAULT_BACKEND = "paddle"
+# (width, height) every page is resized to before inference, Resize target_size in inference.yml
+MODEL_INPUT_SIZE = (640, 640)
+# Set in the fork server's environment when workers share one loaded copy of the weights
+PRELOAD_ENV = "LAYOUT_PRELOAD_BACKEND"
+PRELOAD_THREADS_ENV = "LAYOUT_PRELOAD_THREADS"
+
+# {(name, cpu_threads): backend} loaded before this process forked its workers
+_preloaded = {}
+
+
+def default_backend_name():
+    return os.environ.get("LAYOUT_BACKEND", DEFAULT_BACKEND)
+
+
+def _read_image(image):
+    """Inputs follow the paddle convention: an image path or an HxWx3 BGR array. Returns RGB."""
+    if isinstance(image, str):
+        from PIL import Image
+        with Image.open(image) as img:
+            return np.asarray(img.convert("RGB"))
+    return np.ascontiguousarray(image[:, :, ::-1])
+
+
+class LayoutBackend:
+    """Common surface of the detectors: predict() mirrors paddleocr.LayoutDetection.
+
+    A single input gives a one-element list, a list of inputs gives one result per
+    input in the same order. Each result is {'boxes': [{'cls_id', 'label', 'score',
+    'coordinate'}]} with coordinates in the input image's pixels.
+    """
+
+    name = None
+
+    def predict(self, inputs, batch_size=1):
+        raise NotImplementedError
+
+
+class PaddleBackend(LayoutBackend):
+    name = "paddle"
+
+    def __init__(self, cpu_threads=None):
+        from paddleocr import LayoutDetection
+
+        if cpu_threads:
+            self.model = LayoutDetection(model_name=MODEL_NAME, cpu_threads=cpu_threads)
+        else:
+            self.model = LayoutDetection(model_name=MODEL_NAME)
+
+    def predict(self, inputs, batch_size=1):
+        return self.model.predict(inputs, batch_size=batch_size)
+
+
+class OnnxBackend(LayoutBackend):
+    """PP-DocLayout-L exported with paddle2onnx, run on ONNX Runtime's CPU provider.
+
+    Export once with:
+        paddle2onnx --model_dir PP-DocLayout-L --model_filename inference.json
+                    --params_filename inference.pdiparams --save_file PP-DocLayout-L/inference.onnx
+    Pre/post-processing follows PP-DocLayout-L/inference.yml.
+    """
+
+    name = "onnx"
+
+    def __init__(self, cpu_threads=None, model_path=None):
+        import onnxruntime as ort
+        import yaml
+
+        model_path = model_path or os.environ.get("LAYOUT_ONNX_PATH", os.path.join(MODEL_DIR, "inference.onnx"))
+        with open(os.path.join(MODEL_DIR, "inference.yml"), "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+
+        resize = next(step for step in config["Preprocess"] if step["type"] == "Resize")
+        self.target_h, self.target_w = resize["target_size"]
+        self.labels = config["label_list"]
+        self.threshold = config.get("draw_threshold", 0.5)
+
+        options = ort.SessionOptions()
+        if cpu_threads:
+            options.intra_op_num_threads = cpu_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _preprocess(self, image):
+        from PIL import Image
+
+        rgb = _read_image(image)
+        h, w = rgb.shape[:2]
+        resized = Image.fromarray(rgb).resize((self.target_w, self.target_h), Image.BICUBIC)
+        # NormalizeImage with norm_type none only rescales to [0, 1]
+        tensor = np.asarray(resized, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return tensor, (h, w)
+
+    def _run(self, images):
+        tensors, sizes = zip(*(self._preprocess(image) for image in images))
+        feed = {"image": np.stack(tensors)}
+        if "im_shape" in self.input_names:
+            feed["im_shape"] = np.array([[self.target_h, self.target_w]] * len(images), dtype=np.float32)
+        if "scale_factor" in self.input_names:
+            feed["scale_factor"] = np.array(
+                [[self.target_h / h, self.target_w / w] for h, w in sizes], dtype=np.float32
+            )
+
+        boxes, counts = self.session.run(None, feed)[:2]
+
+        results = []
+        offset = 0
+        for (h, w), count in zip(sizes, counts):
+            page_boxes = []
+            for cls_id, score, x1, y1, x2, y2 in boxes[offset:offset + int(count)]:
+                if score < self.threshold:
+                    continue
+                page_boxes.append({
+                    "cls_id": int(cls_id),
+                    "label": self.labels[int(cls_id)],
+                    "score": float(score),
+                    "coordinate": [
+                        float(np.clip(x1, 0, w)), float(np.clip(y1, 0, h)),
+                        float(np.clip(x2, 0, w)), float(np.clip(y2, 0, h))
+                    ]
+                })
+            results.append({"boxes": page_boxes})
+            offset += int(count)
+        return results
+
+    def predict(self, inputs, batch_size=1):
+        images = inputs if isinstance(inputs, list) else [inputs]
+        results = []
+        for i in range(0, len(images), max(1, batch_size)):
+            results.extend(self._run(images[i:i + max(1, batch_size)]))
+        return results
+
+
+class StubBackend(LayoutBackend):
+    """Deterministic fixed layout so the pipeline can be benchmarked and tested without paddle.
+
+    Every page gets the same boxes, placed relative to the image size.
+    """
+
+    name = "stub"
+
+    # (cls_id, label, score, (x1, y1, x2, y2) as fractions of the page)
+    BOXES = (
+        (11, "doc_title", 0.91, (0.10, 0.06, 0.90, 0.12)),
+        (0, "paragraph_title", 0.83, (0.10, 0.16, 0.60, 0.20)),
+        (2, "text", 0.95, (0.10, 0.21, 0.90, 0.45)),
+        (0, "paragraph_title", 0.78, (0.10, 0.48, 0.60, 0.52)),
+        (2, "text", 0.94, (0.10, 0.53, 0.90, 0.88)),
+        (15, "footer", 0.71, (0.10, 0.93, 0.90, 0.96)),
+    )
+
+    def __init__(self, cpu_threads=None):
+        pass
+
+    def predict(self, inputs, batch_size=1):
+        images = inputs if isinstance(inputs, list) else [inputs]
+        results = []
+        for image in images:
+            h, w = _read_image(image).shape[:2] if isinstance(image, str) else image.shape[:2]
+            results.append({"boxes": [
+                {
+                    "cls_id": cls_id,
+                    "label": label,
+                    "score": score,
+                    "coordinate": [x1 * w, y1 * h, x2 * w, y2 * h]
+                }
+                for cls_id, label, score, (x1, y1, x2, y2) in self.BOXES
+            ]})
+        return results
+
+
+BACKENDS = {
+    PaddleBackend.name: PaddleBackend,
+    OnnxBackend.name: OnnxBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def load_backend(name=None, cpu_threads=None):
+    name = name or default_backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown layout backend '{name}', expected one of {sorted(BACKENDS)}")
+    if (name, cpu_threads) in _preloaded:
+        return _preloaded[(name, cpu_threads)]
+    return BACKENDS[name](cpu_threads=cpu_threads)
+
+
+def is_preloaded(name=None, cpu_threads=None):
+    return (name or default_backend_name(), cpu_threads) in _preloaded
+
+
+def preload_backend(name=None, cpu_threads=None):
+    """Load a backend once in this process. Processes forked from it afterwards get it
+    from load_backend without reading the weights again, sharing the pages copy-on-write."""
+    name = name or default_backend_name()
+    if (name, cpu_threads) not in _preloaded:
+        _preloaded[(name, cpu_threads)] = BACKENDS[name](cpu_threads=cpu_threads)
+    return _preloaded[(name, cpu_threads)]
+
+
+# The fork server imports this module with PRELOAD_ENV set, see FastPDFProcessor(share_weights=True)
+if os.environ.get(PRELOAD_ENV):
+    preload_backend(os.environ[PRELOAD_ENV], int(os.environ.get(PRELOAD_THREADS_ENV) or 0) or None)
@@ -2,6 +2,9 @@
 import os
 import json
 import time
+import multiprocessing as mp
+
+import fitz
 
 # Import all necessary custom agents
 from agents.structure_agent import StructureAnalysisAgent
@@ -11,34 +14,169 @@ from agents.hierarchy_agent import HierarchyAnalysisAgent as HierarchyAgent
 from agents.validation_agent import ValidationAgent
 from agents.TitleClassifier import AdvancedTitleClassifier   
 from utils.helpers import get_pdf_files, log
+from utils.incremental import load_structure_pages, save_structure_pages, structure_pages_path
+from utils.line_table import LineTable
+from utils.page_context import DocumentContext
+from utils.pdf_source import pdf_source
+from model import FastPDFProcessor
 
 
 INPUT_DIR = "input"
 OUTPUT_DIR = "output"
+# Unset: use the host profile saved by `model.py --autotune`, else the processor default
+MODEL_WORKERS = int(os.environ["MODEL_WORKERS"]) if os.environ.get("MODEL_WORKERS") else None
+MODEL_DPI = 55
+# Let pages with a decisive text layer skip layout inference (see utils/page_router.py)
+ROUTE_PAGES = os.environ.get("ROUTE_PAGES") == "1"
+# Reuse detections of pages seen before (see utils/layout_cache.py), off unless set
+LAYOUT_CACHE_DIR = os.environ.get("LAYOUT_CACHE_DIR")
+# Load the model once and fork the workers from it instead of loading it per worker
+SHARE_WEIGHTS = os.environ.get("SHARE_WEIGHTS") == "1"
+# Memory ceiling in MB for the model stage; pages then stream to disk as they finish (see model.py --max_memory_mb)
+MAX_MEMORY_MB = int(os.environ["MAX_MEMORY_MB"]) if os.environ.get("MAX_MEMORY_MB") else None
+# Earlier output folder to reuse unchanged pages from (needs PAGE_HASHES=1 on that run); also records hashes
+PREVIOUS_OUTPUT_DIR = os.environ.get("PREVIOUS_OUTPUT_DIR")
+PAGE_HASHES = os.environ.get("PAGE_HASHES") == "1" or bool(PREVIOUS_OUTPUT_DIR)
+# Per-label duplicate-box suppression before text extraction, e.g. "0.5" or "0.5,doc_title=0.3" (see utils/box_nms.py)
+NMS_IOU = os.environ.get("NMS_IOU") or None
+# "roi" OCRs only the detected heading boxes of low-text pages, "page" the whole page (see utils/ocr_pool.py)
+OCR_MODE = os.environ.get("OCR_MODE", "page")
+# "columnar" writes the model results as memory-mapped .cols directories the agents read lazily (see utils/columnar.py)
+INTERMEDIATE_FORMAT = os.environ.get("INTERMEDIATE_FORMAT", "json")
+RESULTS_EXTENSION = ".cols" if INTERMEDIATE_FORMAT == "columnar" else ".json"
+# "streaming" overlaps inference, extraction and the agents; "phased" runs the model on every PDF first
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "streaming")
+
+
+def processor_kwargs_from_env(**overrides):
+    """FastPDFProcessor keyword arguments from the settings above; overrides win"""
+    kwargs = dict(max_workers=MODEL_WORKERS, in_memory=True, route_pages=ROUTE_PAGES, cache_dir=LAYOUT_CACHE_DIR,
+                  share_weights=SHARE_WEIGHTS, max_memory_mb=MAX_MEMORY_MB, page_hashes=PAGE_HASHES,
+                  intermediate=INTERMEDIATE_FORMAT, nms_iou=NMS_IOU)
+    kwargs.update(overrides)
+    return kwargs
 
 def get_all_elements_path(pdf_path):
     # Now: input/abc.pdf --> output/abc_all_elements_result.json
     base = os.path.splitext(os.path.basename(pdf_path))[0]
-    return os.path.join("output", f"{base}_all_elements_results.json")
+    return os.path.join("output", f"{base}_all_elements_results{RESULTS_EXTENSION}")
+
 
+def get_previous_path(pdf_path):
+    """The previous run's all-elements file for this PDF, if there is one"""
+    if not PREVIOUS_OUTPUT_DIR:
+        return None
+    base = os.path.splitext(os.path.basename(pdf_path))[0]
+    previous_path = os.path.join(PREVIOUS_OUTPUT_DIR, f"{base}_all_elements_results{RESULTS_EXTENSION}")
+    return previous_path if os.path.exists(previous_path) else None
 
-import subprocess
 
-def run_model_on_pdf(pdf_path):
+def run_model_on_pdf(processor, pdf_path):
     """
-    Call model.py on a single PDF file.
-    This will execute: python model.py pdf_path
-    Adjust the command if your model.py requires different arguments.
+    Run layout inference on a single PDF in-process.
+    The processor keeps its worker pool (and the model loaded in each worker)
+    warm between calls, so only the first PDF pays the startup cost.
     """
     try:
-        subprocess.run(
-            ["python", "model.py", pdf_path],
-            check=True  # This raises an error if the model fails
-        )
-    except subprocess.CalledProcessError as e:
+        previous = get_previous_path(pdf_path)
+        if processor.max_memory_bytes:
+            processor.process_pdf_bounded(pdf_path, output_dir=OUTPUT_DIR, dpi=MODEL_DPI, previous=previous)
+        else:
+            processor.process_pdf_dual_output(pdf_path, output_dir=OUTPUT_DIR, dpi=MODEL_DPI, previous=previous)
+    except Exception as e:
         print(f"Model failed for {pdf_path}: {e}")
 
 
+def build_outline(all_elements, pdf, context=None, previous_structure=None, structure_path=None, source=None):
+    """Run the agent chain on one PDF's model output and return its outline.
+
+    all_elements is the all-elements results (dict or file path), pdf the open
+    fitz.Document or its path, context its already parsed pages if any.
+    previous_structure is an earlier run's _structure_pages.json to take unchanged
+    pages' lines from; structure_path is where this run's are saved, when pages are hashed.
+    source is the workers' handle on pdf from utils.pdf_source.pdf_source, if the caller has one.
+    """
+    structure_agent = StructureAnalysisAgent(all_elements, pdf, context, ocr_mode=OCR_MODE,
+                                             previous_pages=load_structure_pages(previous_structure, OCR_MODE),
+                                             source=source)
+    structure_data, page_sources = structure_agent.extract_structure()
+    if structure_path and structure_agent.page_records:
+        save_structure_pages(structure_path, OCR_MODE, structure_agent.page_records)
+    
+
+    # Classification step
+    if page_sources == "doc_title":
+        classifier = AdvancedTitleClassifier(structure_data, max_levels=4)
+        classified_titles = classifier.classify()
+
+    else:
+        # One LineTable for the whole chain, each agent adds its feature columns to it
+        lines = LineTable.from_records(structure_data)
+        del structure_data
+
+        visual_agent = VisualAnalysisAgent(lines)
+        visual_features = visual_agent.analyze_visual()
+
+
+        text_agent = TextAnalysisAgent(lines)
+        text_features = text_agent.analyze_text()
+
+
+        hierarchy_agent = HierarchyAgent(lines, visual_features, text_features)
+        analysis = hierarchy_agent.rank_headings()
+        headings = analysis["outline"]
+
+
+        validation_agent = ValidationAgent(headings, lines)
+        classified_titles = validation_agent.validate()
+
+    return classified_titles
+
+
+def extract_outline(pdf, processor=None, dpi=MODEL_DPI, name=None):
+    """Outline of a PDF given as bytes, an open fitz.Document or a path, all in memory.
+
+    The model results go straight to the agents instead of through
+    output/*_all_elements_results.json. Pass a long-lived FastPDFProcessor to
+    keep its worker pool warm between calls; otherwise one is started and
+    stopped for this PDF.
+    """
+    if processor is None:
+        # Nothing is written in memory, so no page hashes or memory ceiling
+        with FastPDFProcessor(**processor_kwargs_from_env(max_memory_mb=None, page_hashes=False)) as processor:
+            return extract_outline(pdf, processor, dpi, name)
+
+    with pdf_source(pdf) as (pdf_doc, source):
+        # Pages the model stage parsed are not parsed again by the agents
+        context = processor.document_context(pdf_doc)
+        all_elements, _ = processor.process_document(pdf_doc, dpi=dpi, name=name, source=source)
+        return build_outline(all_elements, pdf_doc, context, source=source)
+
+
+def classify_pdf(file_path, all_elements_path=None, views=None):
+    """Run the agent chain on one PDF's model output and write its _classified.json.
+
+    views are the pages another process already parsed (DocumentContext.parsed_views()).
+    """
+    filename = os.path.basename(file_path)
+    all_elements_path = all_elements_path or get_all_elements_path(file_path)
+    # Unchanged pages reuse the previous run's structure lines, OCR included
+    previous_path = get_previous_path(file_path)
+    structure_paths = (previous_path and structure_pages_path(previous_path), structure_pages_path(all_elements_path))
+    if views:
+        with fitz.open(file_path) as pdf_doc:
+            classified_titles = build_outline(all_elements_path, pdf_doc, DocumentContext(pdf_doc, views=views),
+                                              *structure_paths)
+    else:
+        classified_titles = build_outline(all_elements_path, file_path, None, *structure_paths)
+
+    output_path = os.path.join(OUTPUT_DIR, filename.replace(".pdf", "_classified.json"))
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(classified_titles, f, indent=2, ensure_ascii=False)
+
+    return output_path
+
+
 def extract_structure_for_all_pdfs(pdf_files):
     for file_path in pdf_files:
         filename = os.path.basename(file_path)
@@ -52,35 +190,7 @@ def extract_structure_for_all_pdfs(pdf_files):
                 log(f"❌ Missing all_elements_result.json for {filename} (expected at {all_elements_path})")
                 continue
 
-            structure_agent = StructureAnalysisAgent(all_elements_path, file_path)
-            structure_data, page_sources = structure_agent.extract_structure()
-            
-
-            # Classification step
-            if page_sources == "doc_title":
-                classifier = AdvancedTitleClassifier(structure_data, max_levels=4)
-                classified_titles = classifier.classify()
-
-            else:
-                visual_agent = VisualAnalysisAgent(structure_data)
-                visual_features = visual_agent.analyze_visual()
-
-
-                text_agent = TextAnalysisAgent(structure_data)
-                text_features = text_agent.analyze_text()
-
-
-                hierarchy_agent = HierarchyAgent(structure_data, visual_features, text_features)
-                analysis = hierarchy_agent.rank_headings()
-                headings = analysis["outline"]
-
-
-                validation_agent = ValidationAgent(headings, structure_data)
-                classified_titles = validation_agent.validate()
-
-            output_path = os.path.join(OUTPUT_DIR, filename.replace(".pdf", "_classified.json"))
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(classified_titles, f, indent=2, ensure_ascii=False)
+            classify_pdf(file_path, all_elements_path)
 
             end_time = time.time()
             duration = end_time - start_time
@@ -96,9 +206,31 @@ def main():
 
     log(f"📂 Found {len(pdf_files)} PDFs in input folder.")
 
-    # STEP 1: Run model on all PDFs, one by one (SEQUENTIALLY)
-    for pdf_path in pdf_files:
-        run_model_on_pdf(pdf_path)
+    # The streaming pipeline holds each document until its last page is in, so a ceiling means phased
+    if PIPELINE_MODE == "streaming" and MAX_MEMORY_MB:
+        log(f"🧯 MAX_MEMORY_MB={MAX_MEMORY_MB} set, running the model and the agents in phases")
+
+    if PIPELINE_MODE == "streaming" and not MAX_MEMORY_MB:
+        from pipeline import StreamingPipeline
+
+        with FastPDFProcessor(**processor_kwargs_from_env()) as processor:
+            pipeline = StreamingPipeline(processor, classify_pdf, output_dir=OUTPUT_DIR, dpi=MODEL_DPI,
+                                         previous_fn=get_previous_path)
+            pipeline.run(pdf_files)
+            processor.report_worker_memory()
+            processor.report_cache()
+            processor.report_nms()
+
+        log("🏁 All PDFs processed.")
+        return
+
+    # STEP 1: Run model on all PDFs, one by one, sharing one warm worker pool
+    with FastPDFProcessor(**processor_kwargs_from_env()) as processor:
+        for pdf_path in pdf_files:
+            run_model_on_pdf(processor, pdf_path)
+        processor.report_worker_memory()
+        processor.report_cache()
+        processor.report_nms()
 
     # Confirm that all model outputs are present before proceeding
     missing = [f for f in pdf_files if not os.path.exists(get_all_elements_path(f))]
@@ -112,4 +244,5 @@ def main():
     log("🏁 All PDFs processed.")
 
 if __name__ == "__main__":
+    mp.set_start_method("spawn", force=True)
     main()
@@ -1,32 +1,73 @@
-from paddleocr import LayoutDetection
 from PIL import Image
 import fitz  
+import numpy as np
 import os
 import json
+import shutil
+import tempfile
 from datetime import datetime
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor
+import queue
+from utils.page_context import DocumentContext, render_scale
+from utils.page_router import PageRouter, TEXT_LAYER
+from utils.layout_cache import DEFAULT_MAX_BYTES, LayoutCache, to_plain_output
+from utils.page_stream import PageStream, write_json_document
+from utils.cpu_topology import candidate_configs, core_sets, load_profile, pin_process, save_profile
+from utils.proc_memory import process_memory
+from utils.shards import merge_shard_files, page_range_label, parse_page_spec, shard_suffix
+from utils.incremental import load_previous_pages, page_content_hash, renumber
+from utils.columnar import COLUMNAR_SUFFIX, write_columnar
+from utils.pdf_source import open_document, pdf_source
+from utils.box_nms import parse_iou_thresholds, suppress_duplicates
+from detectors import (BACKENDS, MODEL_INPUT_SIZE, MODEL_NAME, PRELOAD_ENV, PRELOAD_THREADS_ENV,
+                       default_backend_name, is_preloaded, load_backend)
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import gc
+import time
 
 os.environ['OMP_NUM_THREADS'] = '2'
 os.environ['MKL_NUM_THREADS'] = '2'
 
 _model_instance = None
+_cpu_threads = None
+_backend_name = None
+_layout_cache = None
 
 def get_shared_model():
     """Load model once and reuse - biggest speedup"""
     global _model_instance
-    if _model_instance is None:
-        print("🔧 Loading layout detection model...")
-        _model_instance = LayoutDetection(model_name="PP-DocLayout-L")
+    if _model_instance is None or _model_instance.name != (_backend_name or default_backend_name()):
+        # Backends import their runtime lazily, so orchestrators that only drive the pool never load paddle
+        if is_preloaded(_backend_name, _cpu_threads):
+            print(f"🔗 Using the {_backend_name or default_backend_name()} model preloaded by the fork server")
+        else:
+            print(f"🔧 Loading layout detection model ({_backend_name or default_backend_name()} backend)...")
+        _model_instance = load_backend(_backend_name, cpu_threads=_cpu_threads)
 
 
     return _model_instance
 
-def _init_worker():
-    os.environ['OMP_NUM_THREADS'] = '1'
-    os.environ['MKL_NUM_THREADS'] = '1'
+def _init_worker(threads=1, backend=None, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES, core_queue=None,
+                 reopen_every=None, memory_queue=None):
+    global _cpu_threads, _backend_name, _layout_cache, _worker_reopen_every, _memory_queue
+    # Each worker takes its own CPU set before the runtime sizes its thread pools
+    if core_queue is not None:
+        try:
+            pin_process(core_queue.get_nowait())
+        except queue.Empty:
+            pass
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
     os.environ['FLAGS_use_mkldnn'] = '1'
+    if threads > 1:
+        _cpu_threads = threads
+    _backend_name = backend
+    if cache_dir:
+        _layout_cache = LayoutCache(cache_dir, cache_max_bytes)
+    _worker_reopen_every = reopen_every
+    _memory_queue = memory_queue
     get_shared_model()
 
 
@@ -35,19 +76,279 @@ def process_single_image_optimized(img_path):
     model = get_shared_model()
     try:
         output = model.predict(img_path, batch_size=1)
+        _report_warm_memory()
         return img_path, output, True
     except Exception as e:
         print(f"❌ Error processing {img_path}: {e}")
         return img_path, [], False
 
 
+_worker_doc = None
+_worker_doc_path = None
+_worker_doc_uses = 0
+# Reopen the document after this many calls and empty MuPDF's store, so memory stays flat (memory-capped runs)
+_worker_reopen_every = None
+# Where the worker reports its memory once warm; cleared once it has
+_memory_queue = None
+
+
+def _report_warm_memory():
+    """Put (pid, {"rss", "pss"}) on the processor's queue after the worker's first batch,
+    when the model is loaded and the runtime has run once"""
+    global _memory_queue
+    if _memory_queue is not None:
+        _memory_queue.put((os.getpid(), process_memory(os.getpid())))
+        _memory_queue = None
+
+def _get_worker_document(pdf_path):
+    """Open the PDF once per worker and keep it around for the next page.
+
+    pdf_path is a path or a utils.pdf_source.SharedPDF for PDFs that only exist in memory.
+    """
+    global _worker_doc, _worker_doc_path, _worker_doc_uses
+    if _worker_doc_path != pdf_path or (_worker_reopen_every and _worker_doc_uses >= _worker_reopen_every):
+        if _worker_doc is not None:
+            _worker_doc.close()
+            if _worker_reopen_every:
+                fitz.TOOLS.store_shrink(100)
+        _worker_doc = open_document(pdf_path)
+        _worker_doc_path = pdf_path
+        _worker_doc_uses = 0
+    _worker_doc_uses += 1
+    return _worker_doc
+
+
+def pixmap_to_array(pix):
+    """HxWxC view of the pixmap samples, channels flipped to BGR.
+
+    paddlex treats ndarray inputs like cv2-decoded images (BGR), so this is
+    what it would have seen after reading the PNG back from disk. The flip is a
+    negative-stride view, so no copy is made here; the pixels are copied once,
+    where the detector's preprocessing makes them contiguous (detectors._read_image).
+    """
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    return samples.reshape(pix.height, pix.width, pix.n)[:, :, 2::-1]
+
+
+def render_page(page, dpi=55, target_size=None):
+    """Pixmap at a fixed DPI, or stretched straight to the detector's input size.
+
+    Returns the pixmap and its exact (scale_x, scale_y) in PDF points per pixel.
+    """
+    if target_size:
+        width, height = target_size
+        matrix = fitz.Matrix(width / page.rect.width, height / page.rect.height)
+    else:
+        matrix = fitz.Matrix(dpi / 72, dpi / 72)
+    pix = page.get_pixmap(matrix=matrix)
+    return pix, (page.rect.width / pix.width, page.rect.height / pix.height)
+
+
+def _top_score(output):
+    scores = [box.get('score', 0) for det_result in output for box in det_result.get('boxes', [])]
+    return max(scores) if scores else 0.0
+
+
+def _infer_pages(model, doc, page_nums, render):
+    """Render and infer pages, re-rendering low-confidence pages at a higher DPI if asked to.
+
+    render is a DPI or a dict with dpi / target_size / escalate_below / escalate_dpi.
+    Returns [(page_num, output, success, scale, cached)], where scale is None for
+    plain fixed-DPI renders (the document's dpi already describes them) and cached
+    is None when the worker has no layout cache, else whether the page was a hit.
+    """
+    options = render if isinstance(render, dict) else {"dpi": render}
+    dpi = options.get("dpi", 55)
+    target_size = options.get("target_size")
+
+    # Keep the pixmaps referenced until predict returns, the arrays are views into them
+    rendered = [render_page(doc.load_page(page_num), dpi, target_size) for page_num in page_nums]
+    results = [None] * len(page_nums)
+    keys = [None] * len(page_nums)
+    todo = list(range(len(page_nums)))
+
+    if _layout_cache is not None:
+        todo = []
+        for i, (pix, _) in enumerate(rendered):
+            keys[i] = LayoutCache.make_key(pix, MODEL_NAME, model.name, options)
+            entry = _layout_cache.get(keys[i])
+            if entry is not None:
+                scale = tuple(entry["scale"]) if entry["scale"] else None
+                results[i] = (entry["output"], True, scale, True)
+            else:
+                todo.append(i)
+
+    if todo:
+        outputs = _predict_batch(model, [pixmap_to_array(rendered[i][0]) for i in todo])
+        for i, (output, success) in zip(todo, outputs):
+            results[i] = (output, success, rendered[i][1] if target_size else None, False)
+    rendered = None
+
+    escalate_below = options.get("escalate_below")
+    low = [i for i in todo if results[i][1] and _top_score(results[i][0]) < escalate_below] if escalate_below is not None else []
+    if low:
+        escalate_dpi = options.get("escalate_dpi", ESCALATE_DPI)
+        retry = [render_page(doc.load_page(page_nums[i]), escalate_dpi) for i in low]
+        retried = _predict_batch(model, [pixmap_to_array(pix) for pix, _ in retry])
+        for i, (_, scale), (output, success) in zip(low, retry, retried):
+            if success and _top_score(output) > _top_score(results[i][0]):
+                print(f"🔍 Page {page_nums[i]+1}: re-rendered at {escalate_dpi} DPI")
+                results[i] = (output, success, scale, False)
+        retry = None
+
+    if _layout_cache is not None:
+        for i in todo:
+            output, success, scale, _ = results[i]
+            if success:
+                _layout_cache.put(keys[i], {"output": to_plain_output(output), "scale": scale})
+
+    return [
+        (page_num, output, success, scale, (cached if _layout_cache is not None else None))
+        for page_num, (output, success, scale, cached) in zip(page_nums, results)
+    ]
+
+
+def process_single_page_in_memory(pdf_path, page_num, dpi):
+    """Render one page in the worker and run inference on the pixel buffer"""
+    model = get_shared_model()
+    try:
+        page_result = _infer_pages(model, _get_worker_document(pdf_path), [page_num], dpi)[0]
+        _report_warm_memory()
+        return page_result
+    except Exception as e:
+        print(f"❌ Error processing page {page_num+1} of {pdf_path}: {e}")
+        return page_num, [], False, None, None
+
+
+def _predict_batch(model, inputs):
+    """One predict call for the whole batch; retry page by page if the batch fails"""
+    try:
+        outputs = list(model.predict(inputs, batch_size=len(inputs)))
+        if len(outputs) == len(inputs):
+            return [([output], True) for output in outputs]
+        print(f"⚠️ Batch returned {len(outputs)} results for {len(inputs)} pages, retrying one by one")
+    except Exception as e:
+        print(f"⚠️ Batch of {len(inputs)} failed ({e}), retrying one by one")
+
+    results = []
+    for image in inputs:
+        try:
+            results.append((model.predict(image, batch_size=1), True))
+        except Exception as e:
+            print(f"❌ Error processing page: {e}")
+            results.append(([], False))
+    return results
+
+
+def process_image_batch(img_paths):
+    """Batched variant of process_single_image_optimized"""
+    model = get_shared_model()
+    start = time.perf_counter()
+    outputs = _predict_batch(model, list(img_paths))
+    elapsed = time.perf_counter() - start
+    _report_warm_memory()
+    return [(img_path, output, success, None, None) for img_path, (output, success) in zip(img_paths, outputs)], elapsed
+
+
+def process_page_batch(page_nums, pdf_path, dpi):
+    """Batched variant of process_single_page_in_memory"""
+    model = get_shared_model()
+    start = time.perf_counter()
+    page_results = _infer_pages(model, _get_worker_document(pdf_path), page_nums, dpi)
+    elapsed = time.perf_counter() - start
+    _report_warm_memory()
+    return page_results, elapsed
+
+
+TITLE_LABELS = ('doc_title', 'paragraph_title', 'table_title')
+TITLE_MIN_SCORE = 0.6
+# PP-DocLayout-L's exported shapes top out at 8 images per call (see inference.yml)
+AUTO_BATCH_CANDIDATES = (1, 2, 4, 8)
+# Where low-confidence pages are re-rendered when escalation is on
+ESCALATE_DPI = 144
+# Workers when neither the caller nor a tuned CPU profile says otherwise
+DEFAULT_MAX_WORKERS = 6
+# Under a memory ceiling, documents are reopened after this many pages
+REOPEN_EVERY_PAGES = 50
+
+
 class FastPDFProcessor:
-    def __init__(self, max_workers=4):  
+    def __init__(self, max_workers=None, in_memory=False, title_labels=TITLE_LABELS,
+                 title_min_score=TITLE_MIN_SCORE, write_titles_only=True,
+                 batch_size=1, threads_per_worker=None, backend=None,
+                 render_mode="dpi", escalate_below=None, escalate_dpi=ESCALATE_DPI,
+                 route_pages=False, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                 pin_workers=None, share_weights=False, max_memory_mb=None, page_hashes=False,
+                 intermediate="json", nms_iou=None):  
         self.layout_model = None
-        self.max_workers = max_workers
+        # Detector implementation loaded in each worker, see detectors.BACKENDS
+        self.backend = backend or default_backend_name()
+        # Worker count and threads left unset come from this host's autotune profile (see autotune_cpu)
+        profile = None
+        if max_workers is None or threads_per_worker is None:
+            profile = load_profile(self.backend)
+            if profile:
+                print(f"🧮 Using tuned CPU profile: {profile['max_workers']} workers x {profile['threads_per_worker']} threads")
+        profile = profile or {}
+        self.max_workers = max_workers or profile.get("max_workers", DEFAULT_MAX_WORKERS)
+        self.threads_per_worker = threads_per_worker or profile.get("threads_per_worker", 1)
+        # Give each worker its own cores, inside one NUMA node where the machine has several
+        self.pin_workers = profile.get("pin_workers", False) if pin_workers is None else pin_workers
+        self._core_queue = None
+        # Load the weights once in a fork server and fork the workers from it, see _weight_sharing_context
+        self.share_weights = share_weights
+        # Pages per predict call: an int, or "auto" to pick from measured throughput
+        self.batch_size = batch_size
+        self._tuned_batch_size = None
+        self._executor = None
+        # Workers report their memory once warm (see report_worker_memory)
+        self._memory_queue = None
+        self._warm_memory = {}
+        # Which detections make it into the titles-only view
+        self.title_labels = set(title_labels)
+        self.title_min_score = title_min_score
+        self.write_titles_only = write_titles_only
+        # Render pages inside the workers instead of round-tripping PNGs through disk
+        self.in_memory = in_memory
+        # Parsed text layer of the document being worked on, see document_context
+        self._context_cache = (None, None)
+        # "dpi" renders at a fixed DPI, "target" renders each page straight to the model's input size
+        self.render_mode = render_mode
+        self.escalate_below = escalate_below
+        self.escalate_dpi = escalate_dpi
+        # Send pages with a decisive text layer around the model, see utils/page_router.py
+        self.router = PageRouter() if route_pages else None
+        # Per-page detections keyed by the rendered pixels, see utils/layout_cache.py
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_stats = {"hits": 0, "misses": 0}
+        if (render_mode != "dpi" or escalate_below is not None) and not in_memory:
+            print("🔁 Adaptive rendering happens inside the workers, enabling in-memory mode")
+            self.in_memory = True
+        if cache_dir and not self.in_memory:
+            print("🔁 The layout cache hashes pages as the workers render them, enabling in-memory mode")
+            self.in_memory = True
+        # Memory ceiling for this process plus its workers; pages then go through a window
+        # of in-flight batches sized to stay under it, see process_pdf_bounded
+        # "json" or "columnar" (memory-mappable .cols directories, see utils/columnar.py)
+        self.intermediate = intermediate
+        # Record a content hash per page so a later run can reuse unchanged pages, see reuse_previous
+        self.page_hashes = page_hashes
+        # Same-label boxes overlapping a better one above this IoU are dropped before
+        # any text is extracted; a float, or per-label thresholds (see utils/box_nms.py)
+        self.nms_iou = parse_iou_thresholds(nms_iou)
+        self.nms_stats = {"boxes": 0, "suppressed": 0}
+        self._boxes_cache = (None, None)
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self.peak_memory = 0
+        if self.max_memory_bytes and not self.in_memory:
+            print("🔁 A memory ceiling keeps rendered pages out of the pipeline, enabling in-memory mode")
+            self.in_memory = True
 
     def _get_layout_model(self):
         """Keep your original model loading"""
+        global _backend_name
+        _backend_name = self.backend
         return get_shared_model()
 
     def convert_pdf_to_images_fast(self, pdf_path, output_dir="images", dpi=55):
@@ -56,42 +357,69 @@ class FastPDFProcessor:
         doc = fitz.open(pdf_path)
         image_paths = []
 
+        # Private directory per document so two PDFs sharing output_dir can't overwrite each other's pages
+        pdf_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+        image_dir = tempfile.mkdtemp(prefix=f"{pdf_filename}_", dir=output_dir)
+
         print(f"📄 Converting {len(doc)} pages to images (DPI: {dpi})...")
 
         for page_num in range(len(doc)):
             page = doc.load_page(page_num)
             # Slightly lower DPI for speed
             pix = page.get_pixmap(dpi=dpi)
-            image_path = os.path.join(output_dir, f"page_{page_num+1}.png")
+            image_path = os.path.join(image_dir, f"page_{page_num+1}.png")
             pix.save(image_path)
             image_paths.append(image_path)
             pix = None
 
         return image_paths, doc
 
-    def extract_text_from_coordinates(self, pdf_doc, page_num, bbox, dpi=55):
+    def _cleanup_images(self, image_paths):
+        """Remove rendered pages and the per-document directory holding them"""
+        if image_paths:
+            shutil.rmtree(os.path.dirname(image_paths[0]), ignore_errors=True)
+
+    def render_options(self, dpi=55):
+        """What the workers need to render a page, see _infer_pages"""
+        if self.render_mode == "dpi" and self.escalate_below is None:
+            return dpi
+        return {
+            "dpi": dpi,
+            "target_size": MODEL_INPUT_SIZE if self.render_mode == "target" else None,
+            "escalate_below": self.escalate_below,
+            "escalate_dpi": self.escalate_dpi
+        }
+
+    def document_context(self, pdf_doc):
+        """Shared parsed text layer of pdf_doc (see utils/page_context.py), one document at a time.
+
+        Routing, text extraction and the agents read pages through it, so each page is parsed once.
+        pdf_doc may already be a DocumentContext, e.g. one per document in the streaming pipeline.
+        """
+        if isinstance(pdf_doc, DocumentContext):
+            return pdf_doc
+        cached_doc, context = self._context_cache
+        if cached_doc is not pdf_doc:
+            context = DocumentContext(pdf_doc)
+            self._context_cache = (pdf_doc, context)
+        return context
+
+    def _get_page_index(self, pdf_doc, page_num):
+        return self.document_context(pdf_doc)[page_num].text_index
+
+    def extract_text_from_coordinates(self, pdf_doc, page_num, bbox, dpi=55, scale=None):
         """Modified to handle all element types better"""
         try:
-            page = pdf_doc.load_page(page_num)
-            page_rect = page.rect
-
-            pix = page.get_pixmap(dpi=dpi)
-            scale_x = page_rect.width / pix.width
-            scale_y = page_rect.height / pix.height
+            index = self._get_page_index(pdf_doc, page_num)
+            scale_x, scale_y = scale or render_scale(index.rect, dpi)
 
             x1, y1, x2, y2 = bbox
-            pdf_rect = fitz.Rect(
+            pdf_rect = (
                 x1 * scale_x, y1 * scale_y,
                 x2 * scale_x, y2 * scale_y
             )
 
-            text = page.get_text("text", clip=pdf_rect)
-
-            # If no text found, try getting text blocks in the area
-            if not text or not text.strip():
-                text_blocks = page.get_text("blocks", clip=pdf_rect)
-                if text_blocks:
-                    text = " ".join([block[4] for block in text_blocks if len(block) > 4])
+            text = index.query(pdf_rect)
 
             return text.strip() if text else ""
 
@@ -99,7 +427,37 @@ class FastPDFProcessor:
             print(f"⚠️ Text extraction error: {e}")
             return ""
 
-    def process_layout_result_all_elements(self, det_result, pdf_doc, page_num, dpi=55):
+    def to_document_pixels(self, pdf_doc, page_num, bbox, dpi, scale):
+        """bbox of a render at scale (points per pixel x, y) in pixels of the page rendered at dpi"""
+        doc_x, doc_y = render_scale(self.document_context(pdf_doc)[page_num].rect, dpi)
+        x1, y1, x2, y2 = bbox
+        return [x1 * scale[0] / doc_x, y1 * scale[1] / doc_y, x2 * scale[0] / doc_x, y2 * scale[1] / doc_y]
+
+    def _get_page_boxes(self, det_result):
+        """Boxes of one detection sorted top to bottom, duplicates suppressed when nms_iou is set.
+
+        The all-elements and titles-only views walk the same list, so it is kept for the last det_result.
+        """
+        cached_result, boxes = self._boxes_cache
+        if cached_result is not det_result:
+            boxes = det_result.get('boxes', [])
+            if self.nms_iou:
+                kept = suppress_duplicates(boxes, self.nms_iou)
+                self.nms_stats["boxes"] += len(boxes)
+                self.nms_stats["suppressed"] += len(boxes) - len(kept)
+                boxes = kept
+            boxes = sorted(boxes, key=lambda box: box.get('coordinate', [0, 0, 0, 0])[1])
+            self._boxes_cache = (det_result, boxes)
+        return boxes
+
+    def report_nms(self):
+        if not self.nms_iou:
+            return
+        boxes, suppressed = self.nms_stats["boxes"], self.nms_stats["suppressed"]
+        rate = suppressed / boxes if boxes else 0.0
+        print(f"🧹 Duplicate suppression: {suppressed}/{boxes} boxes dropped ({rate:.0%}) before text extraction")
+
+    def process_layout_result_all_elements(self, det_result, pdf_doc, page_num, dpi=55, scale=None):
         """MODIFIED: Extract text for ALL element types"""
         result = {
             "page_number": page_num + 1,
@@ -108,14 +466,9 @@ class FastPDFProcessor:
         }
 
         try:
-            boxes = det_result.get('boxes', [])
-
-            if boxes:
-                sorted_boxes = sorted(
-                    boxes,
-                    key=lambda box: box.get('coordinate', [0, 0, 0, 0])[1]
-                )
+            sorted_boxes = self._get_page_boxes(det_result)
 
+            if sorted_boxes:
                 for i, box in enumerate(sorted_boxes):
                     label = box.get('label', 'unknown').lower()
                     score = box.get('score', 0)
@@ -126,17 +479,21 @@ class FastPDFProcessor:
                     text_content = ""
                     try:
                         text_content = self.extract_text_from_coordinates(
-                            pdf_doc, page_num, coordinate, dpi
+                            pdf_doc, page_num, coordinate, dpi, scale
                         )
                     except Exception as e:
                         print(f"⚠️ Failed to extract text for {label}: {e}")
 
+                    bbox = [float(x) for x in coordinate]
+                    if scale is not None:
+                        bbox = self.to_document_pixels(pdf_doc, page_num, bbox, dpi, scale)
+
                     element = {
                         "id": i + 1,
                         "type": label,
                         "confidence": round(float(score), 3),
                         "text": text_content,
-                        "bbox": [float(x) for x in coordinate]  
+                        "bbox": bbox
                     }
 
                     result["elements"].append(element)
@@ -147,53 +504,213 @@ class FastPDFProcessor:
         return result
 
     def process_layout_result_titles_only(self, det_result, pdf_doc, page_num, dpi=55):
-        """Extract ONLY doc_title and paragraph_title elements"""
+        """Extract ONLY doc_title and paragraph_title elements, as the projection of the
+        all-elements result so duplicates are suppressed the same way"""
+        result_all = self.process_layout_result_all_elements(det_result, pdf_doc, page_num, dpi)
+        return self.project_titles_only(result_all, det_result)
+
+    def project_titles_only(self, result_all, det_result=None):
+        """Titles-only view of an all-elements page result, reusing its extracted text"""
         result = {
-            "page_number": page_num + 1,
+            "page_number": result_all["page_number"],
             "elements": [],
             "element_counts": {}
         }
 
-        try:
-            boxes = det_result.get('boxes', [])
+        if "error" in result_all:
+            result["error"] = result_all["error"]
 
-            if boxes:
-                sorted_boxes = sorted(
-                    boxes,
-                    key=lambda box: box.get('coordinate', [0, 0, 0, 0])[1]
-                )
+        if det_result is not None:
+            sorted_boxes = self._get_page_boxes(det_result)
+            # Elements were built from the same sorted boxes, so they line up one to one;
+            # the raw score is used so the threshold matches the unrounded comparison
+            scores = [box.get('score', 0) for box in sorted_boxes]
+        else:
+            scores = [element["confidence"] for element in result_all["elements"]]
 
-                for i, box in enumerate(sorted_boxes):
-                    label = box.get('label', 'unknown').lower()
-                    score = box.get('score', 0)
-                    coordinate = box.get('coordinate', [0, 0, 0, 0])
+        for score, element in zip(scores, result_all["elements"]):
+            label = element["type"]
+            if label in self.title_labels and score >= self.title_min_score:
+                result["element_counts"][label] = result["element_counts"].get(label, 0) + 1
+                result["elements"].append(element)
 
-                    # ONLY process title elements
-                    if label in ['doc_title', 'paragraph_title','table_title'] and score >= 0.6:
-                        result["element_counts"][label] = result["element_counts"].get(label, 0) + 1
+        return result
 
-                        text_content = ""
-                        try:
-                            text_content = self.extract_text_from_coordinates(
-                                pdf_doc, page_num, coordinate, dpi
-                            )
-                        except Exception as e:
-                            print(f"⚠️ Failed to extract text for {label}: {e}")
+    def _weight_sharing_context(self):
+        """Forkserver context whose server process has already loaded the detector.
+
+        Workers are forked from it, so they start with the weights mapped
+        copy-on-write instead of each reading its own copy. The server is started
+        here, with the preload settings in its environment only.
+        """
+        if "forkserver" not in mp.get_all_start_methods():
+            print("⚠️ Weight sharing needs the forkserver start method, loading the model per worker")
+            return None
+
+        from multiprocessing import forkserver
+
+        threads = str(self.threads_per_worker)
+        overrides = {
+            PRELOAD_ENV: self.backend,
+            PRELOAD_THREADS_ENV: threads if self.threads_per_worker > 1 else "",
+            "OMP_NUM_THREADS": threads,
+            "MKL_NUM_THREADS": threads,
+            "FLAGS_use_mkldnn": "1"
+        }
+        saved = {name: os.environ.get(name) for name in overrides}
+        context = mp.get_context("forkserver")
+        context.set_forkserver_preload(["detectors"])
+        os.environ.update(overrides)
+        try:
+            print(f"🔗 Loading the {self.backend} model once in the fork server, workers share its weights")
+            forkserver.ensure_running()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        return context
+
+    def _get_executor(self):
+        """Long-lived worker pool: the model is loaded once per worker and reused for every PDF"""
+        if self._executor is None or getattr(self._executor, "_broken", False):
+            if self._executor is not None:
+                print("⚠️ Worker pool broke, starting a fresh one")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._core_queue = None
+            if self.pin_workers:
+                sets = core_sets(self.max_workers, self.threads_per_worker)
+                if sets is None:
+                    print(f"⚠️ Can't give {self.max_workers} workers {self.threads_per_worker} cores each, not pinning")
+                else:
+                    self._core_queue = mp.Queue()
+                    for cpus in sets:
+                        self._core_queue.put(cpus)
+                    print(f"📌 Pinning workers to cores {sets}")
+            if self._memory_queue is None:
+                self._memory_queue = mp.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=self._weight_sharing_context() if self.share_weights else None,
+                initializer=_init_worker,
+                initargs=(self.threads_per_worker, self.backend, self.cache_dir, self.cache_max_bytes, self._core_queue,
+                          REOPEN_EVERY_PAGES if self.max_memory_bytes else None, self._memory_queue)
+            )
+        return self._executor
+
+    def collect_page_result(self, results, page_result):
+        """Store one worker page result as {key: (output, scale)} and count cache hits"""
+        key, output, success, scale, cached = page_result
+        results[key] = (output if success else [], scale)
+        if cached is not None:
+            self.cache_stats["hits" if cached else "misses"] += 1
+
+    def report_cache(self):
+        if not self.cache_dir:
+            return
+        hits, misses = self.cache_stats["hits"], self.cache_stats["misses"]
+        total = hits + misses
+        rate = hits / total if total else 0.0
+        print(f"🗃️  Layout cache: {hits} hits, {misses} misses ({rate:.0%} hit rate) in {self.cache_dir}")
+
+    def report_worker_memory(self):
+        """Print each live worker's RSS and PSS once warm (after its first batch) and now.
+
+        Call it at shutdown, before the pool closes. Returns {pid: {"warm", "now"}},
+        each {"rss", "pss"} in bytes, "warm" None for a worker that never ran a batch.
+        """
+        processes = getattr(self._executor, "_processes", None) or {}
+        if not processes:
+            return {}
+
+        while True:
+            try:
+                pid, memory = self._memory_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._warm_memory[pid] = memory
+
+        usage = {pid: {"warm": self._warm_memory.get(pid), "now": process_memory(pid)} for pid in sorted(processes)}
+        mode = "shared weights" if self.share_weights else "weights per worker"
+
+        def mb(memory, field):
+            return f"{memory[field] / 2**20:.1f} MB" if memory and memory[field] is not None else "n/a"
+
+        print(f"🧠 Worker memory ({len(usage)} workers, {mode}), warm -> at shutdown:")
+        for pid, memory in usage.items():
+            print(f"   • pid {pid}: RSS {mb(memory['warm'], 'rss')} -> {mb(memory['now'], 'rss')}, "
+                  f"PSS {mb(memory['warm'], 'pss')} -> {mb(memory['now'], 'pss')}")
+        for stage in ("warm", "now"):
+            if all(memory[stage] and memory[stage]["pss"] is not None for memory in usage.values()):
+                total = sum(memory[stage]["pss"] for memory in usage.values())
+                print(f"   • total PSS {'warm' if stage == 'warm' else 'at shutdown'} {total / 2**20:.1f} MB")
+        return usage
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _tune_batch_size(self, executor, keys, batch_fn, args, results):
+        """Probe each candidate batch size on real pages and keep the fastest.
+
+        Probes run one at a time so they don't compete for cores. The pages
+        they cover are kept, and the unprocessed keys are returned.
+        """
+        remaining = list(keys)
+        # First call pays paddle's warm-up, keep it out of the measurements
+        warmup, remaining = remaining[:1], remaining[1:]
+        if warmup:
+            page_results, _ = executor.submit(batch_fn, warmup, *args).result()
+            for page_result in page_results:
+                self.collect_page_result(results, page_result)
+
+        rates = {}
+        for size in AUTO_BATCH_CANDIDATES:
+            if len(remaining) < size:
+                break
+            chunk, remaining = remaining[:size], remaining[size:]
+            page_results, elapsed = executor.submit(batch_fn, chunk, *args).result()
+            for page_result in page_results:
+                self.collect_page_result(results, page_result)
+            rates[size] = size / elapsed if elapsed > 0 else 0.0
+            print(f"📏 Batch size {size}: {rates[size]:.2f} pages/sec")
+
+        # Too few pages to compare anything: leave the decision to a longer document
+        if len(rates) > 1:
+            self._tuned_batch_size = max(rates, key=rates.get)
+            print(f"🎯 Using batch size {self._tuned_batch_size}")
+        return remaining
+
+    def process_batches_parallel(self, keys, batch_fn, *args):
+        """Group pages into batches, one predict call per batch, results keyed like the single-image path"""
+        results = {}
+        total = len(keys)
 
-                        element = {
-                            "id": i + 1,
-                            "type": label,
-                            "confidence": round(float(score), 3),
-                            "text": text_content,
-                            "bbox": [float(x) for x in coordinate]  # Convert numpy types to Python float
-                        }
+        executor = self._get_executor()
+        if self.batch_size == "auto" and self._tuned_batch_size is None:
+            keys = self._tune_batch_size(executor, keys, batch_fn, args, results)
+        batch_size = self._tuned_batch_size or (self.batch_size if self.batch_size != "auto" else 1)
 
-                        result["elements"].append(element)
+        batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+        print(f"🚀 Processing {len(keys)} pages in {len(batches)} batches of {batch_size} with {self.max_workers} workers...")
 
-        except Exception as e:
-            result["error"] = str(e)
+        futures = [executor.submit(batch_fn, batch, *args) for batch in batches]
 
-        return result
+        for future in futures:
+            page_results, _ = future.result()
+            for page_result in page_results:
+                self.collect_page_result(results, page_result)
+            print(f"✅ {len(results)}/{total}")
+
+        return results
 
     def process_images_simple_parallel(self, image_paths):
         """Simple parallel processing - just the AI inference step"""
@@ -201,98 +718,539 @@ class FastPDFProcessor:
 
         results = {}
 
-        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker) as executor:
-            future_to_img = {
-                executor.submit(process_single_image_optimized, img_path): img_path
-                for img_path in image_paths
-            }
+        if self.batch_size != 1:
+            return self.process_batches_parallel(image_paths, process_image_batch)
 
-            completed = 0
-            for future in future_to_img:
-                img_path, output, success = future.result()
-                results[img_path] = output if success else []
-                completed += 1
-                print(f"✅ {completed}/{len(image_paths)}")
+        executor = self._get_executor()
+        future_to_img = {
+            executor.submit(process_single_image_optimized, img_path): img_path
+            for img_path in image_paths
+        }
 
-        return results
+        completed = 0
+        for future in future_to_img:
+            img_path, output, success = future.result()
+            results[img_path] = (output if success else [], None)
+            completed += 1
+            print(f"✅ {completed}/{len(image_paths)}")
 
-    def process_pdf_dual_output(self, pdf_path, output_dir="output", dpi=55):
-        """MODIFIED: Create two JSON files - all elements and titles only"""
-        print("⚡ Starting dual output processing...")
-        start_time = datetime.now()
+        return results
 
-        image_paths, pdf_doc = self.convert_pdf_to_images_fast(pdf_path, dpi=dpi)
-        os.makedirs(output_dir, exist_ok=True)
+    def process_pages_in_memory(self, pdf_path, page_count, dpi=55, page_nums=None):
+        """Diskless variant: workers render their own page and infer on the pixmap.
 
-        layout_results = self.process_images_simple_parallel(image_paths)
+        Returns {page_num: (output, scale)}, see _infer_pages for scale.
+        """
+        page_nums = list(range(page_count)) if page_nums is None else list(page_nums)
+        page_count = len(page_nums)
+        print(f"🚀 Processing {page_count} pages in memory with {self.max_workers} workers...")
 
-        all_elements_results = []
-        titles_only_results = []
+        results = {}
 
-        for idx, img_path in enumerate(image_paths):
-            print(f"📝 Processing results for page {idx+1}...")
+        if self.batch_size != 1:
+            return self.process_batches_parallel(
+                page_nums, process_page_batch, pdf_path, self.render_options(dpi)
+            )
 
-            layout_output = layout_results.get(img_path, [])
+        executor = self._get_executor()
+        futures = [
+            executor.submit(process_single_page_in_memory, pdf_path, page_num, self.render_options(dpi))
+            for page_num in page_nums
+        ]
 
-            page_all_elements = []
-            page_titles_only = []
+        completed = 0
+        for future in futures:
+            self.collect_page_result(results, future.result())
+            completed += 1
+            print(f"✅ {completed}/{page_count}")
 
-            for det_result in layout_output:
-                result_all = self.process_layout_result_all_elements(det_result, pdf_doc, idx, dpi)
-                page_all_elements.append(result_all)
+        return results
 
-                result_titles = self.process_layout_result_titles_only(det_result, pdf_doc, idx, dpi)
-                page_titles_only.append(result_titles)
+    def iter_layout_results(self, page_nums, pdf_path=None, dpi=55, image_paths=None):
+        """Yields (page_num, output, scale) as each batch finishes, not in page order.
+
+        Pages come from image_paths (indexed by page) when given, otherwise the
+        workers render them from pdf_path.
+        """
+        if not page_nums:
+            return
+        executor = self._get_executor()
+        if image_paths is not None:
+            keys = [image_paths[page_num] for page_num in page_nums]
+            page_of = {img_path: page_num for page_num, img_path in zip(page_nums, keys)}
+            batch_fn, args = process_image_batch, ()
+        else:
+            keys = list(page_nums)
+            page_of = {page_num: page_num for page_num in keys}
+            batch_fn, args = process_page_batch, (pdf_path, self.render_options(dpi))
+
+        if self.batch_size == "auto" and self._tuned_batch_size is None:
+            results = {}
+            keys = self._tune_batch_size(executor, keys, batch_fn, args, results)
+            for key, (output, scale) in results.items():
+                yield page_of[key], output, scale
+        batch_size = self._tuned_batch_size or (self.batch_size if self.batch_size != "auto" else 1)
+
+        batches = deque(keys[i:i + batch_size] for i in range(0, len(keys), batch_size))
+        # Without a memory ceiling everything is submitted at once
+        max_window = self.max_workers * 2 if self.max_memory_bytes else max(len(batches), 1)
+        window = max_window
+        pending = set()
+        while batches or pending:
+            while batches and len(pending) < window:
+                pending.add(executor.submit(batch_fn, batches.popleft(), *args))
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_results, _ = future.result()
+                results = {}
+                for page_result in page_results:
+                    self.collect_page_result(results, page_result)
+                for key, (output, scale) in results.items():
+                    yield page_of[key], output, scale
+
+            if self.max_memory_bytes:
+                window = self._adjust_window(window, max_window)
+
+    def memory_in_use(self):
+        """Bytes held by this process and its workers, PSS where the kernel reports it"""
+        total = 0
+        for pid in [os.getpid(), *(getattr(self._executor, "_processes", None) or {})]:
+            memory = process_memory(pid)
+            total += memory["pss"] if memory["pss"] is not None else (memory["rss"] or 0)
+        return total
+
+    def _adjust_window(self, window, max_window):
+        """Halve the in-flight window and drop caches above the ceiling, grow it back below 70% of it"""
+        used = self.memory_in_use()
+        self.peak_memory = max(self.peak_memory, used)
+        if used > self.max_memory_bytes:
+            gc.collect()
+            fitz.TOOLS.store_shrink(100)
+            if window > 1:
+                print(f"🧯 {used / 2**20:.0f} MB in use, over the {self.max_memory_bytes / 2**20:.0f} MB ceiling: "
+                      f"window {window} -> {max(1, window // 2)} batches")
+            return max(1, window // 2)
+        if used < self.max_memory_bytes * 0.7:
+            return min(max_window, window + 1)
+        return window
+
+    def build_page_results(self, layout_output, pdf_doc, page_num, dpi=55, scale=None):
+        """All-elements and titles-only entries for one page's detections.
+
+        scale is the page's (points per pixel x, y) when it wasn't rendered at the document dpi
+        (target size or DPI escalation). Its bboxes are then converted to pixels at dpi like every
+        other page's; the scale is recorded on the page as render_scale for information only.
+        """
+        page_all_elements = []
+        page_titles_only = []
+
+        for det_result in layout_output:
+            result_all = self.process_layout_result_all_elements(det_result, pdf_doc, page_num, dpi, scale)
+            result_titles = self.project_titles_only(result_all, det_result)
+            if scale is not None:
+                result_all["render_scale"] = result_titles["render_scale"] = [float(scale[0]), float(scale[1])]
+
+            page_all_elements.append(result_all)
+            page_titles_only.append(result_titles)
+
+        return page_all_elements, page_titles_only
+
+    def route_document(self, pdf_doc, dpi=55, page_nums=None):
+        """{page_num: elements} for the pages whose text layer makes inference unnecessary"""
+        if self.router is None:
+            return {}
+
+        page_nums = range(len(pdf_doc)) if page_nums is None else page_nums
+        context = self.document_context(pdf_doc)
+        text_pages = {}
+        for page_num in page_nums:
+            page_context = context[page_num]
+            route, reason, lines = self.router.route(page_context)
+            print(f"🧭 Page {page_num+1}: {route} ({reason})")
+            if route == TEXT_LAYER:
+                text_pages[page_num] = self.router.elements_from_lines(
+                    lines, render_scale(page_context.rect, dpi), first_page=page_num == 0
+                )
 
-            all_elements_results.extend(page_all_elements)
-            titles_only_results.extend(page_titles_only)
+        print(f"🧭 Routed {len(text_pages)}/{len(page_nums)} pages to the text layer, {len(text_pages)} inferences saved")
+        return text_pages
 
-            if idx % 3 == 0:
-                gc.collect()
+    def build_text_layer_results(self, elements, page_num):
+        """Page entries for a page the router kept away from the model"""
+        result_all = {
+            "page_number": page_num + 1,
+            "elements": elements,
+            "element_counts": {},
+            "route": TEXT_LAYER
+        }
+        for element in elements:
+            result_all["element_counts"][element["type"]] = result_all["element_counts"].get(element["type"], 0) + 1
+
+        result_titles = self.project_titles_only(result_all)
+        result_titles["route"] = TEXT_LAYER
+        return [result_all], [result_titles]
+
+    def reuse_previous(self, pdf_doc, page_nums, dpi=55, previous=None):
+        """Content hashes of the pages, and a previous run's entries for the pages that didn't change.
+
+        previous is that run's _all_elements_results.json; it needs page_hashes, so
+        it must have been made with page hashes on. Returns ({page_num: hash} or None,
+        {page_num: (all_elements entries, titles_only entries)}).
+        """
+        if not (self.page_hashes or previous):
+            return None, {}
+
+        context = (MODEL_NAME, self.backend, self.render_options(dpi), self.router is not None,
+                   sorted(self.title_labels), self.title_min_score)
+        if self.nms_iou:
+            context += (sorted(self.nms_iou.items()),)
+        # The router labels the first page's largest heading doc_title, so page 1 never matches a moved page
+        document = self.document_context(pdf_doc)
+        hashes = {
+            page_num: page_content_hash(document[page_num], dpi, *context, page_num == 0)
+            for page_num in page_nums
+        }
 
+        reused = {}
+        if previous:
+            previous_pages = load_previous_pages(previous) if os.path.exists(previous) else {}
+            if not previous_pages:
+                print(f"⚠️ No page hashes in {previous}, processing every page")
+            for page_num, content_hash in hashes.items():
+                if content_hash not in previous_pages:
+                    continue
+                all_entries, titles_entries = previous_pages[content_hash]
+                all_entries = renumber(all_entries, page_num + 1)
+                if titles_entries is not None:
+                    titles_entries = renumber(titles_entries, page_num + 1)
+                else:
+                    titles_entries = [self.project_titles_only(entry) for entry in all_entries]
+                reused[page_num] = (all_entries, titles_entries)
+            print(f"♻️ {len(reused)}/{len(hashes)} pages unchanged since {previous}, reusing their results")
+
+        return hashes, reused
+
+    def routed_pages(self, text_pages, reused=None):
+        """Pages served from the text layer, including reused ones that were"""
+        routed = set(text_pages)
+        for page_num, (all_entries, _) in (reused or {}).items():
+            if any(entry.get("route") == TEXT_LAYER for entry in all_entries):
+                routed.add(page_num)
+        return routed
+
+    def select_pages(self, pages, page_count):
+        """0-based page numbers to process: all of them, a spec like '101-200', or a list"""
+        if pages is None:
+            return list(range(page_count))
+        if isinstance(pages, str):
+            return parse_page_spec(pages, page_count)
+        return sorted(page_num for page_num in set(pages) if 0 <= page_num < page_count)
+
+    def assemble_results(self, pdf_path, page_count, start_time, dpi, all_elements_results, titles_only_results,
+                         text_pages=None, page_nums=None, page_hashes=None):
+        """Document-level results. With page_nums covering only part of the document,
+        this is a shard: pages keep their absolute page_number and page_range says which ones are in."""
+        processed = page_count if page_nums is None else len(page_nums)
         final_all_elements = {
             "document": pdf_path,
-            "total_pages": len(image_paths),
+            "total_pages": page_count,
             "processing_time": str(datetime.now() - start_time),
             "extraction_type": "all_elements",
             "dpi": dpi,
             "pages": all_elements_results
         }
 
+        if self.router is not None:
+            final_all_elements["routing"] = {
+                "text_layer_pages": sorted(page_num + 1 for page_num in (text_pages or {})),
+                "model_pages": processed - len(text_pages or {})
+            }
+
         # Create final results for TITLES only
         final_titles_only = {
             "document": pdf_path,
-            "total_pages": len(image_paths),
+            "total_pages": page_count,
             "processing_time": str(datetime.now() - start_time),
             "extraction_type": "titles_only",
             "dpi": dpi,
             "pages": titles_only_results
         }
 
-        pdf_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+        if processed != page_count:
+            final_all_elements["page_range"] = final_titles_only["page_range"] = page_range_label(page_nums)
 
-        all_elements_file = os.path.join(output_dir, f"{pdf_filename}_all_elements_results.json")
-        titles_only_file = os.path.join(output_dir, f"{pdf_filename}_titles_only_results.json")
+        if page_hashes is not None:
+            final_all_elements["page_hashes"] = {
+                str(page_num + 1): content_hash for page_num, content_hash in sorted(page_hashes.items())
+            }
+
+        return final_all_elements, final_titles_only
 
-        with open(all_elements_file, "w", encoding="utf-8") as f:
-            json.dump(final_all_elements, f, indent=2, ensure_ascii=False)
+    def result_paths(self, pdf_path, output_dir="output", suffix=""):
+        """All-elements and titles-only file names; suffix tells page-range shards apart"""
+        pdf_filename = os.path.splitext(os.path.basename(pdf_path))[0] + suffix
+        extension = COLUMNAR_SUFFIX if self.intermediate == "columnar" else ".json"
+        return (
+            os.path.join(output_dir, f"{pdf_filename}_all_elements_results{extension}"),
+            os.path.join(output_dir, f"{pdf_filename}_titles_only_results{extension}")
+        )
+
+    def _write_results(self, path, document, pages=None):
+        """One results file in the configured intermediate format; pages may stream them in"""
+        if self.intermediate == "columnar":
+            write_columnar(path, document, pages)
+        elif pages is not None:
+            write_json_document(path, document, pages)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(document, f, indent=2, ensure_ascii=False)
 
-        with open(titles_only_file, "w", encoding="utf-8") as f:
-            json.dump(final_titles_only, f, indent=2, ensure_ascii=False)
+    def save_results(self, pdf_path, final_all_elements, final_titles_only, output_dir="output", suffix=""):
+        all_elements_file, titles_only_file = self.result_paths(pdf_path, output_dir, suffix)
 
+        self._write_results(all_elements_file, final_all_elements)
         print(f"💾 Saved all elements to: {all_elements_file}")
-        print(f"💾 Saved titles only to: {titles_only_file}")
+
+        if self.write_titles_only:
+            self._write_results(titles_only_file, final_titles_only)
+            print(f"💾 Saved titles only to: {titles_only_file}")
+
+        return all_elements_file
+
+    def process_pdf_dual_output(self, pdf_path, output_dir="output", dpi=55, pages=None, previous=None):
+        """MODIFIED: Create two JSON files - all elements and titles only
+
+        pages limits the run to a page range ('101-200') and writes a shard, see utils/shards.py.
+        previous is an earlier run's _all_elements_results.json; unchanged pages are copied from it.
+        """
+        print("⚡ Starting dual output processing...")
+        start_time = datetime.now()
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        if (pages is not None or previous) and not self.in_memory:
+            print("🔁 Page ranges and reused pages are rendered inside the workers, using in-memory mode")
+
+        if self.in_memory or pages is not None or previous:
+            image_paths = []
+            pdf_doc = fitz.open(pdf_path)
+            page_count = len(pdf_doc)
+            page_nums = self.select_pages(pages, page_count)
+            page_hashes, reused = self.reuse_previous(pdf_doc, page_nums, dpi, previous)
+            text_pages = self.route_document(pdf_doc, dpi, [idx for idx in page_nums if idx not in reused])
+            model_pages = [idx for idx in page_nums if idx not in text_pages and idx not in reused]
+            layout_results = self.process_pages_in_memory(pdf_path, page_count, dpi, page_nums=model_pages) if model_pages else {}
+        else:
+            image_paths, pdf_doc = self.convert_pdf_to_images_fast(pdf_path, dpi=dpi)
+            page_count = len(image_paths)
+            text_pages = self.route_document(pdf_doc, dpi)
+            page_nums = list(range(page_count))
+            page_hashes, reused = self.reuse_previous(pdf_doc, page_nums, dpi)
+            model_paths = [img_path for idx, img_path in enumerate(image_paths) if idx not in text_pages]
+            results_by_path = self.process_images_simple_parallel(model_paths)
+            layout_results = {idx: results_by_path.get(img_path, ([], None)) for idx, img_path in enumerate(image_paths)}
+
+        all_elements_results, titles_only_results = self.build_document_results(
+            pdf_doc, page_nums, dpi, layout_results, text_pages, reused
+        )
+
+        final_all_elements, final_titles_only = self.assemble_results(
+            pdf_path, page_count, start_time, dpi, all_elements_results, titles_only_results,
+            self.routed_pages(text_pages, reused), page_nums, page_hashes
+        )
+        self.save_results(pdf_path, final_all_elements, final_titles_only, output_dir,
+                          shard_suffix(page_nums, page_count))
 
         pdf_doc.close()
+        self._context_cache = (None, None)
 
-        for img_path in image_paths:
-            try:
-                os.remove(img_path)
-            except:
-                pass
+        self._cleanup_images(image_paths)
 
         return final_all_elements, final_titles_only
 
+    def build_document_results(self, pdf_doc, page_nums, dpi, layout_results, text_pages, reused):
+        """All-elements and titles-only page entries of the document, in page order"""
+        all_elements_results = []
+        titles_only_results = []
+
+        for idx in page_nums:
+            print(f"📝 Processing results for page {idx+1}...")
+
+            if idx in reused:
+                page_all_elements, page_titles_only = reused[idx]
+            elif idx in text_pages:
+                page_all_elements, page_titles_only = self.build_text_layer_results(text_pages[idx], idx)
+            else:
+                layout_output, scale = layout_results.get(idx, ([], None))
+                page_all_elements, page_titles_only = self.build_page_results(
+                    layout_output, pdf_doc, idx, dpi, scale
+                )
+
+            all_elements_results.extend(page_all_elements)
+            titles_only_results.extend(page_titles_only)
+
+            if idx % 3 == 0:
+                gc.collect()
+
+        return all_elements_results, titles_only_results
+
+    def process_document(self, pdf, dpi=55, pages=None, name=None, source=None):
+        """In-memory counterpart of process_pdf_dual_output: nothing is read from or written to disk.
+
+        pdf is PDF bytes, an open fitz.Document or a path; name goes in the results'
+        "document" field. Workers render pages from shared memory (see utils/pdf_source.py);
+        callers already inside pdf_source pass its document and source to skip the copy.
+        Returns the (all_elements, titles_only) dicts the JSON files would hold.
+        """
+        start_time = datetime.now()
+
+        with (nullcontext((pdf, source)) if source is not None else pdf_source(pdf)) as (pdf_doc, source):
+            name = name or (source if isinstance(source, str) else pdf_doc.name or "document.pdf")
+            page_count = len(pdf_doc)
+            page_nums = self.select_pages(pages, page_count)
+            page_hashes, _ = self.reuse_previous(pdf_doc, page_nums, dpi)
+            text_pages = self.route_document(pdf_doc, dpi, page_nums)
+            model_pages = [idx for idx in page_nums if idx not in text_pages]
+            layout_results = self.process_pages_in_memory(source, page_count, dpi, page_nums=model_pages) if model_pages else {}
+
+            all_elements_results, titles_only_results = self.build_document_results(
+                pdf_doc, page_nums, dpi, layout_results, text_pages, {}
+            )
+            self._context_cache = (None, None)
+
+        return self.assemble_results(
+            name, page_count, start_time, dpi, all_elements_results, titles_only_results,
+            self.routed_pages(text_pages), page_nums, page_hashes
+        )
+
+    def process_pdf_streaming(self, pdf_path, output_dir="output", dpi=55, stream=None, pages=None, previous=None):
+        """Like process_pdf_dual_output, but each page is written out as soon as it is done.
+
+        Every finished page becomes one NDJSON record {"page_number", "all_elements",
+        "titles_only"} in <name>_pages.ndjson, in completion order, so consumers can
+        start before the document is finished and nothing accumulates in memory.
+        The usual JSON files are then rebuilt from that file in page order.
+
+        If stream is an open text stream, records go there instead and the JSON
+        files are not written. pages and previous work as in process_pdf_dual_output.
+        Returns a summary of the run.
+        """
+        print("⚡ Starting streaming processing...")
+        start_time = datetime.now()
+        os.makedirs(output_dir, exist_ok=True)
+        pdf_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+
+        if (pages is not None or previous) and not self.in_memory:
+            print("🔁 Page ranges and reused pages are rendered inside the workers, using in-memory mode")
+
+        if self.in_memory or pages is not None or previous:
+            image_paths = None
+            pdf_doc = fitz.open(pdf_path)
+        else:
+            image_paths, pdf_doc = self.convert_pdf_to_images_fast(pdf_path, dpi=dpi)
+        page_count = len(pdf_doc)
+        page_nums = self.select_pages(pages, page_count)
+        page_hashes, reused = self.reuse_previous(pdf_doc, page_nums, dpi, previous)
+        text_pages = self.route_document(pdf_doc, dpi, [idx for idx in page_nums if idx not in reused])
+        model_pages = [idx for idx in page_nums if idx not in text_pages and idx not in reused]
+        text_page_nums = self.routed_pages({}, reused)
+
+        page_stream = None
+        if stream is None:
+            suffix = shard_suffix(page_nums, page_count)
+            page_stream = PageStream(os.path.join(output_dir, f"{pdf_filename}{suffix}_pages.ndjson"))
+            write_record = page_stream.write
+            print(f"📡 Streaming pages to: {page_stream.path}")
+        else:
+            def write_record(record):
+                stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stream.flush()
+
+        summary = {"document": pdf_path, "total_pages": page_count, "processed_pages": len(page_nums),
+                   "element_counts": {}, "title_count": 0}
+
+        def emit(page_num, page_all_elements, page_titles_only):
+            write_record({
+                "page_number": page_num + 1,
+                "all_elements": page_all_elements,
+                "titles_only": page_titles_only
+            })
+            for result_all in page_all_elements:
+                for elem_type, count in result_all["element_counts"].items():
+                    summary["element_counts"][elem_type] = summary["element_counts"].get(elem_type, 0) + count
+            summary["title_count"] += sum(len(result["elements"]) for result in page_titles_only)
+
+        try:
+            for page_num in sorted(reused):
+                emit(page_num, *reused.pop(page_num))
+
+            for page_num in sorted(text_pages):
+                emit(page_num, *self.build_text_layer_results(text_pages.pop(page_num), page_num))
+                text_page_nums.add(page_num)
+
+            print(f"🚀 Processing {len(model_pages)} pages with {self.max_workers} workers, streaming as they finish...")
+            completed = 0
+            for page_num, output, scale in self.iter_layout_results(model_pages, pdf_path, dpi, image_paths):
+                emit(page_num, *self.build_page_results(output, pdf_doc, page_num, dpi, scale))
+                completed += 1
+                print(f"✅ {completed}/{len(model_pages)} (page {page_num+1})")
+                if self.max_memory_bytes and completed % REOPEN_EVERY_PAGES == 0:
+                    # Parsed objects stay with the document and fonts in MuPDF's store, drop both
+                    pdf_doc.close()
+                    fitz.TOOLS.store_shrink(100)
+                    pdf_doc = fitz.open(pdf_path)
+                    self._context_cache = (None, None)
+        finally:
+            pdf_doc.close()
+            self._context_cache = (None, None)
+            self._cleanup_images(image_paths or [])
+            if page_stream is not None:
+                page_stream.close()
+
+        if page_stream is not None:
+            summary["pages_file"] = page_stream.path
+            summary["all_elements_file"] = self.rebuild_results(
+                pdf_path, page_count, start_time, dpi, page_stream, text_page_nums, output_dir, page_nums, page_hashes
+            )
+        return summary
+
+    def process_pdf_bounded(self, pdf_path, output_dir="output", dpi=55, pages=None, previous=None):
+        """Memory-capped processing for very large PDFs.
+
+        Pages go through process_pdf_streaming, so each one is written to the NDJSON
+        file and released once its text is extracted; the window of in-flight batches
+        shrinks whenever this process plus its workers go over max_memory_bytes.
+        """
+        print(f"🧯 Memory ceiling {self.max_memory_bytes / 2**20:.0f} MB, processing pages in windows")
+        summary = self.process_pdf_streaming(pdf_path, output_dir, dpi, pages=pages, previous=previous)
+        summary["peak_memory_mb"] = round(self.peak_memory / 2**20, 1)
+        print(f"🧯 Peak memory {summary['peak_memory_mb']} MB (ceiling {self.max_memory_bytes / 2**20:.0f} MB)")
+        return summary
+
+    def rebuild_results(self, pdf_path, page_count, start_time, dpi, page_stream, text_pages=None, output_dir="output",
+                        page_nums=None, page_hashes=None):
+        """Write the all-elements and titles-only JSON files from a finished PageStream"""
+        final_all_elements, final_titles_only = self.assemble_results(
+            pdf_path, page_count, start_time, dpi, [], [], text_pages, page_nums, page_hashes
+        )
+
+        all_elements_file, titles_only_file = self.result_paths(
+            pdf_path, output_dir, shard_suffix(page_nums, page_count)
+        )
+        self._write_results(all_elements_file, final_all_elements, (
+            result for record in page_stream.iter_in_page_order() for result in record["all_elements"]
+        ))
+        print(f"💾 Saved all elements to: {all_elements_file}")
+
+        if self.write_titles_only:
+            self._write_results(titles_only_file, final_titles_only, (
+                result for record in page_stream.iter_in_page_order() for result in record["titles_only"]
+            ))
+            print(f"💾 Saved titles only to: {titles_only_file}")
+
+        return all_elements_file
+
     def get_titles_only_optimized(self, pdf_path, dpi=55):
         """Your original titles function with shared model"""
         print("🎯 Extracting titles only...")
@@ -335,18 +1293,100 @@ class FastPDFProcessor:
             print("✅")
 
         pdf_doc.close()
+        self._context_cache = (None, None)
 
         # Clean up images
-        for img_path in image_paths:
-            try:
-                os.remove(img_path)
-            except:
-                pass
+        self._cleanup_images(image_paths)
 
         return titles_result
 
 
 
+def compare_backends(pdf_path, backend_names, max_workers=None, dpi=55, batch_size=1, threads_per_worker=None):
+    """Layout-inference throughput (pages/sec) of each backend on the same PDF"""
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+
+    rates = {}
+    for name in backend_names:
+        print(f"\n⏱️  Benchmarking {name} backend...")
+        processor = FastPDFProcessor(
+            max_workers=max_workers, in_memory=True, batch_size=batch_size,
+            threads_per_worker=threads_per_worker, backend=name
+        )
+        with processor:
+            try:
+                # Warm-up: starts the pool and loads the model in the workers
+                processor.process_pages_in_memory(pdf_path, min(page_count, processor.max_workers), dpi)
+                start = time.perf_counter()
+                processor.process_pages_in_memory(pdf_path, page_count, dpi)
+                rates[name] = page_count / (time.perf_counter() - start)
+            except Exception as e:
+                print(f"❌ {name} backend failed: {e}")
+
+    print(f"\n🏁 BACKEND THROUGHPUT ({page_count} pages, {processor.max_workers} workers, batch size {batch_size}):")
+    print("="*50)
+    for name in backend_names:
+        if name in rates:
+            print(f"   • {name}: {rates[name]:.2f} pages/sec")
+        else:
+            print(f"   • {name}: failed")
+
+    return rates
+
+
+def autotune_cpu(pdf_path, backend=None, dpi=55, sample_pages=16, batch_size=1, configs=None):
+    """Benchmark (workers x threads) combinations on sample pages and save the fastest for this host.
+
+    Every combination gets a fresh, pinned pool and a warm-up pass, so model loading
+    isn't measured. Later processors created without max_workers / threads_per_worker
+    pick the saved profile up.
+    """
+    backend = backend or default_backend_name()
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    page_nums = [i % page_count for i in range(max(sample_pages, 1))]
+    configs = configs or candidate_configs()
+
+    rates = {}
+    for workers, threads in configs:
+        pin = core_sets(workers, threads) is not None
+        print(f"\n⏱️  Benchmarking {workers} workers x {threads} threads{' (pinned)' if pin else ''}...")
+        processor = FastPDFProcessor(
+            max_workers=workers, in_memory=True, batch_size=batch_size,
+            threads_per_worker=threads, backend=backend, pin_workers=pin
+        )
+        with processor:
+            try:
+                processor.process_pages_in_memory(pdf_path, page_count, dpi, page_nums=page_nums[:workers])
+                start = time.perf_counter()
+                processor.process_pages_in_memory(pdf_path, page_count, dpi, page_nums=page_nums)
+                rates[(workers, threads, pin)] = len(page_nums) / (time.perf_counter() - start)
+            except Exception as e:
+                print(f"❌ {workers} x {threads} failed: {e}")
+
+    print(f"\n🏁 CPU CONFIGURATIONS ({len(page_nums)} sample pages, {backend} backend):")
+    print("="*50)
+    for (workers, threads, pin), rate in sorted(rates.items(), key=lambda item: -item[1]):
+        print(f"   • {workers} workers x {threads} threads{' pinned' if pin else ''}: {rate:.2f} pages/sec")
+
+    if not rates:
+        return None
+
+    (workers, threads, pin), rate = max(rates.items(), key=lambda item: item[1])
+    profile = {
+        "max_workers": workers,
+        "threads_per_worker": threads,
+        "pin_workers": pin,
+        "pages_per_sec": round(rate, 3),
+        "sample_pages": len(page_nums),
+        "batch_size": batch_size
+    }
+    path = save_profile(backend, profile)
+    print(f"🎯 Saved {workers} workers x {threads} threads as this host's profile in {path}")
+    return profile
+
+
 if __name__ == "__main__":
     import argparse
     import time
@@ -358,12 +1398,70 @@ if __name__ == "__main__":
     parser.add_argument("pdf_path", nargs='?', help="Path to the PDF file to process.")
     parser.add_argument("--output_dir", default="output", help="Where to save results (default: output).")
     parser.add_argument("--dpi", type=int, default=55, help="Rendering DPI (default: 55).")
-    parser.add_argument("--max_workers", type=int, default=6, help="Parallel workers (default: 6).")
+    parser.add_argument("--max_workers", type=int, default=None,
+                        help=f"Parallel workers (default: tuned profile, else {DEFAULT_MAX_WORKERS}).")
+    parser.add_argument("--title_labels", default=",".join(TITLE_LABELS),
+                        help="Comma-separated labels kept in the titles-only view.")
+    parser.add_argument("--title_min_score", type=float, default=TITLE_MIN_SCORE,
+                        help=f"Minimum detection score for the titles-only view (default: {TITLE_MIN_SCORE}).")
+    parser.add_argument("--no_titles_file", action="store_true", help="Skip writing _titles_only_results.json.")
+    parser.add_argument("--batch_size", default="1",
+                        help="Pages per predict call, or 'auto' to pick from measured throughput (default: 1).")
+    parser.add_argument("--threads_per_worker", type=int, default=None,
+                        help="Intra-op CPU threads per worker; raise it when running fewer, batched workers (default: tuned profile, else 1).")
+    parser.add_argument("--pin_workers", action="store_true", default=None,
+                        help="Pin each worker to its own cores, within one NUMA node (default: tuned profile, else off).")
+    parser.add_argument("--share_weights", action="store_true",
+                        help="Load the model once in a fork server and fork the workers from it, sharing the weights.")
+    parser.add_argument("--max_memory_mb", type=int, default=None,
+                        help="Memory ceiling for this process plus its workers; streams pages through a window sized to stay under it.")
+    parser.add_argument("--pages", default=None,
+                        help="Only process these pages (1-based, e.g. 101-200) and write a shard named after them.")
+    parser.add_argument("--merge", nargs="+", default=None, metavar="SHARD",
+                        help="Merge page-range shards of one document into its full result files, then exit.")
+    parser.add_argument("--page_hashes", action="store_true",
+                        help="Record a content hash per page so a later run can pass this output as --previous.")
+    parser.add_argument("--previous", default=None, metavar="ALL_ELEMENTS_FILE",
+                        help="Earlier run's _all_elements_results (.json or .cols); pages whose content is unchanged reuse its results.")
+    parser.add_argument("--intermediate", choices=["json", "columnar"], default="json",
+                        help="Format of the results files: indented JSON, or memory-mappable .cols columns (default: json).")
+    parser.add_argument("--nms_iou", default=None,
+                        help="Drop same-label boxes overlapping a higher-scoring one above this IoU before text extraction, "
+                             "e.g. 0.5 or 0.5,doc_title=0.3 (default: off).")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Benchmark worker x thread combinations on the PDF and save the fastest as this host's profile.")
+    parser.add_argument("--autotune_pages", type=int, default=16, help="Sample pages per autotune run (default: 16).")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=None,
+                        help=f"Layout detector backend (default: $LAYOUT_BACKEND or {default_backend_name()}).")
+    parser.add_argument("--compare_backends", default=None,
+                        help="Comma-separated backends to benchmark on the PDF instead of processing it, e.g. paddle,onnx,stub.")
+    parser.add_argument("--render_mode", choices=["dpi", "target"], default="dpi",
+                        help="'dpi' renders at --dpi, 'target' renders each page straight to the model's input size.")
+    parser.add_argument("--escalate_below", type=float, default=None,
+                        help="Re-render pages whose best detection scores below this at --escalate_dpi.")
+    parser.add_argument("--escalate_dpi", type=int, default=ESCALATE_DPI,
+                        help=f"DPI for re-rendering low-confidence pages (default: {ESCALATE_DPI}).")
+    parser.add_argument("--route_pages", action="store_true",
+                        help="Skip layout inference on pages whose text layer already separates headings from body text.")
+    parser.add_argument("--cache_dir", default=os.environ.get("LAYOUT_CACHE_DIR"),
+                        help="Cache per-page detections here, keyed by the rendered page (default: $LAYOUT_CACHE_DIR, off).")
+    parser.add_argument("--cache_max_mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Size limit of the layout cache; least recently used pages are evicted (default: 512).")
+    parser.add_argument("--in_memory", action="store_true", help="Render pages inside the workers and skip the PNG round-trip.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Append each finished page to <name>_pages.ndjson as it completes, then rebuild the JSON files from it.")
     args = parser.parse_args()
 
     print("⚡ Dual Output PDF Processor")
     print("=" * 50)
 
+    if args.merge:
+        for extraction_type, (merged_path, missing) in merge_shard_files(args.merge, args.output_dir).items():
+            print(f"🧩 Merged {extraction_type} shards into: {merged_path}")
+            if missing:
+                print(f"⚠️ No shard covered pages {page_range_label(page_num - 1 for page_num in missing)}")
+        exit(0)
+
     pdf_path = args.pdf_path or os.environ.get('PDF_PATH')
     
     if not pdf_path:
@@ -388,23 +1486,88 @@ if __name__ == "__main__":
         print(f"❌ Error: PDF file '{pdf_path}' not found.")
         exit(1)
 
-    processor = FastPDFProcessor(max_workers=args.max_workers)
+    batch_size = args.batch_size if args.batch_size == "auto" else int(args.batch_size)
+
+    if args.autotune:
+        autotune_cpu(pdf_path, backend=args.backend, dpi=args.dpi, sample_pages=args.autotune_pages,
+                     batch_size=batch_size if isinstance(batch_size, int) else 1)
+        exit(0)
+
+    if args.compare_backends:
+        compare_backends(
+            pdf_path, [name.strip() for name in args.compare_backends.split(",") if name.strip()],
+            max_workers=args.max_workers, dpi=args.dpi, batch_size=batch_size,
+            threads_per_worker=args.threads_per_worker
+        )
+        exit(0)
+
+    processor = FastPDFProcessor(
+        max_workers=args.max_workers,
+        in_memory=args.in_memory,
+        title_labels=[label.strip() for label in args.title_labels.split(",") if label.strip()],
+        title_min_score=args.title_min_score,
+        write_titles_only=not args.no_titles_file,
+        batch_size=batch_size,
+        threads_per_worker=args.threads_per_worker,
+        pin_workers=args.pin_workers,
+        share_weights=args.share_weights,
+        max_memory_mb=args.max_memory_mb,
+        page_hashes=args.page_hashes or bool(args.previous),
+        intermediate=args.intermediate,
+        nms_iou=args.nms_iou,
+        backend=args.backend,
+        render_mode=args.render_mode,
+        escalate_below=args.escalate_below,
+        escalate_dpi=args.escalate_dpi,
+        route_pages=args.route_pages,
+        cache_dir=args.cache_dir,
+        cache_max_bytes=args.cache_max_mb * 1024 * 1024
+    )
 
     print(f"🚀 Processing: {pdf_path}")
     start = time.time()
 
-    all_elements_results, titles_only_results = processor.process_pdf_dual_output(
-        pdf_path, output_dir=args.output_dir, dpi=args.dpi
-    )
+    if args.stream or args.max_memory_mb:
+        with processor:
+            if args.max_memory_mb:
+                summary = processor.process_pdf_bounded(pdf_path, output_dir=args.output_dir, dpi=args.dpi,
+                                                        pages=args.pages, previous=args.previous)
+            else:
+                summary = processor.process_pdf_streaming(pdf_path, output_dir=args.output_dir, dpi=args.dpi,
+                                                          pages=args.pages, previous=args.previous)
+            processor.report_worker_memory()
+        elapsed = time.time() - start
+        processor.report_cache()
+        processor.report_nms()
+
+        print(f"\n🏆 RESULTS:")
+        print(f"⏱️  Total time: {elapsed:.2f} seconds")
+        print(f"📊 Pages processed: {summary['processed_pages']}")
+        print(f"🚀 Speed: {summary['processed_pages']/elapsed:.2f} pages/sec")
+        print(f"📊 Total elements found: {sum(summary['element_counts'].values())}")
+        for elem_type, count in sorted(summary['element_counts'].items()):
+            print(f"   • {elem_type}: {count}")
+        print(f"📊 Total titles found: {summary['title_count']}")
+        exit(0)
+
+    with processor:
+        all_elements_results, titles_only_results = processor.process_pdf_dual_output(
+            pdf_path, output_dir=args.output_dir, dpi=args.dpi, pages=args.pages, previous=args.previous
+        )
+        processor.report_worker_memory()
 
     end = time.time()
 
+    processor.report_cache()
+    processor.report_nms()
+
     print(f"\n🏆 RESULTS:")
     print(f"⏱️  Total time: {end-start:.2f} seconds")
-    print(f"📊 Pages processed: {all_elements_results['total_pages']}")
-    print(f"🚀 Speed: {all_elements_results['total_pages']/(end-start):.2f} pages/sec")
+    pages_processed = len(processor.select_pages(args.pages, all_elements_results['total_pages']))
+    print(f"📊 Pages processed: {pages_processed}")
+    print(f"🚀 Speed: {pages_processed/(end-start):.2f} pages/sec")
     
-    sequential_estimate = all_elements_results['total_pages'] * 4.5  # Rough estimate
+    sequential_estimate = pages_processed * 4.5  # Rough estimate
     speedup = sequential_estimate / (end-start)
     print(f"📈 Estimated speedup: {speedup:.1f}x")
 
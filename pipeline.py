@@ -0,0 +1,353 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import fitz
+
+from model import process_page_batch
+from utils.helpers import log
+from utils.page_context import DocumentContext
+
+# Characters of text layer that cost about as much to extract as one page of inference
+TEXT_CHARS_PER_INFERENCE = 20000
+
+
+def estimate_document_cost(context, sample_pages=3):
+    """Rough relative cost of a document (its DocumentContext): one unit per page for
+    inference, plus text extraction scaled by the characters on a few sampled pages.
+    The sampled pages stay parsed for the later stages."""
+    page_count = len(context)
+    if page_count == 0:
+        return 0.0
+
+    step = max(1, page_count // sample_pages)
+    sampled = range(0, page_count, step)[:sample_pages]
+    # Span text plus a newline per line, about what get_text("text") returns
+    chars = sum(
+        sum(len(span["text"]) for span in context[page_num].spans) + context[page_num].line_count
+        for page_num in sampled
+    )
+    chars_per_page = chars / len(sampled)
+
+    return page_count * (1.0 + chars_per_page / TEXT_CHARS_PER_INFERENCE)
+
+
+class StreamingPipeline:
+    """Render, inference, text extraction and the agent chain running side by side.
+
+    - Scheduling: page batches of every input PDF go to one warm worker pool,
+      shortest estimated document first, so small PDFs are not stuck behind a
+      long one and a 1-page PDF doesn't leave the rest of the pool idle. A
+      document is hashed and routed when its turn comes, while the batches of
+      the one before are still in flight.
+    - Render + inference: each worker renders its own pages in memory, so pages
+      are inferred as soon as they are drawn.
+    - Text extraction: the calling thread, taking batches in completion order and
+      reassembling each document in page order once all of its pages are in.
+    - Agent chain: a separate process, so PyMuPDF is never driven from two
+      threads at once and document N's outline overlaps document N+1's pages.
+
+    In-flight inference batches are capped, and so is the number of documents
+    waiting on the agent process, so a slow stage holds back the ones feeding it
+    instead of letting results pile up in memory.
+    """
+
+    def __init__(self, processor, classify_fn, output_dir="output", dpi=55,
+                 max_pending_batches=None, max_pending_docs=2, previous_fn=None):
+        self.processor = processor
+        # Module-level callable run in the agent process as classify_fn(pdf_path, all_elements_path, views),
+        # views being the DocumentContext.parsed_views() of the pages parsed so far
+        self.classify_fn = classify_fn
+        self.output_dir = output_dir
+        self.dpi = dpi
+        self.max_pending_batches = max_pending_batches or processor.max_workers * 2
+        self.max_pending_docs = max_pending_docs
+        # previous_fn(pdf_path) -> earlier _all_elements_results.json to reuse unchanged pages from, or None
+        self.previous_fn = previous_fn
+        self._executor_lock = threading.Lock()
+
+    def _batch_size(self):
+        size = self.processor._tuned_batch_size or self.processor.batch_size
+        return size if isinstance(size, int) else 1
+
+    def schedule(self, pdf_files):
+        """[(pdf_path, context)] ordered shortest estimated job first.
+
+        Each document is opened once here and its DocumentContext goes with the
+        job, through routing and text extraction to the agents. Only the cost
+        estimate is read now; hashing and routing wait until the document's turn
+        comes (see _prepare), so the first batch goes out after one document's
+        preparation rather than every document's.
+        """
+        jobs = []
+        for pdf_path in pdf_files:
+            try:
+                doc = fitz.open(pdf_path)
+            except Exception as e:
+                log(f"❌ Could not open {pdf_path}: {e}")
+                continue
+            context = DocumentContext(doc)
+            try:
+                jobs.append((estimate_document_cost(context), pdf_path, context))
+            except Exception as e:
+                log(f"❌ Could not read {pdf_path}: {e}")
+                doc.close()
+
+        jobs.sort(key=lambda job: job[0])
+        for cost, pdf_path, context in jobs:
+            log(f"📋 Queued {os.path.basename(pdf_path)}: {len(context)} pages, estimated cost {cost:.1f}")
+        return [(pdf_path, context) for _, pdf_path, context in jobs]
+
+    def _prepare(self, pdf_path, context):
+        """Settle what is known of a document before inference: the unchanged pages
+        of a previous run (reused) and the pages the router keeps away from the
+        model. Returns the document's state and the pages left for the model."""
+        processor = self.processor
+        log(f"🕐 Processing {os.path.basename(pdf_path)}")
+        page_count = len(context)
+        previous = self.previous_fn(pdf_path) if self.previous_fn else None
+        page_hashes, reused = processor.reuse_previous(context, range(page_count), self.dpi, previous)
+        text_pages = processor.route_document(
+            context, self.dpi, [page_num for page_num in range(page_count) if page_num not in reused]
+        )
+
+        state = {
+            "pdf_path": pdf_path,
+            # Documents are in flight side by side, each keeps its own parsed pages
+            "context": context,
+            "page_count": page_count,
+            "routed": processor.routed_pages(text_pages, reused),
+            "page_hashes": page_hashes,
+            "start_time": datetime.now(),
+            "pages": {
+                **reused,
+                **{
+                    page_num: processor.build_text_layer_results(elements, page_num)
+                    for page_num, elements in text_pages.items()
+                }
+            }
+        }
+        model_pages = [page_num for page_num in range(page_count) if page_num not in state["pages"]]
+        return state, model_pages
+
+    def _start_next(self, jobs, documents, ready, agent_executor, pending_agents):
+        """Prepare the next document and hand its model pages to the feeder, or None once there are no more.
+
+        This runs on the calling thread, like text extraction, so PyMuPDF is never
+        driven from two threads; the feeder only submits.
+        """
+        while jobs:
+            pdf_path, context = jobs.popleft()
+            try:
+                state, model_pages = self._prepare(pdf_path, context)
+            except Exception as e:
+                log(f"❌ Could not prepare {os.path.basename(pdf_path)}: {e}")
+                context.pdf_doc.close()
+                continue
+            documents[pdf_path] = state
+            ready.put((pdf_path, model_pages))
+            # Every page reused or routed: nothing to wait for
+            self._finish_if_complete(state, documents, agent_executor, pending_agents)
+            return
+        ready.put(None)
+
+    def _submit(self, events, pdf_path, page_nums, render):
+        """Queue one batch; its result arrives as a ("batch", pdf_path, (page_nums, future)) event.
+
+        The feeder and run() both submit, so they take turns getting the executor:
+        _get_executor replaces a pool whose worker died, and only one of them may do it.
+        """
+        with self._executor_lock:
+            try:
+                future = self.processor._get_executor().submit(process_page_batch, page_nums, pdf_path, render)
+            except BrokenProcessPool:
+                # The pool broke after the check; this time _get_executor starts a fresh one
+                future = self.processor._get_executor().submit(process_page_batch, page_nums, pdf_path, render)
+        future.add_done_callback(lambda f: events.put(("batch", pdf_path, (page_nums, f))))
+
+    def _feed(self, ready, events, slots):
+        """Submit the batches of each document handed over on ready, until None; blocks while
+        too many are in flight. Posts "submitted" once a document's batches are all out.
+
+        If submitting fails for good, the pages of the current document not yet
+        submitted are posted as "abandoned", so run() can still finish what it has.
+        """
+        batch_size = self._batch_size()
+        render = self.processor.render_options(self.dpi)
+        pdf_path, unsubmitted = None, []
+        try:
+            for pdf_path, unsubmitted in iter(ready.get, None):
+                while unsubmitted:
+                    page_nums = unsubmitted[:batch_size]
+                    slots.acquire()
+                    try:
+                        self._submit(events, pdf_path, page_nums, render)
+                    except Exception:
+                        slots.release()
+                        raise
+                    del unsubmitted[:batch_size]
+                events.put(("submitted", pdf_path, None))
+        except Exception as e:
+            log(f"❌ Pipeline feeder stopped: {e}")
+            if unsubmitted:
+                events.put(("abandoned", pdf_path, unsubmitted))
+            events.put(("fed", None, e))
+        else:
+            events.put(("fed", None, None))
+
+    def _collect(self, pending, outputs, run_start):
+        pdf_path, future = pending
+        filename = os.path.basename(pdf_path)
+        try:
+            outputs[pdf_path] = future.result()
+            log(f"✅ Outline ready: {filename} ({time.time() - run_start:.2f}s into the run)")
+        except Exception as e:
+            log(f"❌ Error processing {filename}: {e}")
+
+    def _finish_if_complete(self, state, documents, agent_executor, pending_agents):
+        if len(state["pages"]) == state["page_count"]:
+            del documents[state["pdf_path"]]
+            try:
+                self._finish_document(state, agent_executor, pending_agents)
+            except Exception as e:
+                self._drop_document(state, documents, e)
+
+    @staticmethod
+    def _drop_document(state, documents, error):
+        """A document failed after inference: log it, close it and let the others carry on"""
+        log(f"❌ Error processing {os.path.basename(state['pdf_path'])}: {error}")
+        documents.pop(state["pdf_path"], None)
+        if not state["context"].pdf_doc.is_closed:
+            state["context"].pdf_doc.close()
+
+    def _finish_document(self, state, agent_executor, pending_agents):
+        """All pages are in: write the document in page order and hand it to the agents"""
+        processor = self.processor
+        pdf_path = state["pdf_path"]
+
+        all_elements_results = []
+        titles_only_results = []
+        for page_num in sorted(state["pages"]):
+            page_all_elements, page_titles_only = state["pages"][page_num]
+            all_elements_results.extend(page_all_elements)
+            titles_only_results.extend(page_titles_only)
+
+        final_all_elements, final_titles_only = processor.assemble_results(
+            pdf_path, state["page_count"], state["start_time"], self.dpi, all_elements_results, titles_only_results,
+            state["routed"], None, state["page_hashes"]
+        )
+        all_elements_file = processor.save_results(pdf_path, final_all_elements, final_titles_only, self.output_dir)
+        # The agents start from the pages parsed here instead of parsing them again
+        views = state["context"].parsed_views()
+        state["context"].pdf_doc.close()
+
+        pending_agents.append((pdf_path, agent_executor.submit(self.classify_fn, pdf_path, all_elements_file, views)))
+
+    @staticmethod
+    def _failed_pages(page_nums):
+        """Page results for pages without inference; they come out with no elements"""
+        return [(page_num, [], False, None, None) for page_num in page_nums]
+
+    def _add_pages(self, state, page_results):
+        processor = self.processor
+        layout_results = {}
+        for page_result in page_results:
+            processor.collect_page_result(layout_results, page_result)
+        for page_num, (output, scale) in layout_results.items():
+            state["pages"][page_num] = processor.build_page_results(
+                output, state["context"], page_num, self.dpi, scale
+            )
+
+    def _add_and_finish(self, state, page_results, documents, agent_executor, pending_agents):
+        try:
+            self._add_pages(state, page_results)
+        except Exception as e:
+            self._drop_document(state, documents, e)
+        else:
+            self._finish_if_complete(state, documents, agent_executor, pending_agents)
+
+    def run(self, pdf_files):
+        """Process every PDF and return {pdf_path: classified_json_path}"""
+        run_start = time.time()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        jobs = deque(self.schedule(pdf_files))
+        events = queue.Queue()
+        ready = queue.Queue()
+        slots = threading.BoundedSemaphore(self.max_pending_batches)
+        feeder = threading.Thread(target=self._feed, args=(ready, events, slots), daemon=True)
+        feeder.start()
+
+        processor = self.processor
+        render = processor.render_options(self.dpi)
+        outputs = {}
+        pending_agents = deque()
+        documents = {}
+        retried = set()
+        fed = False
+
+        with ProcessPoolExecutor(max_workers=1) as agent_executor:
+            self._start_next(jobs, documents, ready, agent_executor, pending_agents)
+            while not fed or documents:
+                kind, pdf_path, payload = events.get()
+
+                if kind == "fed":
+                    fed = True
+                    if payload is not None:
+                        for pdf_path, context in jobs:
+                            log(f"❌ Error processing {os.path.basename(pdf_path)}: not started, the pipeline feeder stopped ({payload})")
+                            context.pdf_doc.close()
+                        jobs.clear()
+                    continue
+
+                if kind == "submitted":
+                    # The feeder is through this document, the next one can be prepared
+                    self._start_next(jobs, documents, ready, agent_executor, pending_agents)
+
+                elif kind == "batch":
+                    state = documents.get(pdf_path)
+                    if state is None:
+                        # The document was dropped after an error; its other batches only free their slot
+                        slots.release()
+                        continue
+                    page_nums, future = payload
+                    pages = f"pages {page_nums[0]+1}-{page_nums[-1]+1} of {os.path.basename(pdf_path)}"
+                    try:
+                        page_results, _ = future.result()
+                    except BrokenProcessPool as e:
+                        # A worker died and took every batch in flight with it; each gets one more go on a fresh pool
+                        if (pdf_path, page_nums[0]) not in retried:
+                            retried.add((pdf_path, page_nums[0]))
+                            log(f"⚠️ Worker pool broke during {pages}, resubmitting")
+                            try:
+                                self._submit(events, pdf_path, page_nums, render)
+                                continue
+                            except Exception as submit_error:
+                                e = submit_error
+                        log(f"❌ Inference failed for {pages}: {e}")
+                        page_results = self._failed_pages(page_nums)
+                    except Exception as e:
+                        log(f"❌ Inference failed for {pages}: {e}")
+                        page_results = self._failed_pages(page_nums)
+                    slots.release()
+                    self._add_and_finish(state, page_results, documents, agent_executor, pending_agents)
+
+                elif kind == "abandoned" and pdf_path in documents:
+                    state = documents[pdf_path]
+                    log(f"❌ Pages {', '.join(str(page_num + 1) for page_num in payload)} of {os.path.basename(pdf_path)} were never submitted")
+                    self._add_and_finish(state, self._failed_pages(payload), documents, agent_executor, pending_agents)
+
+                while pending_agents and (len(pending_agents) > self.max_pending_docs
+                                          or pending_agents[0][1].done()):
+                    self._collect(pending_agents.popleft(), outputs, run_start)
+
+            feeder.join()
+            while pending_agents:
+                self._collect(pending_agents.popleft(), outputs, run_start)
+
+        return outputs
@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT_DIR = os.path.join(REPO_DIR, "input")
+OUTPUT_DIR = os.path.join(REPO_DIR, "output")
+SAMPLES = sorted(name[:-len(".pdf")] for name in os.listdir(INPUT_DIR) if name.endswith(".pdf"))
+
+sys.path.insert(0, REPO_DIR)
+
+
+def sample_pdf(name):
+    return os.path.join(INPUT_DIR, f"{name}.pdf")
+
+
+def sample_output(name, kind):
+    """Path of a committed output, kind being all_elements_results, titles_only_results or classified"""
+    return os.path.join(OUTPUT_DIR, f"{name}_{kind}.json")
+
+
+def load_output(name, kind):
+    with open(sample_output(name, kind), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def detections(page_entry):
+    """The layout model's boxes for a committed all-elements page entry"""
+    return {"boxes": [
+        {"label": element["type"], "score": element["confidence"], "coordinate": element["bbox"]}
+        for element in page_entry["elements"]
+    ]}
+
+
+@pytest.fixture(params=SAMPLES)
+def sample(request):
+    return request.param
@@ -0,0 +1,40 @@
+"""The agent chain over one shared LineTable, against the committed outlines"""
+import importlib.util
+import shutil
+
+import pytest
+
+from agents.structure_agent import StructureAnalysisAgent
+from agents.visual_agent import VisualAnalysisAgent
+from conftest import load_output, sample_output, sample_pdf
+from extract_outline import build_outline
+from utils.line_table import LineTable
+
+HAS_OCR = bool(shutil.which("tesseract")) and any(
+    importlib.util.find_spec(module) for module in ("tesserocr", "pytesseract")
+)
+
+
+def _needs_ocr(sample):
+    agent = StructureAnalysisAgent(sample_output(sample, "all_elements_results"), sample_pdf(sample), workers=1)
+    _, ocr_page_nums, _, _ = agent._extract_pages(agent._iter_pages())
+    return bool(ocr_page_nums)
+
+
+def test_outline_matches_committed_output(sample):
+    if not HAS_OCR and _needs_ocr(sample):
+        pytest.skip("needs tesseract for its low-text pages")
+    outline = build_outline(sample_output(sample, "all_elements_results"), sample_pdf(sample))
+    assert outline == load_output(sample, "classified")
+
+
+def test_agents_take_only_a_line_table():
+    lines = [{"text": "Introduction", "font_size": 14.0, "font": "Arial-Bold", "bold": True, "italic": False,
+              "bbox": [72, 72, 200, 90], "page": 1, "ocr": False, "is_heading": True}]
+    with pytest.raises(TypeError, match="LineTable.from_records"):
+        VisualAnalysisAgent(lines)
+
+    table = LineTable.from_records(lines)
+    VisualAnalysisAgent(table).analyze_visual()
+    # The features land on the table the next agent reads
+    assert table[0]["font_ratio"] == 1.0
@@ -0,0 +1,49 @@
+"""Duplicate-box suppression before text extraction"""
+import pytest
+
+from conftest import detections, load_output
+from utils.box_nms import parse_iou_thresholds, suppress_duplicates
+
+
+def _file03_page1_boxes():
+    return detections(load_output("file03", "all_elements_results")["pages"][0])["boxes"]
+
+
+def test_overlapping_doc_titles_become_one():
+    boxes = _file03_page1_boxes()
+    doc_titles = [box for box in boxes if box["label"] == "doc_title"]
+    assert len(doc_titles) == 3
+
+    kept = suppress_duplicates(boxes, parse_iou_thresholds("doc_title=0.5"))
+    # The lower-scoring of the two overlapping boxes goes, the rest keep the detector's order
+    duplicate = min(doc_titles[1:], key=lambda box: box["score"])
+    assert kept == [box for box in boxes if box is not duplicate]
+    # Too little overlap for a stricter threshold
+    assert suppress_duplicates(boxes, parse_iou_thresholds("doc_title=0.9")) == boxes
+
+
+def test_different_labels_are_never_suppressed():
+    box = {"label": "doc_title", "score": 0.9, "coordinate": [10, 10, 200, 40]}
+    same_place = [box] + [dict(box, label=label, score=0.5) for label in ("paragraph_title", "text", "table_title")]
+    assert suppress_duplicates(same_place, parse_iou_thresholds("0.0")) == same_place
+
+
+@pytest.mark.parametrize("spec, thresholds", [
+    ("0.5", {"*": 0.5}),
+    ("0.5, Doc_Title=0.3", {"*": 0.5, "doc_title": 0.3}),
+    (0.4, {"*": 0.4}),
+    (None, None),
+])
+def test_parse_iou_thresholds(spec, thresholds):
+    assert parse_iou_thresholds(spec) == thresholds
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("half", "Bad IoU threshold 'half'"),
+    ("doc_title=", "Bad IoU threshold 'doc_title='"),
+    ("doc_title:0.3", "Bad IoU threshold 'doc_title:0.3'"),
+    ("1.5", "outside"),
+])
+def test_bad_spec_raises(spec, message):
+    with pytest.raises(ValueError, match=message):
+        parse_iou_thresholds(spec)
@@ -0,0 +1,34 @@
+"""The columnar intermediate round-trips the committed results and reads the same in the agents"""
+import json
+
+import pytest
+
+from agents.structure_agent import StructureAnalysisAgent
+from conftest import load_output, sample_output, sample_pdf
+from utils.columnar import ColumnarResults, columnar_to_json, load_results, write_columnar
+
+
+@pytest.mark.parametrize("kind", ["all_elements_results", "titles_only_results"])
+def test_round_trip_matches_committed_json(sample, kind, tmp_path):
+    document = load_output(sample, kind)
+    path = write_columnar(str(tmp_path / f"{sample}_{kind}.cols"), document)
+
+    assert load_results(path) == document
+    # Back to JSON gives the file json.dump writes, key order included
+    with open(columnar_to_json(path), encoding="utf-8") as f:
+        assert f.read() == json.dumps(document, indent=2, ensure_ascii=False)
+
+    results = ColumnarResults(path)
+    assert len(results) == len(document["pages"])
+    for entry_index, entry in enumerate(document["pages"]):
+        titles = [element for element in entry["elements"] if element["type"] in ("title", "doc_title")]
+        assert results.page_elements(entry_index, types={"title", "doc_title"}) == titles
+
+
+def test_structure_agent_reads_columnar_like_json(sample, tmp_path):
+    all_elements_path = sample_output(sample, "all_elements_results")
+    path = write_columnar(str(tmp_path / f"{sample}_all_elements_results.cols"), load_output(sample, "all_elements_results"))
+
+    from_json = StructureAnalysisAgent(all_elements_path, sample_pdf(sample), workers=1).extract_structure()
+    from_columnar = StructureAnalysisAgent(path, sample_pdf(sample), workers=1).extract_structure()
+    assert from_columnar == from_json
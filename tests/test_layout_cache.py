@@ -0,0 +1,65 @@
+"""Per-page detection cache: stable keys, hits give back what was stored, LRU eviction"""
+import os
+import time
+
+import fitz
+
+from conftest import detections, load_output, sample_pdf
+from utils.layout_cache import LayoutCache, to_plain_output
+
+
+def _render(name, page_num, dpi=55):
+    with fitz.open(sample_pdf(name)) as pdf_doc:
+        return pdf_doc.load_page(page_num).get_pixmap(dpi=dpi)
+
+
+def test_keys_follow_the_pixels_and_context():
+    key = LayoutCache.make_key(_render("file02", 0), "model", 55)
+    # Same page rendered again from a freshly opened document, as a second run does
+    assert LayoutCache.make_key(_render("file02", 0), "model", 55) == key
+    assert LayoutCache.make_key(_render("file02", 1), "model", 55) != key
+    assert LayoutCache.make_key(_render("file02", 0, dpi=72), "model", 72) != key
+    assert LayoutCache.make_key(_render("file02", 0), "other model", 55) != key
+
+
+def test_hit_returns_the_stored_detections(tmp_path):
+    page = load_output("file02", "all_elements_results")["pages"][0]
+    entry = {"output": to_plain_output([detections(page)]), "scale": None}
+    key = LayoutCache.make_key(_render("file02", 0), "model", 55)
+
+    cache = LayoutCache(str(tmp_path))
+    assert cache.get(key) is None
+    cache.put(key, entry)
+    assert cache.get(key) == entry
+    # Another worker process opens the same directory
+    assert LayoutCache(str(tmp_path)).get(key) == entry
+    assert [box["coordinate"] for box in cache.get(key)["output"][0]["boxes"]] == \
+           [element["bbox"] for element in page["elements"]]
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = LayoutCache(str(tmp_path))
+    keys = [f"{i:02d}" + "0" * 62 for i in range(6)]
+    for key in keys:
+        cache.put(key, {"output": [{"boxes": []}], "scale": None})
+    # Oldest first, one second apart, then a read makes the oldest the most recent
+    now = time.time()
+    for i, key in enumerate(keys):
+        os.utime(cache._path(key), (now - 100 + i, now - 100 + i))
+    assert cache.get(keys[0]) is not None
+
+    entry_size = os.path.getsize(cache._path(keys[0]))
+    cache.max_bytes = 3 * entry_size
+    assert cache.evict() == 3
+    assert [key for key in keys if cache.get(key) is not None] == [keys[0], keys[4], keys[5]]
+    assert cache.evict() == 0
+
+
+def test_writes_trim_the_cache(tmp_path):
+    cache = LayoutCache(str(tmp_path), max_bytes=0)
+    cache.EVICT_EVERY = 4
+    for i in range(3):
+        cache.put(f"{i:02d}" + "0" * 62, {"output": [], "scale": None})
+    assert len([name for _, _, files in os.walk(tmp_path) for name in files]) == 3
+    cache.put("03" + "0" * 62, {"output": [], "scale": None})
+    assert [name for _, _, files in os.walk(tmp_path) for name in files] == []
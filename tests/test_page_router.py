@@ -0,0 +1,56 @@
+"""Which pages of the sample PDFs the router keeps away from the model, and why"""
+import fitz
+
+from conftest import sample_pdf
+from model import FastPDFProcessor
+from utils.page_context import DocumentContext, render_scale
+from utils.page_router import MODEL, TEXT_LAYER, PageRouter
+
+
+def _routes(name):
+    router = PageRouter()
+    with fitz.open(sample_pdf(name)) as pdf_doc:
+        context = DocumentContext(pdf_doc)
+        return [router.route(context[page_num])[:2] for page_num in range(len(context))]
+
+
+def test_file02_routes():
+    routes = _routes("file02")
+    assert [page_num + 1 for page_num, (route, _) in enumerate(routes) if route == TEXT_LAYER] == [3, 4, 5, 6, 7, 10, 11, 12]
+    # Too little text, or too much image
+    assert routes[0] == (MODEL, "6 spans")
+    assert routes[7] == (MODEL, "images cover 28%")
+    # The smallest spread that still separates headings from body text
+    assert routes[10] == (TEXT_LAYER, "81 spans, font size spread 2.0pt")
+
+
+def test_flat_typography_and_scans_go_to_the_model():
+    routes = _routes("file03")
+    assert [page_num + 1 for page_num, (route, _) in enumerate(routes) if route == TEXT_LAYER] == [2, 10]
+    assert routes[0] == (MODEL, "font size spread 0.0pt")
+    assert routes[8] == (MODEL, "no heading candidates")
+    for name in ("file01", "file04", "file05"):
+        assert [route for route, _ in _routes(name)] == [MODEL]
+    assert _routes("file04")[0][1] == "images cover 100%"
+
+
+def test_routed_pages_become_text_layer_entries():
+    processor = FastPDFProcessor(max_workers=1, route_pages=True)
+    with fitz.open(sample_pdf("file02")) as pdf_doc:
+        text_pages = processor.route_document(pdf_doc, dpi=55)
+        assert sorted(text_pages) == [2, 3, 4, 5, 6, 9, 10, 11]
+
+        page_num = 2
+        width, height = (side / scale for side, scale in zip(pdf_doc[page_num].rect[2:], render_scale(pdf_doc[page_num].rect, 55)))
+        entries_all, entries_titles = processor.build_text_layer_results(text_pages[page_num], page_num)
+    result_all, result_titles = entries_all[0], entries_titles[0]
+
+    assert result_all["route"] == TEXT_LAYER
+    assert [element["type"] for element in result_titles["elements"]] == ["paragraph_title", "paragraph_title"]
+    assert [element["text"] for element in result_titles["elements"]] == ["Overview", "Revision History"]
+    for element in result_all["elements"]:
+        x1, y1, x2, y2 = element["bbox"]
+        # Rendered pixels at the document dpi, like detections
+        assert element["source"] == TEXT_LAYER and 0 <= x1 < x2 <= width + 1 and 0 <= y1 < y2 <= height + 1
+    # A page reused from a run that routed it still counts as routed
+    assert processor.routed_pages({}, {7: (entries_all, entries_titles)}) == {7}
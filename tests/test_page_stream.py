@@ -0,0 +1,49 @@
+"""Streamed results files are byte-for-byte what json.dump writes"""
+import json
+import random
+
+import pytest
+
+from conftest import load_output
+from utils.page_stream import PageStream, write_json_document
+
+
+def _json_dump(path, document):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_streamed(path, document, pages):
+    # As the streaming writer calls it: the document assembled with no pages, the pages from the stream
+    write_json_document(path, {**document, "pages": []}, pages)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("kind", ["all_elements_results", "titles_only_results"])
+def test_matches_json_dump(sample, kind, tmp_path):
+    document = load_output(sample, kind)
+    expected = _json_dump(tmp_path / "dumped.json", document)
+    assert _write_streamed(tmp_path / "streamed.json", document, iter(document["pages"])) == expected
+
+
+def test_pages_streamed_out_of_order(tmp_path):
+    document = load_output("file03", "all_elements_results")
+    # Later keys after "pages", as routing and page_hashes come
+    document["routing"] = {"text_layer_pages": [2, 10], "model_pages": 12}
+    document["page_hashes"] = {str(page["page_number"]): f"hash-{page['page_number']}" for page in document["pages"]}
+    shuffled = list(document["pages"])
+    random.Random(0).shuffle(shuffled)
+
+    with PageStream(str(tmp_path / "pages.ndjson")) as stream:
+        for page in shuffled:
+            stream.write(page)
+    streamed = _write_streamed(tmp_path / "streamed.json", document, stream.iter_in_page_order())
+    assert streamed == _json_dump(tmp_path / "dumped.json", document)
+
+
+def test_no_pages_and_non_ascii(tmp_path):
+    document = {"document": "input/résumé – ü.pdf", "total_pages": 0, "pages": [], "note": "é中"}
+    assert _write_streamed(tmp_path / "streamed.json", document, iter([])) == _json_dump(tmp_path / "dumped.json", document)
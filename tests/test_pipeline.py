@@ -0,0 +1,44 @@
+"""A document that fails after inference doesn't take the rest of the streaming run with it"""
+import os
+
+from conftest import load_output, sample_pdf
+from model import FastPDFProcessor
+from pipeline import StreamingPipeline
+
+
+def classify(pdf_path, all_elements_path, views):
+    return all_elements_path
+
+
+def test_failed_save_drops_only_that_document(tmp_path, monkeypatch):
+    processor = FastPDFProcessor(max_workers=1)
+    failing, passing = sample_pdf("file01"), sample_pdf("file02")
+
+    def reuse_previous(context, page_nums, dpi=55, previous=None):
+        # Every page comes from the committed results, so nothing goes to the model
+        pages = load_output(os.path.splitext(os.path.basename(context.pdf_doc.name))[0], "all_elements_results")["pages"]
+        return None, {page_num: ([pages[page_num]], [processor.project_titles_only(pages[page_num])])
+                      for page_num in page_nums}
+
+    save_results = processor.save_results
+
+    def save_or_fail(pdf_path, *args, **kwargs):
+        if pdf_path == failing:
+            raise OSError("disk full")
+        return save_results(pdf_path, *args, **kwargs)
+
+    monkeypatch.setattr(processor, "reuse_previous", reuse_previous)
+    monkeypatch.setattr(processor, "save_results", save_or_fail)
+    closed = []
+    close = StreamingPipeline._drop_document
+
+    def drop_document(state, documents, error):
+        close(state, documents, error)
+        closed.append((state["pdf_path"], state["context"].pdf_doc.is_closed))
+
+    monkeypatch.setattr(StreamingPipeline, "_drop_document", staticmethod(drop_document))
+
+    outputs = StreamingPipeline(processor, classify, output_dir=str(tmp_path)).run([failing, passing])
+    assert list(outputs) == [passing]
+    assert os.path.exists(outputs[passing])
+    assert closed == [(failing, True)]
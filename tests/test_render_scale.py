@@ -0,0 +1,35 @@
+"""Pages rendered at another size than the document dpi (target size, DPI escalation)
+must come out with bboxes in document-dpi pixels like every other page"""
+import fitz
+import pytest
+
+from conftest import detections, load_output, sample_pdf
+from model import MODEL_INPUT_SIZE, FastPDFProcessor
+from utils.page_context import render_scale
+
+
+def test_target_size_bboxes_are_document_pixels(sample):
+    all_elements = load_output(sample, "all_elements_results")
+    dpi = all_elements["dpi"]
+    processor = FastPDFProcessor(max_workers=1)
+
+    with fitz.open(sample_pdf(sample)) as pdf_doc:
+        for page_all in all_elements["pages"]:
+            page_num = page_all["page_number"] - 1
+            rect = pdf_doc.load_page(page_num).rect
+            doc_x, doc_y = render_scale(rect, dpi)
+            # The page stretched to the detector's input size, as render_mode="target" draws it
+            scale = (rect.width / MODEL_INPUT_SIZE[0], rect.height / MODEL_INPUT_SIZE[1])
+            stretched = detections(page_all)
+            for box in stretched["boxes"]:
+                x1, y1, x2, y2 = box["coordinate"]
+                box["coordinate"] = [x1 * doc_x / scale[0], y1 * doc_y / scale[1],
+                                     x2 * doc_x / scale[0], y2 * doc_y / scale[1]]
+
+            expected, _ = processor.build_page_results([detections(page_all)], pdf_doc, page_num, dpi)
+            result_all, result_titles = processor.build_page_results([stretched], pdf_doc, page_num, dpi, scale)
+
+            assert result_all[0]["render_scale"] == result_titles[0]["render_scale"] == list(scale)
+            for element, expected_element in zip(result_all[0]["elements"], expected[0]["elements"]):
+                assert element["bbox"] == pytest.approx(expected_element["bbox"])
+                assert element["text"] == expected_element["text"]
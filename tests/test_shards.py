@@ -0,0 +1,86 @@
+"""Page-range shards of one document merge back into the whole-document result"""
+from datetime import timedelta
+
+import pytest
+
+from conftest import load_output
+from utils.shards import merge_shard_results, page_range_label, parse_page_spec
+
+
+def _shard(document, page_nums, processing_time="0:00:10", routing=None):
+    """The committed result cut down to page_nums (0-based), as a --pages run writes it"""
+    shard = {key: value for key, value in document.items() if key != "pages"}
+    shard["processing_time"] = processing_time
+    shard["pages"] = [page for page in document["pages"] if page["page_number"] - 1 in page_nums]
+    shard["page_range"] = page_range_label(page_nums)
+    if routing is not None:
+        shard["routing"] = routing
+    return shard
+
+
+@pytest.mark.parametrize("spec, page_nums", [
+    ("1-3", [0, 1, 2]),
+    ("1-3,5,9-", [0, 1, 2, 4, 8, 9]),
+    ("-2", [0, 1]),
+    ("3, 2-4", [1, 2, 3]),
+    ("8-20", [7, 8, 9]),
+])
+def test_parse_page_spec(spec, page_nums):
+    assert parse_page_spec(spec, 10) == page_nums
+
+
+@pytest.mark.parametrize("spec", ["a-b", "3-1", "0-2", "11-", ""])
+def test_bad_page_spec_raises(spec):
+    with pytest.raises(ValueError, match="page range|Page range"):
+        parse_page_spec(spec, 10)
+
+
+def test_out_of_order_shards_merge_in_page_order():
+    document = load_output("file03", "all_elements_results")
+    shards = [_shard(document, range(10, 14)), _shard(document, range(0, 5)), _shard(document, range(5, 10))]
+
+    merged, missing = merge_shard_results(shards)
+    assert missing == []
+    assert merged["pages"] == document["pages"]
+    assert {key: merged[key] for key in ("document", "total_pages", "extraction_type", "dpi")} == \
+           {key: document[key] for key in ("document", "total_pages", "extraction_type", "dpi")}
+
+
+def test_missing_pages_are_reported():
+    document = load_output("file03", "all_elements_results")
+    merged, missing = merge_shard_results([_shard(document, range(0, 5)), _shard(document, range(8, 14))])
+    assert missing == [6, 7, 8]
+    assert [page["page_number"] for page in merged["pages"]] == [1, 2, 3, 4, 5, 9, 10, 11, 12, 13, 14]
+
+
+def test_overlapping_shards_are_rejected():
+    document = load_output("file03", "all_elements_results")
+    with pytest.raises(ValueError, match=r"Pages \[5, 6\] appear in more than one shard"):
+        merge_shard_results([_shard(document, range(0, 6)), _shard(document, range(4, 14))])
+
+
+def test_routing_blocks_are_combined():
+    document = load_output("file03", "all_elements_results")
+    shards = [
+        _shard(document, range(7, 14), routing={"text_layer_pages": [8, 12], "model_pages": 5}),
+        _shard(document, range(0, 7), routing={"text_layer_pages": [2], "model_pages": 6}),
+    ]
+    merged, _ = merge_shard_results(shards)
+    assert merged["routing"] == {"text_layer_pages": [2, 8, 12], "model_pages": 11}
+
+
+def test_processing_time_past_a_day():
+    document = load_output("file03", "all_elements_results")
+    long_run = str(timedelta(days=1, hours=2, minutes=3, seconds=4.5))
+    assert long_run == "1 day, 2:03:04.500000"
+    shards = [_shard(document, range(0, 7), "23:59:59.5"), _shard(document, range(7, 14), long_run)]
+
+    merged, _ = merge_shard_results(shards)
+    assert merged["processing_time"] == long_run
+
+
+def test_shards_of_different_documents_are_rejected():
+    first = _shard(load_output("file03", "all_elements_results"), range(0, 7))
+    other = _shard(load_output("file02", "all_elements_results"), range(7, 12))
+    with pytest.raises(ValueError, match="Shards disagree on document"):
+        merge_shard_results([first, other])
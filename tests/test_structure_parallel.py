@@ -0,0 +1,42 @@
+"""The structure agent's page-range workers give the lines of the in-process pass"""
+import fitz
+import pytest
+
+import agents.structure_agent as structure_agent
+from agents.structure_agent import StructureAnalysisAgent
+from conftest import load_output, sample_output, sample_pdf
+from utils.pdf_source import SharedPDF
+
+
+@pytest.fixture
+def parallel(monkeypatch):
+    monkeypatch.setattr(structure_agent, "PARALLEL_MIN_PAGES", 2)
+    yield
+    structure_agent.shutdown()
+
+
+def test_page_ranges_match_the_serial_pass(sample, parallel):
+    all_elements_path = sample_output(sample, "all_elements_results")
+    serial = StructureAnalysisAgent(all_elements_path, sample_pdf(sample), workers=1).extract_structure()
+    ranges = StructureAnalysisAgent(all_elements_path, sample_pdf(sample), workers=2).extract_structure()
+    assert ranges == serial
+
+
+def test_document_in_memory_is_shared_once(parallel, monkeypatch):
+    copies = []
+    tobytes = fitz.Document.tobytes
+    monkeypatch.setattr(fitz.Document, "tobytes", lambda doc, *args, **kwargs: copies.append(1) or tobytes(doc, *args, **kwargs))
+    # Without detections the low-text pages go to OCR, whose workers need the document as well
+    ocr_sources = []
+    monkeypatch.setattr(structure_agent, "uses_workers", lambda page_count: True)
+    monkeypatch.setattr(structure_agent, "ocr_pages", lambda pdf_doc, source, page_nums, regions=None: ocr_sources.append(source) or {})
+    all_elements = load_output("file02", "all_elements_results")
+    for page in all_elements["pages"]:
+        page["elements"] = []
+
+    with open(sample_pdf("file02"), "rb") as f:
+        pdf_doc = fitz.open(stream=f.read(), filetype="pdf")
+    with pdf_doc:
+        StructureAnalysisAgent(all_elements, pdf_doc, workers=2).extract_structure()
+    assert len(copies) == 1
+    assert len(ocr_sources) == 1 and isinstance(ocr_sources[0], SharedPDF)
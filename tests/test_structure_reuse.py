@@ -0,0 +1,25 @@
+"""Unchanged pages take their structure lines from the previous run's records"""
+import json
+
+from agents.structure_agent import StructureAnalysisAgent
+from conftest import load_output, sample_pdf
+from utils.page_context import PageContext
+
+
+def test_reused_pages_give_the_same_lines_without_reading_pages(sample, monkeypatch):
+    all_elements = load_output(sample, "all_elements_results")
+    all_elements["page_hashes"] = {str(page): f"{sample}-{page}" for page in range(1, len(all_elements["pages"]) + 1)}
+
+    first = StructureAnalysisAgent(all_elements, sample_pdf(sample), workers=1)
+    expected = first.extract_structure()
+    # Saved and loaded as _structure_pages.json is
+    previous_pages = json.loads(json.dumps(first.page_records))
+    assert set(previous_pages) == set(all_elements["page_hashes"].values())
+
+    def no_parse(page_context):
+        raise AssertionError(f"page {page_context.page_num + 1} was parsed again")
+
+    monkeypatch.setattr(PageContext, "_parse", no_parse)
+    second = StructureAnalysisAgent(all_elements, sample_pdf(sample), workers=1, previous_pages=previous_pages)
+    assert json.loads(json.dumps(second.extract_structure())) == json.loads(json.dumps(expected))
+    assert second.page_records == previous_pages
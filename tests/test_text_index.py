@@ -0,0 +1,66 @@
+"""Box text and the titles-only projection against the committed outputs,
+which were extracted with page.get_text("text", clip=) per box"""
+import random
+import re
+
+import fitz
+
+import utils.text_index as text_index
+from conftest import detections, load_output, sample_pdf
+from model import FastPDFProcessor
+from utils.text_index import PageTextIndex
+
+
+def _normalized(page_entries):
+    # The committed files come from a MuPDF that kept runs of spaces; newlines and all else must match
+    for entry in page_entries:
+        for element in entry["elements"]:
+            element["text"] = re.sub(r" {2,}", " ", element["text"])
+    return page_entries
+
+
+def test_page_entries_match_committed_outputs(sample):
+    all_elements = load_output(sample, "all_elements_results")
+    titles_only = load_output(sample, "titles_only_results")
+    processor = FastPDFProcessor(max_workers=1)
+
+    with fitz.open(sample_pdf(sample)) as pdf_doc:
+        for page_all, page_titles in zip(all_elements["pages"], titles_only["pages"]):
+            page_num = page_all["page_number"] - 1
+            result_all, result_titles = processor.build_page_results(
+                [detections(page_all)], pdf_doc, page_num, dpi=all_elements["dpi"]
+            )
+            assert _normalized(result_all) == _normalized([page_all])
+            assert _normalized(result_titles) == _normalized([page_titles])
+
+
+def _random_rects(rect, count, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        x1, x2 = sorted(rng.uniform(0, rect.width) for _ in range(2))
+        y1, y2 = sorted(rng.uniform(0, rect.height) for _ in range(2))
+        yield x1, y1, x2, y2
+
+
+def _without_spaces(text):
+    """Lines with their spaces removed, lines of only spaces dropped"""
+    return [line.replace(" ", "") for line in text.split("\n") if line.strip(" ")]
+
+
+def test_query_matches_clip_extraction_up_to_spaces(sample):
+    # The display list leaves out some space runs; every other character and line break must match
+    with fitz.open(sample_pdf(sample)) as pdf_doc:
+        for page in pdf_doc:
+            index = PageTextIndex(page)
+            for rect in _random_rects(page.rect, 100, page.number):
+                assert _without_spaces(index._get_text("text", rect)) == _without_spaces(page.get_text("text", clip=rect))
+
+
+def test_falls_back_to_clip_extraction(monkeypatch):
+    monkeypatch.setattr(text_index, "_REPLAY", True)
+    monkeypatch.setattr(text_index, "mupdf", None)
+    with fitz.open(sample_pdf("file01")) as pdf_doc:
+        page = pdf_doc[0]
+        rect = (0, 0, page.rect.width, page.rect.height / 2)
+        assert PageTextIndex(page).query(rect) == page.get_text("text", clip=rect)
+    assert text_index._REPLAY is False
@@ -0,0 +1,22 @@
+"""process_layout_result_titles_only is the titles-only projection of the all-elements result"""
+import fitz
+import pytest
+
+from conftest import detections, load_output, sample_pdf
+from model import FastPDFProcessor
+
+
+@pytest.mark.parametrize("nms_iou", [None, "0.5"])
+def test_titles_only_is_the_projection(sample, nms_iou):
+    all_elements = load_output(sample, "all_elements_results")
+    dpi = all_elements["dpi"]
+    # No score floor, so a low-scoring duplicate (file03 page 1) reaches the titles
+    processor = FastPDFProcessor(max_workers=1, title_min_score=0.0, nms_iou=nms_iou)
+
+    with fitz.open(sample_pdf(sample)) as pdf_doc:
+        for page_all in all_elements["pages"]:
+            page_num = page_all["page_number"] - 1
+            _, expected = processor.build_page_results([detections(page_all)], pdf_doc, page_num, dpi)
+            # A fresh detection dict, so nothing comes from the boxes cache of the call above
+            result = processor.process_layout_result_titles_only(detections(page_all), pdf_doc, page_num, dpi)
+            assert result == expected[0]
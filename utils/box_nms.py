@@ -0,0 +1,67 @@
+# utils/box_nms.py
+import numpy as np
+
+
+def parse_iou_thresholds(spec):
+    """'0.5' or '0.5,doc_title=0.3' -> {"*": 0.5, "doc_title": 0.3}; "*" covers the other labels"""
+    if spec is None or isinstance(spec, dict):
+        return spec
+    if isinstance(spec, (int, float)):
+        return {"*": float(spec)}
+
+    thresholds = {}
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        label, _, value = part.rpartition("=")
+        try:
+            threshold = float(value)
+        except ValueError:
+            raise ValueError(f"Bad IoU threshold '{part}', expected e.g. 0.5 or doc_title=0.3")
+        if not 0 <= threshold <= 1:
+            raise ValueError(f"IoU threshold {threshold} is outside [0, 1]")
+        thresholds[label.strip().lower() or "*"] = threshold
+    return thresholds
+
+
+def suppress_duplicates(boxes, thresholds):
+    """Greedy per-label NMS over detector boxes; returns the kept boxes in their original order.
+
+    A box is dropped when a higher-scoring box of the same label overlaps it with
+    IoU above that label's threshold. Labels without a threshold (and no "*")
+    are left alone. All labels go through one pass: each label's boxes are shifted
+    to their own region of the plane, so boxes of different labels never overlap.
+    """
+    if len(boxes) < 2 or not thresholds:
+        return list(boxes)
+
+    labels = [box.get('label', 'unknown').lower() for box in boxes]
+    label_ids = {label: i for i, label in enumerate(dict.fromkeys(labels))}
+    label_of = np.array([label_ids[label] for label in labels])
+    default = thresholds.get("*", np.inf)
+    # IoU never exceeds 1, so an infinite threshold suppresses nothing
+    label_thresholds = np.array([thresholds.get(label, default) for label in label_ids], dtype=np.float64)
+
+    coords = np.array([box.get('coordinate', [0, 0, 0, 0]) for box in boxes], dtype=np.float64).reshape(-1, 4)
+    scores = np.array([box.get('score', 0) for box in boxes], dtype=np.float64)
+    offset = coords.max() + 1 if coords.size else 1
+    shifted = coords + (label_of * offset)[:, None]
+    areas = (shifted[:, 2] - shifted[:, 0]).clip(0) * (shifted[:, 3] - shifted[:, 1]).clip(0)
+
+    # Stable, so equal scores keep the detector's order
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        x1 = np.maximum(shifted[best, 0], shifted[rest, 0])
+        y1 = np.maximum(shifted[best, 1], shifted[rest, 1])
+        x2 = np.minimum(shifted[best, 2], shifted[rest, 2])
+        y2 = np.minimum(shifted[best, 3], shifted[rest, 3])
+        inter = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+        union = areas[best] + areas[rest] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        order = rest[iou <= label_thresholds[label_of[rest]]]
+
+    return [boxes[i] for i in sorted(keep)]
@@ -0,0 +1,274 @@
+# utils/columnar.py
+"""Compact, memory-mappable alternative to the *_results.json intermediates.
+
+A result file becomes a directory (<name>_all_elements_results.cols) of .npy
+columns over all elements of the document, plus a string table:
+
+    meta.json            document fields, label / key tables, rare per-page extras
+    page_number.npy      int32   page_number of each page entry
+    page_offsets.npy     int64   element range of each page entry (entries + 1)
+    page_keyset.npy      int16   key order of each page entry
+    elem_id.npy          int32   element id
+    label.npy            int16   index into meta["labels"]
+    confidence.npy       float64
+    bbox.npy             float64 (elements, 4)
+    font_size.npy        float64 NaN when the element has none
+    text.npy, font.npy, source.npy   int32 index into the string table, -1 when absent
+    keyset.npy           int16   key order of each element
+    strings.bin          utf-8 strings back to back
+    string_offsets.npy   int64   (strings + 1)
+
+Readers map the columns lazily and only decode the strings they are asked for.
+Converting to JSON and back gives the same file json.dump would have written.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+COLUMNAR_SUFFIX = ".cols"
+ELEMENT_KEYS = ("id", "type", "confidence", "text", "bbox", "font_size", "font", "source")
+STRING_KEYS = ("text", "font", "source")
+
+
+def is_columnar(path):
+    return path.endswith(COLUMNAR_SUFFIX) or os.path.isdir(path)
+
+
+def columnar_path(json_path):
+    """<name>_all_elements_results.json -> <name>_all_elements_results.cols"""
+    return os.path.splitext(json_path)[0] + COLUMNAR_SUFFIX
+
+
+def _element_counts(elements):
+    counts = {}
+    for element in elements:
+        counts[element["type"]] = counts.get(element["type"], 0) + 1
+    return counts
+
+
+def write_columnar(path, document, pages=None):
+    """Write document (a results dict) as a columnar directory at path.
+
+    pages, when given, is an iterable of page entries used instead of
+    document["pages"], so a document can be written while it is streamed.
+    """
+    pages = document["pages"] if pages is None else pages
+
+    strings = {}
+    labels = {}
+    page_keysets = {}
+    element_keysets = {}
+
+    def intern(value):
+        if value is None:
+            return -1
+        return strings.setdefault(value, len(strings))
+
+    def index_of(table, value):
+        return table.setdefault(value, len(table))
+
+    page_numbers, page_offsets, page_keyset = [], [0], []
+    page_extras = {}
+    elem_ids, label_ids, confidences, bboxes, font_sizes, keysets = [], [], [], [], [], []
+    string_columns = {key: [] for key in STRING_KEYS}
+    element_extras = {}
+
+    for entry_index, entry in enumerate(pages):
+        page_numbers.append(entry["page_number"])
+        page_keyset.append(index_of(page_keysets, tuple(entry)))
+
+        extras = {key: value for key, value in entry.items() if key not in ("page_number", "elements", "element_counts")}
+        if entry.get("element_counts") != _element_counts(entry["elements"]):
+            extras["element_counts"] = entry.get("element_counts")
+        if extras:
+            page_extras[str(entry_index)] = extras
+
+        for element in entry["elements"]:
+            element_index = len(elem_ids)
+            unknown = {key: value for key, value in element.items() if key not in ELEMENT_KEYS}
+            if unknown:
+                element_extras[str(element_index)] = unknown
+
+            keysets.append(index_of(element_keysets, tuple(element)))
+            elem_ids.append(element.get("id", 0))
+            label_ids.append(index_of(labels, element.get("type", "unknown")))
+            confidences.append(element.get("confidence", 0.0))
+            bboxes.append(element.get("bbox", [0, 0, 0, 0]))
+            font_sizes.append(element["font_size"] if "font_size" in element else np.nan)
+            for key in STRING_KEYS:
+                string_columns[key].append(intern(element.get(key)))
+
+        page_offsets.append(len(elem_ids))
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    def save(name, values, dtype, shape=None):
+        array = np.asarray(values, dtype=dtype)
+        if shape is not None:
+            array = array.reshape(shape)
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+
+    save("page_number", page_numbers, np.int32)
+    save("page_offsets", page_offsets, np.int64)
+    save("page_keyset", page_keyset, np.int16)
+    save("elem_id", elem_ids, np.int32)
+    save("label", label_ids, np.int16)
+    save("confidence", confidences, np.float64)
+    save("bbox", bboxes, np.float64, (-1, 4))
+    save("font_size", font_sizes, np.float64)
+    save("keyset", keysets, np.int16)
+    for key in STRING_KEYS:
+        save(key, string_columns[key], np.int32)
+
+    encoded = [value.encode("utf-8") for value in strings]
+    with open(os.path.join(tmp_path, "strings.bin"), "wb") as f:
+        for value in encoded:
+            f.write(value)
+    save("string_offsets", np.concatenate([[0], np.cumsum([len(value) for value in encoded], dtype=np.int64)]), np.int64)
+
+    meta = {
+        "document": {key: value for key, value in document.items() if key != "pages"},
+        "key_order": list(document),
+        "labels": list(labels),
+        "page_keysets": [list(keys) for keys in page_keysets],
+        "element_keysets": [list(keys) for keys in element_keysets],
+        "page_extras": page_extras,
+        "element_extras": element_extras
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ColumnarResults:
+    """Lazy reader of a columnar results directory.
+
+    Columns are memory-mapped on first use and strings are decoded on demand,
+    so reading the titles of a few pages doesn't touch the rest of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.document = self.meta["document"]
+        self.labels = self.meta["labels"]
+        self._columns = {}
+        self._strings = None
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def string(self, index):
+        if index < 0:
+            return None
+        if self._strings is None:
+            strings_path = os.path.join(self.path, "strings.bin")
+            self._strings = np.memmap(strings_path, dtype=np.uint8, mode="r") if os.path.getsize(strings_path) else b""
+        offsets = self.column("string_offsets")
+        return bytes(self._strings[offsets[index]:offsets[index + 1]]).decode("utf-8")
+
+    def __len__(self):
+        return len(self.column("page_number"))
+
+    def page_number(self, entry_index):
+        return int(self.column("page_number")[entry_index])
+
+    def page_elements(self, entry_index, types=None):
+        """Element dicts of one page entry, only those whose type is in types if given"""
+        offsets = self.column("page_offsets")
+        start, end = int(offsets[entry_index]), int(offsets[entry_index + 1])
+        indices = range(start, end)
+        if types is not None:
+            wanted = [label_id for label_id, label in enumerate(self.labels) if label in types]
+            indices = start + np.flatnonzero(np.isin(self.column("label")[start:end], wanted))
+        return [self.element(int(index)) for index in indices]
+
+    def element(self, index):
+        values = {
+            "id": int(self.column("elem_id")[index]),
+            "type": self.labels[self.column("label")[index]],
+            "confidence": float(self.column("confidence")[index]),
+            "bbox": [float(x) for x in self.column("bbox")[index]],
+        }
+        font_size = float(self.column("font_size")[index])
+        if not np.isnan(font_size):
+            values["font_size"] = font_size
+        for key in STRING_KEYS:
+            value = self.string(int(self.column(key)[index]))
+            if value is not None:
+                values[key] = value
+        values.update(self.meta["element_extras"].get(str(index), {}))
+
+        keys = self.meta["element_keysets"][self.column("keyset")[index]]
+        return {key: values[key] for key in keys}
+
+    def page_extras(self, entry_index):
+        """Page entry fields other than page_number / elements / element_counts, e.g. render_scale"""
+        return self.meta["page_extras"].get(str(entry_index), {})
+
+    def page(self, entry_index):
+        """One page entry exactly as it appears in the JSON file"""
+        elements = self.page_elements(entry_index)
+        values = {
+            "page_number": self.page_number(entry_index),
+            "elements": elements,
+            "element_counts": _element_counts(elements)
+        }
+        values.update(self.page_extras(entry_index))
+
+        keys = self.meta["page_keysets"][self.column("page_keyset")[entry_index]]
+        return {key: values[key] for key in keys}
+
+    def iter_pages(self):
+        for entry_index in range(len(self)):
+            yield self.page(entry_index)
+
+    def to_dict(self):
+        values = {**self.document, "pages": list(self.iter_pages())}
+        return {key: values[key] for key in self.meta["key_order"]}
+
+
+def load_results(path):
+    """A results file as a dict, whichever format it was written in"""
+    if is_columnar(path):
+        return ColumnarResults(path).to_dict()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def json_to_columnar(json_path, out_path=None):
+    with open(json_path, "r", encoding="utf-8") as f:
+        document = json.load(f)
+    return write_columnar(out_path or columnar_path(json_path), document)
+
+
+def columnar_to_json(path, out_path=None):
+    out_path = out_path or os.path.splitext(path)[0] + ".json"
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(ColumnarResults(path).to_dict(), f, indent=2, ensure_ascii=False)
+    return out_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert results between JSON and the columnar format.")
+    parser.add_argument("direction", choices=["to-json", "to-columnar"])
+    parser.add_argument("source")
+    parser.add_argument("target", nargs="?", default=None)
+    args = parser.parse_args()
+
+    if args.direction == "to-json":
+        print(f"💾 Wrote {columnar_to_json(args.source, args.target)}")
+    else:
+        print(f"💾 Wrote {json_to_columnar(args.source, args.target)}")
@@ -0,0 +1,120 @@
+# utils/cpu_topology.py
+import glob
+import json
+import os
+import platform
+import re
+import socket
+from datetime import datetime
+
+NODE_DIR = "/sys/devices/system/node"
+PROFILE_PATH = os.environ.get(
+    "CPU_PROFILE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "pdf_outline", "cpu_profiles.json")
+)
+
+
+def parse_cpulist(text):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus():
+    """CPUs this process may run on (respects taskset / cgroup cpusets)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes():
+    """{node_id: [cpus]} from sysfs, limited to the CPUs we may use; one node if sysfs has none"""
+    allowed = set(available_cpus())
+    nodes = {}
+    for path in sorted(glob.glob(os.path.join(NODE_DIR, "node[0-9]*", "cpulist"))):
+        node_id = int(re.search(r"node(\d+)", path).group(1))
+        try:
+            with open(path, "r") as f:
+                cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        except OSError:
+            continue
+        if cpus:
+            nodes[node_id] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+def core_sets(workers, threads, nodes=None):
+    """Disjoint CPU sets of `threads` CPUs for each worker, each set inside one NUMA node.
+
+    Workers are dealt round-robin over the nodes so they share memory bandwidth
+    evenly. Returns None when the CPUs can't be split that way.
+    """
+    nodes = nodes or numa_nodes()
+    chunks = [
+        [cpus[i:i + threads] for i in range(0, len(cpus) - threads + 1, threads)]
+        for cpus in nodes.values()
+    ]
+
+    sets = []
+    while len(sets) < workers and any(chunks):
+        for node_chunks in chunks:
+            if node_chunks and len(sets) < workers:
+                sets.append(node_chunks.pop(0))
+    return sets if len(sets) == workers else None
+
+
+def pin_process(cpus):
+    """Restrict the calling process to cpus, where the OS supports it"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+        return True
+    return False
+
+
+def candidate_configs(cpu_count=None):
+    """(workers, threads) combinations worth benchmarking on this many CPUs"""
+    cpu_count = cpu_count or len(available_cpus())
+    configs = []
+    threads = 1
+    while threads <= cpu_count:
+        for workers in (cpu_count // threads, cpu_count // threads // 2):
+            if workers >= 1 and (workers, threads) not in configs:
+                configs.append((workers, threads))
+        threads *= 2
+    return configs
+
+
+def host_key(backend):
+    """Profiles are per machine shape and detector backend"""
+    return f"{socket.gethostname()}|{platform.machine()}|{len(available_cpus())}cpu|{len(numa_nodes())}node|{backend}"
+
+
+def _read_profiles(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_profile(backend, path=PROFILE_PATH):
+    """Tuned {max_workers, threads_per_worker, pin_workers, ...} for this host, or None"""
+    return _read_profiles(path).get(host_key(backend))
+
+
+def save_profile(backend, profile, path=PROFILE_PATH):
+    profiles = _read_profiles(path)
+    profiles[host_key(backend)] = {**profile, "tuned_at": datetime.now().isoformat(timespec="seconds")}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
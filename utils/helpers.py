@@ -14,10 +14,10 @@ def log(message):
     print(f"[LOG] {message}")
 # utils/helpers.py
 
-def is_toc_page(structure_data, page_num, threshold=0.4):
-    spans = [i for i in structure_data if i["page"] == page_num]
-    if not spans:
-        return False
-    # fraction of lines with >10% dots
-    dotty = sum(1 for i in spans if i["text"].count('.') / max(len(i["text"]), 1) > 0.1)
-    return (dotty / len(spans)) > threshold
+def toc_pages(lines, threshold=0.4):
+    """Pages of a LineTable where more than threshold of the lines are over 10% dots, as in a table of contents"""
+    dotty = [text.count('.') / max(len(text), 1) > 0.1 for text in lines.text]
+    return {
+        page for page, rows in lines.page_rows().items()
+        if sum(dotty[row] for row in rows) / len(rows) > threshold
+    }
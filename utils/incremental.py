@@ -0,0 +1,93 @@
+# utils/incremental.py
+import hashlib
+import json
+import os
+
+import fitz
+
+from utils.columnar import load_results
+
+
+def page_content_hash(page_context, dpi, *context):
+    """Hash of what the pipeline sees of a page: its text layer (the spans of its
+    PageContext, shared with routing and the agents) and its render at dpi.
+
+    context carries the settings that change the results for the same page
+    (model, backend, render options), so a page only matches a previous run
+    that would have produced the same entries.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(list(context), sort_keys=True, default=str).encode("utf-8"))
+    digest.update(json.dumps([[span["text"], span["size"], span["font"], list(span["bbox"])]
+                              for span in page_context.spans]).encode("utf-8"))
+    pix = page_context.page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+    digest.update(json.dumps([pix.width, pix.height, pix.n]).encode("utf-8"))
+    digest.update(pix.samples_mv)
+    return digest.hexdigest()
+
+
+def titles_path_for(all_elements_path):
+    return all_elements_path.replace("_all_elements_results", "_titles_only_results")
+
+
+def load_previous_pages(all_elements_path):
+    """{content_hash: (all_elements entries, titles_only entries or None)} from a previous run.
+
+    Only runs that recorded page_hashes can be reused. Titles-only entries come
+    from the matching titles file when there is one.
+    """
+    previous = load_results(all_elements_path)
+
+    page_hashes = previous.get("page_hashes")
+    if not page_hashes:
+        return {}
+
+    all_by_page = {}
+    for entry in previous["pages"]:
+        all_by_page.setdefault(entry["page_number"], []).append(entry)
+
+    titles_by_page = None
+    titles_path = titles_path_for(all_elements_path)
+    if os.path.exists(titles_path):
+        titles_by_page = {}
+        for entry in load_results(titles_path)["pages"]:
+            titles_by_page.setdefault(entry["page_number"], []).append(entry)
+
+    pages = {}
+    for page_number, content_hash in page_hashes.items():
+        page_number = int(page_number)
+        # No entries means inference failed on that page last time, run it again
+        if not all_by_page.get(page_number):
+            continue
+        pages[content_hash] = (
+            all_by_page[page_number],
+            titles_by_page.get(page_number, []) if titles_by_page is not None else None
+        )
+    return pages
+
+
+def renumber(entries, page_number):
+    """Copies of page entries moved to page_number (pages can shift between revisions)"""
+    return [{**entry, "page_number": page_number} for entry in entries]
+
+
+def structure_pages_path(all_elements_path):
+    """The structure agent's per-page lines saved next to an all-elements file (.json or .cols)"""
+    return os.path.splitext(all_elements_path)[0].replace("_all_elements_results", "_structure_pages") + ".json"
+
+
+def load_structure_pages(path, ocr_mode):
+    """{content_hash: {"source", "entries"}} the structure agent saved for each page of a previous run.
+
+    The lines depend on the OCR mode as well as on the page, so a file from another mode gives nothing.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        saved = json.load(f)
+    return saved["pages"] if saved.get("ocr_mode") == ocr_mode else {}
+
+
+def save_structure_pages(path, ocr_mode, pages):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"ocr_mode": ocr_mode, "pages": pages}, f, ensure_ascii=False)
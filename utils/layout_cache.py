@@ -0,0 +1,107 @@
+# utils/layout_cache.py
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def to_plain_output(output):
+    """Detection results as JSON-friendly dicts, keeping only what the pipeline reads"""
+    return [
+        {
+            "boxes": [
+                {
+                    "cls_id": int(box.get("cls_id", -1)),
+                    "label": str(box.get("label", "unknown")),
+                    "score": float(box.get("score", 0)),
+                    "coordinate": [float(x) for x in box.get("coordinate", [0, 0, 0, 0])]
+                }
+                for box in det_result.get("boxes", [])
+            ]
+        }
+        for det_result in output
+    ]
+
+
+class LayoutCache:
+    """On-disk cache of per-page detections, keyed by the rendered pixels.
+
+    Entries are small JSON files named after the key. Reads bump the file's
+    mtime, so evicting the oldest mtimes first gives LRU order; the directory is
+    trimmed back under max_bytes every few writes. Writes go through a temp file
+    and os.replace, so several worker processes can share one directory.
+    """
+
+    EVICT_EVERY = 50
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(pix, *context):
+        """Hash of the pixmap samples plus whatever else changes the detections (model, backend, render)"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([pix.width, pix.height, pix.n, *context], default=str).encode("utf-8"))
+        digest.update(pix.samples_mv)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
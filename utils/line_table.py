@@ -0,0 +1,165 @@
+# utils/line_table.py
+"""Columnar form of the structure lines the analysis agents share.
+
+StructureAnalysisAgent produces one dict per text line. For the agent chain
+they become a LineTable: NumPy arrays for font_size, bbox, page and the flags,
+interned string columns for font and type, and one plain list for the text.
+The agents add their features (font_ratio, is_numbered, ...) as further
+columns instead of writing keys into every line.
+
+Code that wants dicts indexes the table: table[i] is a read-only LineView
+that looks up the columns on access, and table.records() rebuilds the dicts.
+The agents take only a LineTable (see require_table), never a list of dicts.
+"""
+from collections.abc import Mapping
+
+import numpy as np
+
+# Keys of a structure line, in the order StructureAnalysisAgent writes them; "type" is optional
+LINE_FIELDS = ("text", "font_size", "font", "bold", "italic", "bbox", "page", "ocr", "is_heading", "type")
+FLAG_FIELDS = ("bold", "italic", "ocr", "is_heading")
+
+
+class StringColumn:
+    """Interned strings: an int32 code per row, each distinct value (None included) stored once"""
+
+    def __init__(self, values=()):
+        self.values = []
+        self._codes = {}
+        self.codes = np.fromiter((self.code(value) for value in values), dtype=np.int32)
+
+    def code(self, value):
+        if value not in self._codes:
+            self._codes[value] = len(self.values)
+            self.values.append(value)
+        return self._codes[value]
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+
+class LineView(Mapping):
+    """One row of a LineTable, read like the structure line dict it came from"""
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.table.value(self.row, key)
+
+    def __iter__(self):
+        return iter(self.table.keys(self.row))
+
+    def __len__(self):
+        return len(self.table.keys(self.row))
+
+    def __repr__(self):
+        return f"LineView({dict(self)!r})"
+
+
+class LineTable:
+    """Structure lines as columns; see the module docstring"""
+
+    def __init__(self, text, font_size, font, bold, italic, bbox, page, ocr, is_heading, types):
+        self.text = text
+        self.font_size = font_size
+        self.font = font
+        self.bold = bold
+        self.italic = italic
+        self.bbox = bbox
+        self.page = page
+        self.ocr = ocr
+        self.is_heading = is_heading
+        self.type = types
+        # Agent features: arrays with a value per row, or one value for every row
+        self.features = {}
+        self._page_rows = None
+        self._word_count = None
+
+    @classmethod
+    def from_records(cls, records):
+        """Table of structure line dicts; keys other than LINE_FIELDS are not kept"""
+        records = list(records)
+        count = len(records)
+        flags = {name: np.fromiter((bool(line.get(name)) for line in records), dtype=bool, count=count)
+                 for name in FLAG_FIELDS}
+        return cls(
+            text=[line["text"] for line in records],
+            font_size=np.fromiter((line["font_size"] for line in records), dtype=np.float64, count=count),
+            font=StringColumn(line.get("font", "") for line in records),
+            bbox=np.array([line["bbox"] for line in records], dtype=np.float64).reshape(count, 4),
+            page=np.fromiter((line["page"] for line in records), dtype=np.int32, count=count),
+            types=StringColumn(line.get("type") for line in records),
+            **flags
+        )
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, row):
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return LineView(self, row % len(self))
+
+    def __iter__(self):
+        return (LineView(self, row) for row in range(len(self)))
+
+    def records(self):
+        """The lines as plain dicts, features included"""
+        return [dict(view) for view in self]
+
+    def keys(self, row):
+        keys = LINE_FIELDS if self.type[row] is not None else LINE_FIELDS[:-1]
+        return keys + tuple(self.features)
+
+    def value(self, row, key):
+        if key in self.features:
+            values = self.features[key]
+            return values[row].item() if isinstance(values, np.ndarray) else values
+        if key == "text":
+            return self.text[row]
+        if key in ("font", "type"):
+            value = getattr(self, key)[row]
+            if value is None:
+                raise KeyError(key)
+            return value
+        if key == "bbox":
+            return self.bbox[row].tolist()
+        if key in LINE_FIELDS:
+            return getattr(self, key)[row].item()
+        raise KeyError(key)
+
+    def set_feature(self, name, values):
+        """Add or replace a feature column: an array of len(self) or one value for all rows"""
+        if isinstance(values, np.ndarray) and len(values) != len(self):
+            raise ValueError(f"Feature {name} has {len(values)} values for {len(self)} lines")
+        self.features[name] = values
+
+    def page_rows(self):
+        """{page: row indices in line order}, pages ascending"""
+        if self._page_rows is None:
+            order = np.argsort(self.page, kind="stable")
+            pages, starts = np.unique(self.page[order], return_index=True)
+            self._page_rows = dict(zip(pages.tolist(), np.split(order, starts[1:])))
+        return self._page_rows
+
+    @property
+    def word_count(self):
+        """Whitespace-separated words per line"""
+        if self._word_count is None:
+            self._word_count = np.fromiter((len(text.split()) for text in self.text), dtype=np.int64, count=len(self))
+        return self._word_count
+
+    def rows_of_page(self, page):
+        return self.page_rows().get(page, np.empty(0, dtype=np.intp))
+
+
+def require_table(lines):
+    """The agents' shared input: they write their features into the LineTable they are given,
+    so a list would leave every agent with a private copy and the next one without them"""
+    if not isinstance(lines, LineTable):
+        raise TypeError(f"Expected a LineTable, got {type(lines).__name__}; wrap the lines in LineTable.from_records()")
+    return lines
@@ -0,0 +1,190 @@
+# utils/ocr_pool.py
+import os
+
+import fitz
+from PIL import Image
+
+from utils.pdf_source import open_document
+from utils.worker_pool import LazyPool
+
+OCR_DPI = 300
+# Heading crops are small, so they are rendered sharper than whole pages
+ROI_DPI = 400
+# Points of margin around a detection box, detections tend to clip ascenders and descenders
+ROI_PADDING = 3
+# Unset: up to 4 workers, leaving cores to the layout model
+OCR_WORKERS = int(os.environ["OCR_WORKERS"]) if os.environ.get("OCR_WORKERS") else min(4, os.cpu_count() or 1)
+
+
+class OCREngine:
+    """Line-level OCR with a persistent tesseract where possible.
+
+    tesserocr keeps one initialized TessBaseAPI for the life of the process; without it
+    pytesseract.image_to_data starts a tesseract per image. Either way a line is
+    (text, [x0, y0, x1, y1] in pixels, confidence).
+    """
+
+    def __init__(self, lang="eng"):
+        self.lang = lang
+        try:
+            import tesserocr
+            self._tesserocr = tesserocr
+            self._api = tesserocr.PyTessBaseAPI(lang=lang)
+            self.name = "tesserocr"
+        except ImportError:
+            self._api = None
+            self.name = "pytesseract"
+
+    def lines(self, image, single_block=False):
+        """single_block treats the image as one block of text, right for a cropped heading"""
+        if self._api is not None:
+            return self._lines_tesserocr(image, single_block)
+        return self._lines_pytesseract(image, single_block)
+
+    def _lines_tesserocr(self, image, single_block=False):
+        level = self._tesserocr.RIL.TEXTLINE
+        psm = self._tesserocr.PSM.SINGLE_BLOCK if single_block else self._tesserocr.PSM.AUTO
+        self._api.SetPageSegMode(psm)
+        self._api.SetImage(image)
+        self._api.Recognize()
+        lines = []
+        iterator = self._api.GetIterator()
+        if iterator is None:
+            return lines
+        for item in self._tesserocr.iterate_level(iterator, level):
+            text = (item.GetUTF8Text(level) or "").strip()
+            box = item.BoundingBox(level)
+            if text and box:
+                lines.append((text, list(box), item.Confidence(level)))
+        return lines
+
+    def _lines_pytesseract(self, image, single_block=False):
+        import pytesseract
+
+        config = "--psm 6" if single_block else ""
+        data = pytesseract.image_to_data(image, lang=self.lang, config=config, output_type=pytesseract.Output.DICT)
+        grouped = {}
+        for i, word in enumerate(data["text"]):
+            if not (word or "").strip() or float(data["conf"][i]) < 0:
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            x0, y0 = data["left"][i], data["top"][i]
+            x1, y1 = x0 + data["width"][i], y0 + data["height"][i]
+            if key not in grouped:
+                grouped[key] = {"words": [], "box": [x0, y0, x1, y1], "conf": []}
+            line = grouped[key]
+            line["words"].append(word.strip())
+            line["box"] = [min(line["box"][0], x0), min(line["box"][1], y0),
+                           max(line["box"][2], x1), max(line["box"][3], y1)]
+            line["conf"].append(float(data["conf"][i]))
+        # Tesseract numbers blocks, paragraphs and lines in reading order
+        return [
+            (" ".join(line["words"]), line["box"], sum(line["conf"]) / len(line["conf"]))
+            for _, line in sorted(grouped.items())
+        ]
+
+
+_engine = None
+_ocr_doc = None
+_ocr_doc_source = None
+
+
+def _get_engine():
+    global _engine
+    if _engine is None:
+        _engine = OCREngine()
+    return _engine
+
+
+def _get_document(source):
+    global _ocr_doc, _ocr_doc_source
+    if _ocr_doc_source != source:
+        if _ocr_doc is not None:
+            _ocr_doc.close()
+        _ocr_doc = open_document(source)
+        _ocr_doc_source = source
+    return _ocr_doc
+
+
+def ocr_rendered_page(page, dpi=OCR_DPI):
+    """Render page at dpi and OCR it; returns [(text, bbox in PDF points, confidence)]"""
+    pix = page.get_pixmap(dpi=dpi)
+    image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    to_points = 72 / dpi
+    return [
+        (text, [coord * to_points for coord in box], confidence)
+        for text, box, confidence in _get_engine().lines(image)
+    ]
+
+
+def ocr_regions(page, rects, dpi=ROI_DPI):
+    """OCR only the given rects (PDF points) of page, each cropped from a render at dpi.
+
+    Returns one (text, rect, confidence) per rect that yields text, its lines joined by spaces.
+    """
+    regions = []
+    for rect in rects:
+        clip = (fitz.Rect(rect) + (-ROI_PADDING, -ROI_PADDING, ROI_PADDING, ROI_PADDING)) & page.rect
+        if clip.is_empty:
+            continue
+        pix = page.get_pixmap(dpi=dpi, clip=clip)
+        image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        lines = _get_engine().lines(image, single_block=True)
+        if lines:
+            text = " ".join(text for text, _, _ in lines)
+            confidence = sum(confidence for _, _, confidence in lines) / len(lines)
+            regions.append((text, list(rect), confidence))
+    return regions
+
+
+def ocr_page(source, page_num, dpi=OCR_DPI, pdf_doc=None, rects=None):
+    """(page_num, lines) for one page; workers open source themselves.
+
+    With rects only those regions are read (see ocr_regions), otherwise the whole page.
+    """
+    try:
+        pdf_doc = pdf_doc or _get_document(source)
+        page = pdf_doc.load_page(page_num)
+        if rects:
+            return page_num, ocr_regions(page, rects)
+        return page_num, ocr_rendered_page(page, dpi)
+    except Exception as e:
+        print(f"⚠️ OCR failed on page {page_num+1}: {e}")
+        return page_num, []
+
+
+def _init_ocr_worker():
+    # One tesseract thread per worker, the pool provides the parallelism
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    _get_engine()
+
+
+# Long-lived OCR workers, each with its own engine
+_pool = LazyPool(OCR_WORKERS, initializer=_init_ocr_worker)
+
+
+def shutdown():
+    _pool.shutdown()
+
+
+def uses_workers(page_count):
+    """Whether ocr_pages sends that many pages to the pool; otherwise it doesn't need a source"""
+    return page_count >= 2 and OCR_WORKERS >= 2
+
+
+def ocr_pages(pdf_doc, source, page_nums, dpi=OCR_DPI, regions=None):
+    """{page_num: lines} for pages of the open pdf_doc, whose workers' source is a path or SharedPDF.
+
+    regions maps page numbers to rects (PDF points) to read instead of the whole page.
+    Several pages go to the worker pool; a single page is done in this process
+    on pdf_doc, which is cheaper than waking the pool for it (source may then be None).
+    """
+    page_nums = list(page_nums)
+    regions = regions or {}
+    if not uses_workers(len(page_nums)):
+        return dict(ocr_page(source, page_num, dpi, pdf_doc, regions.get(page_num)) for page_num in page_nums)
+
+    print(f"🔠 OCR of {len(page_nums)} pages on {OCR_WORKERS} workers...")
+    pool = _pool.get()
+    futures = [pool.submit(ocr_page, source, page_num, dpi, None, regions.get(page_num)) for page_num in page_nums]
+    return dict(future.result() for future in futures)
@@ -0,0 +1,158 @@
+# utils/page_context.py
+from collections import OrderedDict
+
+import fitz
+
+from utils.text_index import PageTextIndex
+
+# Character-level indexes kept per document; the compact per-page views are always kept
+DEFAULT_KEEP_INDEXES = 64
+
+
+def render_scale(page_rect, dpi):
+    """PDF points per rendered pixel, from the pixmap size get_pixmap(dpi=dpi) would produce"""
+    zoom = dpi / 72
+    pixel_rect = (page_rect * fitz.Matrix(zoom, zoom)).irect
+    return page_rect.width / pixel_rect.width, page_rect.height / pixel_rect.height
+
+
+class PageContext:
+    """One page's text layer, parsed on first use and shared by every stage reading it.
+
+    The parse is one get_text("dict") for the compact views (spans, non-empty
+    lines, line count). Box lookups go through a PageTextIndex, made on first use.
+    """
+
+    def __init__(self, document, page_num):
+        self.document = document
+        self.page_num = page_num
+        self._rect = None
+        self._spans = None
+        self._lines = None
+        self._line_count = None
+        self._index = None
+
+    @property
+    def page(self):
+        return self.document.pdf_doc.load_page(self.page_num)
+
+    @property
+    def rect(self):
+        if self._rect is None:
+            self._rect = self.document.pdf_doc.load_page(self.page_num).rect
+        return self._rect
+
+    def _parse(self):
+        page = self.page
+        raw = page.get_text("dict")
+        spans = []
+        lines = []
+        line_count = 0
+        for block_no, block in enumerate(raw["blocks"]):
+            if block.get("type") != 0:
+                continue
+            for line in block["lines"]:
+                line_count += 1
+                texts = []
+                for span in line["spans"]:
+                    text = span["text"]
+                    spans.append({"text": text, "size": span["size"], "font": span["font"], "bbox": span["bbox"]})
+                    texts.append(text)
+                text = " ".join(texts).strip()
+                if text:
+                    span0 = line["spans"][0]
+                    lines.append({
+                        "text": text,
+                        "size": span0["size"],
+                        "font": span0["font"],
+                        "bbox": list(line["bbox"]),
+                        "block": block_no,
+                    })
+
+        self._rect = page.rect
+        self._spans, self._lines, self._line_count = spans, lines, line_count
+
+    @property
+    def parsed(self):
+        return self._spans is not None
+
+    def views(self):
+        """The parsed compact views as plain data, to hand to another process"""
+        return tuple(self._rect), self._spans, self._lines, self._line_count
+
+    def load_views(self, views):
+        rect, self._spans, self._lines, self._line_count = views
+        self._rect = fitz.Rect(rect)
+
+    @property
+    def spans(self):
+        """Every text span as {"text", "size", "font", "bbox"}, empty ones included"""
+        if self._spans is None:
+            self._parse()
+        return self._spans
+
+    @property
+    def lines(self):
+        """Non-empty text lines with the font attributes of their first span"""
+        if self._lines is None:
+            self._parse()
+        return self._lines
+
+    @property
+    def line_count(self):
+        """Text lines on the page, empty ones included"""
+        if self._line_count is None:
+            self._parse()
+        return self._line_count
+
+    @property
+    def text_index(self):
+        if self._index is None:
+            self._index = PageTextIndex(self.page)
+            self.document._keep_index(self)
+        return self._index
+
+    def release_index(self):
+        self._index = None
+
+
+class DocumentContext:
+    """PageContexts of one open document.
+
+    Compact views stay for the life of the document. Only the last keep_indexes
+    text indexes are kept, which bounds memory on very long documents; a page whose
+    index was dropped is recorded again if a box lookup needs it.
+
+    views is parsed_views() of a context of the same document in another process,
+    so the pages parsed there are not parsed again here.
+    """
+
+    def __init__(self, pdf_doc, keep_indexes=DEFAULT_KEEP_INDEXES, views=None):
+        self.pdf_doc = pdf_doc
+        self.keep_indexes = keep_indexes
+        self._pages = {}
+        self._indexed = OrderedDict()
+        for page_num, page_views in (views or {}).items():
+            self[page_num].load_views(page_views)
+
+    def __len__(self):
+        return len(self.pdf_doc)
+
+    def __getitem__(self, page_num):
+        if page_num not in self._pages:
+            self._pages[page_num] = PageContext(self, page_num)
+        return self._pages[page_num]
+
+    def parsed_views(self, page_nums=None):
+        """{page_num: compact views} of the pages parsed so far, optionally only page_nums"""
+        return {
+            page_num: page_context.views() for page_num, page_context in self._pages.items()
+            if page_context.parsed and (page_nums is None or page_num in page_nums)
+        }
+
+    def _keep_index(self, page_context):
+        self._indexed[page_context.page_num] = page_context
+        self._indexed.move_to_end(page_context.page_num)
+        while len(self._indexed) > self.keep_indexes:
+            _, evicted = self._indexed.popitem(last=False)
+            evicted.release_index()
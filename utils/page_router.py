@@ -0,0 +1,110 @@
+# utils/page_router.py
+import re
+import statistics
+
+import fitz
+
+# Same heading test StructureAnalysisAgent applies to text-layer lines
+HEADING_PATTERN = re.compile(r'^(\d+[\.\)]?\s*)?([A-Z][a-z]+\s*){1,6}$')
+
+TEXT_LAYER = "text_layer"
+MODEL = "model"
+
+
+def image_coverage(page):
+    """Fraction of the page area covered by placed images"""
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0.0
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return min(1.0, covered / page_area)
+
+
+class PageRouter:
+    """Decides per page whether the text layer is decisive enough to skip layout inference.
+
+    A page goes to the text layer only when it has plenty of spans, is not
+    image-heavy, and its font sizes separate headings from body text. Everything
+    else (scans, posters, flat typography) still goes to the model.
+    """
+
+    def __init__(self, min_spans=20, min_size_spread=2.0, max_image_coverage=0.2):
+        self.min_spans = min_spans
+        self.min_size_spread = min_size_spread
+        self.max_image_coverage = max_image_coverage
+
+    def route(self, page_context):
+        """Returns (TEXT_LAYER or MODEL, reason, lines) for a utils.page_context.PageContext"""
+        lines, span_count = page_context.lines, len(page_context.spans)
+        if not lines or span_count < self.min_spans:
+            return MODEL, f"{span_count} spans", lines
+
+        coverage = image_coverage(page_context.page)
+        if coverage > self.max_image_coverage:
+            return MODEL, f"images cover {coverage:.0%}", lines
+
+        sizes = [line["size"] for line in lines]
+        median_size = statistics.median(sizes)
+        spread = max(sizes) - median_size
+        if spread < self.min_size_spread:
+            return MODEL, f"font size spread {spread:.1f}pt", lines
+
+        if not any(self._is_heading(line, median_size) for line in lines):
+            return MODEL, "no heading candidates", lines
+
+        return TEXT_LAYER, f"{span_count} spans, font size spread {spread:.1f}pt", lines
+
+    def _is_heading(self, line, median_size):
+        font = line["font"].lower()
+        return (
+            line["size"] >= median_size + 1 and
+            len(line["text"]) < 100 and
+            ("bold" in font or "italic" in font or bool(HEADING_PATTERN.match(line["text"])))
+        )
+
+    def elements_from_lines(self, lines, scale, first_page=False):
+        """Model-style elements built from the text layer.
+
+        Consecutive heading lines of one block and size become one title element,
+        the largest heading on the first page becomes the doc_title, everything
+        else is text. Bboxes are converted to rendered pixels like detections.
+        """
+        if not lines:
+            return []
+
+        median_size = statistics.median(line["size"] for line in lines)
+        headings = [line for line in lines if self._is_heading(line, median_size)]
+        title_size = max((line["size"] for line in headings), default=None) if first_page else None
+
+        groups = []
+        for line in lines:
+            label = "text"
+            if self._is_heading(line, median_size):
+                label = "doc_title" if line["size"] == title_size else "paragraph_title"
+
+            last = groups[-1] if groups else None
+            if (last and label != "text" and last["type"] == label and
+                    last["block"] == line["block"] and last["font_size"] == line["size"]):
+                last["lines"].append(line)
+            else:
+                groups.append({"type": label, "block": line["block"], "font_size": line["size"],
+                               "font": line["font"], "lines": [line]})
+
+        scale_x, scale_y = scale
+        elements = []
+        for i, group in enumerate(sorted(groups, key=lambda g: g["lines"][0]["bbox"][1])):
+            x0 = min(line["bbox"][0] for line in group["lines"])
+            y0 = min(line["bbox"][1] for line in group["lines"])
+            x1 = max(line["bbox"][2] for line in group["lines"])
+            y1 = max(line["bbox"][3] for line in group["lines"])
+            elements.append({
+                "id": i + 1,
+                "type": group["type"],
+                "confidence": 1.0,
+                "text": "\n".join(line["text"] for line in group["lines"]),
+                "bbox": [x0 / scale_x, y0 / scale_y, x1 / scale_x, y1 / scale_y],
+                "font_size": group["font_size"],
+                "font": group["font"],
+                "source": TEXT_LAYER
+            })
+        return elements
@@ -0,0 +1,65 @@
+# utils/page_stream.py
+import json
+import os
+import textwrap
+
+_PAGES_PLACEHOLDER = "\u0000pages\u0000"
+
+
+class PageStream:
+    """Append-only NDJSON file with one record per finished page.
+
+    Records are flushed as soon as they are written, so a consumer tailing the
+    file sees pages as they complete. Only the byte offset of each record is
+    kept, which is enough to read the pages back in page order afterwards.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self._file = open(path, "wb")
+
+    def write(self, record):
+        self.offsets[record["page_number"]] = self._file.tell()
+        self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def iter_in_page_order(self):
+        """Records sorted by page number, read back one at a time"""
+        with open(self.path, "rb") as f:
+            for page_number in sorted(self.offsets):
+                f.seek(self.offsets[page_number])
+                yield json.loads(f.readline())
+
+
+def write_json_document(path, document, pages):
+    """Write document with its "pages" list taken from an iterable, one page at a time.
+
+    The file is byte-for-byte what json.dump(..., indent=2, ensure_ascii=False)
+    would write for the same document with the pages filled in.
+    """
+    head, tail = json.dumps({**document, "pages": _PAGES_PLACEHOLDER}, indent=2, ensure_ascii=False).split(
+        json.dumps(_PAGES_PLACEHOLDER, ensure_ascii=False)
+    )
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(head)
+        written = 0
+        for page in pages:
+            f.write("[\n" if written == 0 else ",\n")
+            f.write(textwrap.indent(json.dumps(page, indent=2, ensure_ascii=False), "    "))
+            written += 1
+        f.write("\n  ]" if written else "[]")
+        f.write(tail)
+    os.replace(tmp_path, path)
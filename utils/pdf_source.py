@@ -0,0 +1,55 @@
+# utils/pdf_source.py
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import fitz
+
+# A PDF held in a shared memory block, picklable so it can stand in for a path in worker tasks
+SharedPDF = namedtuple("SharedPDF", ["shm_name", "size"])
+
+
+def open_document(source):
+    """Open a path or a SharedPDF; the shared bytes are copied so the block can go away"""
+    if isinstance(source, SharedPDF):
+        shm = shared_memory.SharedMemory(name=source.shm_name)
+        try:
+            data = bytes(shm.buf[:source.size])
+        finally:
+            shm.close()
+        return fitz.open(stream=data, filetype="pdf")
+    return fitz.open(source)
+
+
+@contextmanager
+def pdf_source(pdf):
+    """(open document, worker source) for PDF bytes, an open fitz.Document or a path.
+
+    Workers open paths themselves. Bytes and documents without a file behind
+    them are copied into shared memory once, instead of being pickled into every
+    task or written to a temp file. Documents passed in are left open.
+    """
+    if isinstance(pdf, fitz.Document):
+        pdf_doc, owned = pdf, False
+        if pdf.name and os.path.isfile(pdf.name) and not pdf.is_dirty:
+            yield pdf_doc, pdf.name
+            return
+        data = pdf.tobytes()
+    elif isinstance(pdf, (bytes, bytearray, memoryview)):
+        data = bytes(pdf)
+        pdf_doc, owned = fitz.open(stream=data, filetype="pdf"), True
+    else:
+        with fitz.open(pdf) as pdf_doc:
+            yield pdf_doc, pdf
+        return
+
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        shm.buf[:len(data)] = data
+        yield pdf_doc, SharedPDF(shm.name, len(data))
+    finally:
+        shm.close()
+        shm.unlink()
+        if owned:
+            pdf_doc.close()
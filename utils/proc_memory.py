@@ -0,0 +1,28 @@
+# utils/proc_memory.py
+
+
+def process_memory(pid):
+    """{"rss", "pss"} of a process in bytes from /proc; pss is None where the kernel doesn't report it.
+
+    RSS counts shared pages in full for every process mapping them, PSS splits
+    them between those processes, so the PSS sum is what the workers really cost.
+    """
+    memory = {"rss": None, "pss": None}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                field, _, value = line.partition(":")
+                if field in ("Rss", "Pss"):
+                    memory[field.lower()] = int(value.split()[0]) * 1024
+        return memory
+    except OSError:
+        pass
+
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return memory
@@ -0,0 +1,151 @@
+# utils/shards.py
+import json
+import os
+import re
+from datetime import timedelta
+
+from utils.columnar import is_columnar, load_results, write_columnar
+
+
+def parse_page_spec(spec, page_count):
+    """'101-200' or '1-10,15,20-' (1-based, inclusive) -> sorted 0-based page numbers"""
+    page_nums = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r"(\d*)\s*-\s*(\d*)|(\d+)", part)
+        if not match:
+            raise ValueError(f"Bad page range '{part}', expected e.g. 101-200")
+        if match.group(3):
+            first = last = int(match.group(3))
+        else:
+            first = int(match.group(1) or 1)
+            last = int(match.group(2) or page_count)
+        if first < 1 or last < first:
+            raise ValueError(f"Bad page range '{part}'")
+        page_nums.update(range(first - 1, min(last, page_count)))
+
+    if not page_nums:
+        raise ValueError(f"Page range '{spec}' selects no pages of a {page_count}-page document")
+    return sorted(page_nums)
+
+
+def page_range_label(page_nums):
+    """Compact 1-based label for a set of pages: [0..99] -> '1-100', [0, 2, 3] -> '1,3-4'"""
+    parts = []
+    start = prev = None
+    for page_num in sorted(page_nums):
+        if start is None:
+            start = prev = page_num
+        elif page_num == prev + 1:
+            prev = page_num
+        else:
+            parts.append(f"{start + 1}" if start == prev else f"{start + 1}-{prev + 1}")
+            start = prev = page_num
+    if start is not None:
+        parts.append(f"{start + 1}" if start == prev else f"{start + 1}-{prev + 1}")
+    return ",".join(parts)
+
+
+def shard_suffix(page_nums, page_count):
+    """Filename part that keeps shards of one document apart; empty for the whole document"""
+    if page_nums is None or list(page_nums) == list(range(page_count)):
+        return ""
+    return "_p" + page_range_label(page_nums).replace(",", "_")
+
+
+def _parse_duration(text):
+    """str(timedelta) back to a timedelta: '2:03:04.5', or '1 day, 2:03:04.5' past 24 hours"""
+    match = re.fullmatch(r"(?:(-?\d+) days?, )?(\d+):(\d{2}):(\d{2}(?:\.\d+)?)", text.strip())
+    if not match:
+        raise ValueError(f"Bad processing_time '{text}', expected e.g. 0:01:02.5 or 1 day, 2:03:04.5")
+    days, hours, minutes, seconds = match.groups()
+    return timedelta(days=int(days or 0), hours=int(hours), minutes=int(minutes), seconds=float(seconds))
+
+
+def merge_shard_results(shards):
+    """Stitch partial results of one document back into the whole-document result.
+
+    Shards must come from the same document, extraction type and dpi, and must
+    not overlap. Pages keep their absolute page_number and come out in page order;
+    processing_time is the slowest shard's, the wall time when they ran side by side.
+    """
+    if not shards:
+        raise ValueError("Nothing to merge")
+
+    first = shards[0]
+    for shard in shards[1:]:
+        for key in ("document", "total_pages", "extraction_type", "dpi"):
+            if shard.get(key) != first.get(key):
+                raise ValueError(f"Shards disagree on {key}: {first.get(key)!r} vs {shard.get(key)!r}")
+
+    pages = []
+    seen = set()
+    for shard in shards:
+        shard_pages = {page["page_number"] for page in shard["pages"]}
+        overlap = seen & shard_pages
+        if overlap:
+            raise ValueError(f"Pages {sorted(overlap)} appear in more than one shard")
+        seen |= shard_pages
+        pages.extend(shard["pages"])
+    pages.sort(key=lambda page: page["page_number"])
+
+    merged = {
+        "document": first["document"],
+        "total_pages": first["total_pages"],
+        "processing_time": str(max(_parse_duration(shard["processing_time"]) for shard in shards)),
+        "extraction_type": first["extraction_type"],
+        "dpi": first["dpi"],
+        "pages": pages
+    }
+
+    if any("routing" in shard for shard in shards):
+        merged["routing"] = {
+            "text_layer_pages": sorted(
+                page_number for shard in shards for page_number in shard.get("routing", {}).get("text_layer_pages", [])
+            ),
+            "model_pages": sum(shard.get("routing", {}).get("model_pages", 0) for shard in shards)
+        }
+
+    # Keep the per-page hashes so the merged result can serve as --previous later
+    if any("page_hashes" in shard for shard in shards):
+        page_hashes = {}
+        for shard in shards:
+            page_hashes.update(shard.get("page_hashes", {}))
+        merged["page_hashes"] = dict(sorted(page_hashes.items(), key=lambda item: int(item[0])))
+
+    covered = set()
+    for shard in shards:
+        covered.update(parse_page_spec(shard.get("page_range") or "1-", first["total_pages"]))
+    missing = [page_num + 1 for page_num in range(first["total_pages"]) if page_num not in covered]
+    return merged, missing
+
+
+def merge_shard_files(shard_paths, output_dir="output"):
+    """Merge shard files into <name>_all_elements_results.json / _titles_only_results.json.
+
+    Columnar shards (see utils/columnar.py) give a columnar merged result.
+    Shards are grouped by extraction type, so all-elements and titles-only shards
+    can be passed together. Returns {extraction_type: (merged_path, missing_pages)}.
+    """
+    groups = {}
+    columnar = False
+    for path in shard_paths:
+        shard = load_results(path)
+        columnar = columnar or is_columnar(path)
+        groups.setdefault(shard.get("extraction_type", "all_elements"), []).append(shard)
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = {}
+    for extraction_type, shards in groups.items():
+        merged, missing = merge_shard_results(shards)
+        pdf_filename = os.path.splitext(os.path.basename(merged["document"]))[0]
+        if columnar:
+            merged_path = write_columnar(os.path.join(output_dir, f"{pdf_filename}_{extraction_type}_results.cols"), merged)
+        else:
+            merged_path = os.path.join(output_dir, f"{pdf_filename}_{extraction_type}_results.json")
+            with open(merged_path, "w", encoding="utf-8") as f:
+                json.dump(merged, f, indent=2, ensure_ascii=False)
+        written[extraction_type] = (merged_path, missing)
+    return written
@@ -0,0 +1,67 @@
+# utils/text_index.py
+import pymupdf
+
+try:
+    from pymupdf import mupdf
+except ImportError:
+    mupdf = None
+
+# Cleared when this PyMuPDF's low-level bindings can't build the text page, see _get_text
+_REPLAY = mupdf is not None
+
+
+class PageTextIndex:
+    """Box text lookups on one page, recording the page once.
+
+    page.get_text("text", clip=rect) interprets the whole page again for every
+    box. Here the page is drawn once into a display list, and each query replays
+    it into a text page bounded by the box, with MuPDF skipping everything that
+    lies outside. The text page is built the way get_text(clip=) builds it, so
+    the output has MuPDF's line and block breaks and the characters it keeps at
+    the box edges. Only spaces can differ: the display list doesn't record some
+    space runs, so a line of blanks or a space at a line end may be missing.
+
+    The replay uses PyMuPDF's low-level mupdf bindings. Where they don't fit
+    this PyMuPDF version, every box falls back to get_text(clip=).
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.rect = page.rect
+        self._display_list = None
+
+    def _textpage(self, rect, flags):
+        if self._display_list is None:
+            self._display_list = self.page.get_displaylist()
+        area = mupdf.FzRect(*rect)
+        stext = mupdf.FzStextPage(area)
+        device = mupdf.fz_new_stext_device(stext, mupdf.FzStextOptions(flags))
+        mupdf.fz_run_display_list(self._display_list.this, device, mupdf.FzMatrix(), area, mupdf.FzCookie())
+        mupdf.fz_close_device(device)
+        textpage = pymupdf.TextPage(stext)
+        textpage.parent = self.page
+        return textpage
+
+    def _get_text(self, option, rect):
+        global _REPLAY
+        # get_textpage un-rotates the page first; rotated pages take that path
+        if self.page.rotation or not _REPLAY:
+            return self.page.get_text(option, clip=rect)
+        flags = pymupdf.TEXTFLAGS_BLOCKS if option == "blocks" else pymupdf.TEXTFLAGS_TEXT
+        try:
+            textpage = self._textpage(rect, flags)
+        except (AttributeError, TypeError) as e:
+            print(f"⚠️ Text index unavailable with PyMuPDF {pymupdf.VersionBind} ({e}), extracting text per box")
+            _REPLAY = False
+            return self.page.get_text(option, clip=rect)
+        return self.page.get_text(option, textpage=textpage)
+
+    def query(self, rect):
+        """get_text("text", clip=rect), falling back to the clip's text blocks when that is blank"""
+        rect = tuple(pymupdf.Rect(rect))
+        text = self._get_text("text", rect)
+        if not text or not text.strip():
+            text_blocks = self._get_text("blocks", rect)
+            if text_blocks:
+                text = " ".join([block[4] for block in text_blocks if len(block) > 4])
+        return text
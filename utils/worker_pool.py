@@ -0,0 +1,34 @@
+# utils/worker_pool.py
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+
+
+class LazyPool:
+    """Spawned worker processes started on first use, kept for the life of the process
+    and shut down at exit.
+
+    The pools are also used from the agent worker process, where atexit never runs and
+    exit would wait on the idle workers, so shutdown is a multiprocessing finalizer. It
+    runs ahead of the queues' own finalizers, which would stop the workers' sentinels.
+    """
+
+    def __init__(self, max_workers, initializer=None):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self._executor = None
+        self._registered = False
+
+    def get(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp.get_context("spawn"),
+                                                 initializer=self.initializer)
+            if not self._registered:
+                Finalize(None, self.shutdown, exitpriority=100)
+                self._registered = True
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None